@@ -1,3 +1,4 @@
+import contextlib
 import sys
 from datetime import datetime
 import time
@@ -12,6 +13,7 @@ from encyc import docstore
 from encyc import http
 from encyc import publish
 from encyc import wiki
+from encyc.models.helpers import PARSERS
 from encyc.repo_models import ELASTICSEARCH_CLASSES
 
 SOURCES_API = config.SOURCES_API
@@ -183,7 +185,10 @@ def mappings(hosts, indices):
 @click.option('--force', is_flag=True,
               help='Forcibly update records whether they need it or not.')
 def vocabs(hosts, report, dryrun, force):
-    """TODO Index DDR vocabulary facets and terms.
+    """Index DDR vocabulary facets and terms.
+    
+    Only facets whose vocab JSON has changed since it was last indexed are
+    updated (use --force to update all).
     """
     ds = get_docstore(hosts)
     check_es_status(ds)
@@ -199,16 +204,45 @@ def vocabs(hosts, report, dryrun, force):
 @click.option('--force', is_flag=True,
               help='Forcibly update records whether they need it or not.')
 @click.option('--title', help='Single author to publish.')
-def authors(hosts, report, dryrun, force, title):
+@click.option('--verify-sample', default=config.PUBLISH_VERIFY_SAMPLE, type=float,
+              help='Read back this fraction (0.0-1.0) of saved documents.')
+@click.option('--parser', default=config.HTML_PARSER, type=click.Choice(PARSERS),
+              help='HTML parser used to render pages.')
+@click.option('--incremental', '-i', is_flag=True,
+              help='Only publish titles changed since the last run.')
+@click.option('--resume', is_flag=True,
+              help='Skip titles completed by an interrupted run.')
+@click.option('--run-id', help='Run ID for the resume journal (default: last run).')
+@click.option('--rebuild', is_flag=True,
+              help='Turn off refresh and replicas while indexing (see core.cfg).')
+def authors(hosts, report, dryrun, force, title, verify_sample, parser,
+            incremental, resume, run_id, rebuild):
     """Index authors.
+    
+    \b
+    With --incremental, only authors edited, created, or moved since the last
+    completed run are published.  Falls back to a full comparison if there is
+    no record of a previous run or it is too old.
+    
+    \b
+    Completed authors are recorded in a journal.  If a run is interrupted,
+    --resume skips the ones it finished.
+    
+    \b
+    --rebuild turns off index refresh and replicas for the run, then
+    restores them ([elasticsearch] refresh_interval, number_of_replicas).
+    Use it for full reindexing, e.g. with --force into a new index.
     """
     ds = get_docstore(hosts)
     check_es_status(ds)
     check_es_index(ds, 'author')
     check_mediawiki_status()
-    publish.authors(
-        ds, report=report, dryrun=dryrun, force=force, title=title
-    )
+    with rebuilding(ds, 'author', rebuild and not dryrun):
+        publish.authors(
+            ds, report=report, dryrun=dryrun, force=force, title=title,
+            verify_sample=verify_sample, parser=parser, incremental=incremental,
+            resume=resume, run_id=run_id,
+        )
 
 
 @encyc.command()
@@ -220,16 +254,149 @@ def authors(hosts, report, dryrun, force, title):
 @click.option('--force', is_flag=True,
               help='Forcibly update records whether they need it or not.')
 @click.option('--title', help='Single article to publish.')
-def articles(hosts, report, dryrun, force, title):
+@click.option('--workers', '-w', default=config.PUBLISH_WORKERS, type=int,
+              help='Worker threads for the render and index stages.')
+@click.option('--fetch-concurrency', '-f', default=config.PUBLISH_FETCH_CONCURRENCY, type=int,
+              help='Articles fetched from MediaWiki at a time.')
+@click.option('--render-processes', '-p', default=config.RENDER_PROCESSES, type=int,
+              help='Render pages in a pool of worker processes (0 = off).')
+@click.option('--verify-sample', default=config.PUBLISH_VERIFY_SAMPLE, type=float,
+              help='Read back this fraction (0.0-1.0) of saved documents.')
+@click.option('--parser', default=config.HTML_PARSER, type=click.Choice(PARSERS),
+              help='HTML parser used to render pages.')
+@click.option('--incremental', '-i', is_flag=True,
+              help='Only publish titles changed since the last run.')
+@click.option('--resume', is_flag=True,
+              help='Skip titles completed by an interrupted run.')
+@click.option('--run-id', help='Run ID for the resume journal (default: last run).')
+@click.option('--rebuild', is_flag=True,
+              help='Turn off refresh and replicas while indexing (see core.cfg).')
+def articles(hosts, report, dryrun, force, title, workers, fetch_concurrency,
+             render_processes, verify_sample, parser, incremental, resume,
+             run_id, rebuild):
     """Index articles.
+    
+    \b
+    With --workers or --fetch-concurrency greater than 1, articles are
+    fetched, rendered, and indexed in a pipeline: up to --fetch-concurrency
+    articles are fetched at a time, and render and index each have a pool
+    of --workers threads.
+    
+    \b
+    With --render-processes the CPU-heavy HTML parsing is done in a pool of
+    worker processes.  Use at least as many --workers as render processes.
+    
+    \b
+    --parser lxml builds page trees with lxml (faster); --parser lxml-verify
+    renders with both parsers and keeps the html.parser result if they differ.
+    
+    \b
+    With --incremental, only articles changed (edited, moved, or added to
+    or removed from a category) since the last completed run are published.
+    Falls back to a full comparison if there is no record of a previous run
+    or it is too old ([publish] incremental_max_hours).
+    
+    \b
+    Completed articles are recorded in a journal.  If a run is interrupted,
+    --resume skips the ones it finished.
+    
+    \b
+    --rebuild turns off index refresh and replicas for the run, then
+    restores them ([elasticsearch] refresh_interval, number_of_replicas).
+    Use it for full reindexing, e.g. with --force into a new index.
     """
     ds = get_docstore(hosts)
     check_es_status(ds)
     check_es_index(ds, 'article')
     check_psms_status()
     check_mediawiki_status()
-    publish.articles(
-        ds, report=report, dryrun=dryrun, force=force, title=title
+    with rebuilding(ds, 'article', rebuild and not dryrun):
+        publish.articles(
+            ds, report=report, dryrun=dryrun, force=force, title=title,
+            workers=workers, fetch_concurrency=fetch_concurrency,
+            render_processes=render_processes, verify_sample=verify_sample,
+            parser=parser, incremental=incremental, resume=resume, run_id=run_id,
+        )
+
+
+@encyc.command()
+@click.option('--hosts', default=config.DOCSTORE_HOST, help='Elasticsearch hosts.')
+@click.option('--version', 'version', type=int,
+              help='Version to build (default: next).  With --resume, finish it.')
+@click.option('--resume', is_flag=True,
+              help='Skip documents completed by an interrupted build.')
+@click.option('--no-swap', is_flag=True,
+              help='Build but leave the aliases alone.')
+@click.option('--swap', 'swap_to', type=int,
+              help='Only point the aliases at this existing version (rollback).')
+@click.option('--migrate', is_flag=True,
+              help='Replace non-versioned indices (from "encyc create") with aliases.')
+@click.option('--workers', '-w', default=config.PUBLISH_WORKERS, type=int,
+              help='Worker threads for the render and index stages.')
+@click.option('--fetch-concurrency', '-f', default=config.PUBLISH_FETCH_CONCURRENCY, type=int,
+              help='Articles fetched from MediaWiki at a time.')
+@click.option('--render-processes', '-p', default=config.RENDER_PROCESSES, type=int,
+              help='Render pages in a pool of worker processes (0 = off).')
+@click.option('--parser', default=config.HTML_PARSER, type=click.Choice(PARSERS),
+              help='HTML parser used to render pages.')
+def reindex(hosts, version, resume, no_swap, swap_to, migrate, workers,
+            fetch_concurrency, render_processes, parser):
+    """Rebuild all indices without taking the site down.
+    
+    \b
+    Builds new versioned indices (encycarticle-v7 etc) for all doctypes,
+    filling them in parallel, then moves the aliases the site reads from
+    (encycarticle etc) to them in one atomic request.  Old versions are
+    kept: "encyc reindex --swap 6" rolls back instantly.
+    
+    \b
+    The first time, the site still reads non-versioned indices created by
+    "encyc create"; --migrate replaces them when the aliases are swapped in,
+    keeping a copy as v0 ("encyc reindex --swap 0").
+    """
+    ds = get_docstore(hosts)
+    check_es_status(ds)
+    if swap_to is not None:
+        publish.swap_version(ds, swap_to, migrate=migrate)
+        return
+    check_psms_status()
+    check_mediawiki_status()
+    publish.reindex(
+        ds, version=version, swap=not no_swap, migrate=migrate, resume=resume,
+        workers=workers, fetch_concurrency=fetch_concurrency,
+        render_processes=render_processes, parser=parser,
+    )
+
+
+@encyc.command()
+@click.option('--hosts', default=config.DOCSTORE_HOST, help='Elasticsearch hosts.')
+@click.option('--dryrun', is_flag=True,
+              help='perform a trial run with no changes made')
+@click.option('--title', help='Single article to rerender.')
+@click.option('--workers', '-w', default=config.PUBLISH_WORKERS, type=int,
+              help='Worker threads for the render and index stages.')
+@click.option('--render-processes', '-p', default=config.RENDER_PROCESSES, type=int,
+              help='Render pages in a pool of worker processes (0 = off).')
+@click.option('--verify-sample', default=config.PUBLISH_VERIFY_SAMPLE, type=float,
+              help='Read back this fraction (0.0-1.0) of saved documents.')
+@click.option('--parser', default=config.HTML_PARSER, type=click.Choice(PARSERS),
+              help='HTML parser used to render pages.')
+def rerender(hosts, dryrun, title, workers, render_processes, verify_sample, parser):
+    """Re-render articles from cached page data.
+    
+    \b
+    Applies changes to hidden tags, databoxes, or link marking to published
+    articles without fetching anything from MediaWiki.  Only articles in the
+    page data cache ([mediawiki] pagedata_cache_dir) are rerendered; use
+    "encyc articles" for new or edited articles.
+    """
+    ds = get_docstore(hosts)
+    check_es_status(ds)
+    check_es_index(ds, 'article')
+    publish.rerender(
+        ds, dryrun=dryrun, title=title, workers=workers,
+        render_processes=render_processes, verify_sample=verify_sample,
+        parser=parser,
     )
 
 
@@ -242,17 +409,36 @@ def articles(hosts, report, dryrun, force, title):
 @click.option('--force', is_flag=True,
               help='Forcibly update records whether they need it or not.')
 @click.option('--sourceid', help='Single article to publish.')
-def sources(hosts, report, dryrun, force, sourceid):
+@click.option('--verify-sample', default=config.PUBLISH_VERIFY_SAMPLE, type=float,
+              help='Read back this fraction (0.0-1.0) of saved documents.')
+@click.option('--resume', is_flag=True,
+              help='Skip titles completed by an interrupted run.')
+@click.option('--run-id', help='Run ID for the resume journal (default: last run).')
+@click.option('--rebuild', is_flag=True,
+              help='Turn off refresh and replicas while indexing (see core.cfg).')
+def sources(hosts, report, dryrun, force, sourceid, verify_sample, resume,
+            run_id, rebuild):
     """Index sources.
+    
+    \b
+    Completed sources are recorded in a journal.  If a run is interrupted,
+    --resume skips the ones it finished.
+    
+    \b
+    --rebuild turns off index refresh and replicas for the run, then
+    restores them ([elasticsearch] refresh_interval, number_of_replicas).
+    Use it for full reindexing, e.g. with --force into a new index.
     """
     ds = get_docstore(hosts)
     check_es_status(ds)
     check_es_index(ds, 'source')
     check_psms_status()
     check_mediawiki_status()
-    publish.sources(
-        ds, report=report, dryrun=dryrun, force=force, psms_id=sourceid
-    )
+    with rebuilding(ds, 'source', rebuild and not dryrun):
+        publish.sources(
+            ds, report=report, dryrun=dryrun, force=force, psms_id=sourceid,
+            verify_sample=verify_sample, resume=resume, run_id=run_id,
+        )
 
 
 @encyc.command()
@@ -438,6 +624,15 @@ def check_es_status(ds):
         click.echo(f'ERROR: Elasticsearch {err}')
         sys.exit(1)
 
+def rebuilding(ds, doctype, rebuild):
+    """Bulk-load index settings for the command if rebuild
+    
+    See docstore.DocstoreManager.rebuilding.
+    """
+    if rebuild:
+        return ds.rebuilding([doctype])
+    return contextlib.nullcontext()
+
 def check_es_index(ds, doctype):
     """Quit with message if Elasticssearch index not present
     """
@@ -40,6 +40,11 @@ DOCSTORE_SSL_CERTFILE = config.get('elasticsearch', 'docstore_ssl_certfile')
 DOCSTORE_USERNAME = 'elastic'
 DOCSTORE_PASSWORD = config.get('elasticsearch', 'docstore_password')
 DOCSTORE_TIMEOUT = int(config.get('elasticsearch','docstore_timeout'))
+DOCSTORE_BULK_CHUNK_SIZE = config.getint('elasticsearch', 'bulk_chunk_size', fallback=500)
+DOCSTORE_BULK_MAX_BYTES = config.getint('elasticsearch', 'bulk_max_bytes', fallback=10485760)
+DOCSTORE_REFRESH_INTERVAL = config.get('elasticsearch', 'refresh_interval', fallback='1s')
+DOCSTORE_NUMBER_OF_REPLICAS = config.getint('elasticsearch', 'number_of_replicas', fallback=1)
+DOCSTORE_FORCEMERGE_SEGMENTS = config.getint('elasticsearch', 'forcemerge_segments', fallback=0)
 
 # mediawiki
 MEDIAWIKI_SCHEME = config.get('mediawiki', 'scheme')
@@ -59,9 +64,27 @@ except:
     raise Exception('mediawiki.databox format: "MWDIVID:PREFIX;MWDIVID:PREFIX"')
 MEDIAWIKI_HIDDEN_CATEGORIES = config.get('mediawiki', 'hidden_categories').split(',')
 MEDIAWIKI_SHOW_UNPUBLISHED = config.getboolean('mediawiki', 'show_unpublished')
+HTML_PARSER = config.get('mediawiki', 'html_parser', fallback='html.parser')
+PAGEDATA_CACHE_DIR = config.get('mediawiki', 'pagedata_cache_dir', fallback='/var/lib/encyc-core/pagedata')
+PAGEDATA_CACHE_MAX_MB = config.getint('mediawiki', 'pagedata_cache_max_mb', fallback=2048)
 MEDIAWIKI_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 MEDIAWIKI_DATETIME_FORMAT_TZ = '%Y-%m-%dT%H:%M:%SZ'
 
+# http
+HTTP_CONCURRENCY = config.getint('http', 'concurrency', fallback=32)
+HTTP_PER_HOST = config.getint('http', 'per_host', fallback=8)
+HTTP_POOL_MAXSIZE = config.getint('http', 'pool_maxsize', fallback=10)
+
+# publish
+PUBLISH_WORKERS = config.getint('publish', 'workers', fallback=1)
+PUBLISH_FETCH_CONCURRENCY = config.getint('publish', 'fetch_concurrency', fallback=1)
+RENDER_PROCESSES = config.getint('publish', 'render_processes', fallback=0)
+RENDER_TIMEOUT = config.getint('publish', 'render_timeout', fallback=120)
+RENDER_MAXTASKS = config.getint('publish', 'render_maxtasks', fallback=200)
+PUBLISH_VERIFY_SAMPLE = config.getfloat('publish', 'verify_sample', fallback=0)
+PUBLISH_STATE_DIR = config.get('publish', 'state_dir', fallback='/var/lib/encyc-core')
+PUBLISH_INCREMENTAL_MAX_HOURS = config.getint('publish', 'incremental_max_hours', fallback=168)
+
 
 # citations
 AUTHORS_DEFAULT = 'Densho Encyclopedia contributors.'
@@ -84,6 +107,7 @@ try:
     SOURCES_API_HTPASS = config.get('sources', 'api_htpass')
 except:
     SOURCES_API_HTPASS = None
+SOURCES_MIRROR_PATH = config.get('sources', 'mirror_path', fallback='/var/lib/encyc-core/sources.json')
 SOURCES_BASE = config.get('sources', 'local_base')
 SOURCES_URL = config.get('sources', 'source_url')
 SOURCES_DEST = config.get('sources', 'remote_dest')
@@ -157,5 +181,33 @@ def read_hidden_tags(config):
 
 # hide tags with the given attrib=selector
 HIDDEN_TAGS = read_hidden_tags(config)
+
+# Sample core.cfg:
+#
+#   [index:article]
+#   number_of_replicas=2
+#   forcemerge_segments=1
+#
+def read_index_settings(config):
+    """Index settings for each doctype, with per-doctype overrides
+    """
+    settings = {}
+    for doctype in ['author', 'article', 'source', 'facet', 'facetterm']:
+        section = 'index:%s' % doctype
+        settings[doctype] = {
+            'refresh_interval': config.get(
+                section, 'refresh_interval', fallback=DOCSTORE_REFRESH_INTERVAL
+            ),
+            'number_of_replicas': config.getint(
+                section, 'number_of_replicas', fallback=DOCSTORE_NUMBER_OF_REPLICAS
+            ),
+            'forcemerge_segments': config.getint(
+                section, 'forcemerge_segments', fallback=DOCSTORE_FORCEMERGE_SEGMENTS
+            ),
+        }
+    return settings
+
+# settings restored after a bulk rebuild (see docstore.DocstoreManager.rebuilding)
+DOCSTORE_INDEX_SETTINGS = read_index_settings(config)
 # display comment for each hidden tag
 HIDDEN_TAG_COMMENTS = True
@@ -20,9 +20,15 @@ d.delete(os.path.basename(PATH), recursive=True)
 ------------------------------------------------------------------------
 """
 
+from contextlib import contextmanager
+import copy
 import json
 import logging
 logger = logging.getLogger(__name__)
+import re
+import threading
+
+from elasticsearch.helpers import streaming_bulk
 
 from elastictools import docstore
 from elastictools.docstore import elasticsearch_dsl
@@ -35,6 +41,15 @@ from encyc.repo_models import MODEL_REPO_MODELS
 
 INDEX_PREFIX = 'encyc'
 
+# versioned indices for reindex (see DocstoreManager.versioned)
+VERSION_SUFFIX = '-v%s'
+# non-versioned indices are kept as this version when migrated
+ORIGINAL_VERSION = 0
+VERSION_PATTERN = re.compile(r'^(.+)-v(\d+)$')
+
+# index settings while bulk loading (see DocstoreManager.rebuilding)
+REBUILD_SETTINGS = {'refresh_interval': '-1', 'number_of_replicas': 0}
+
 
 def load_json(path):
     try:
@@ -44,6 +59,15 @@ def load_json(path):
     return data
 
 
+def _live_settings(settings):
+    """Index settings from a DOCSTORE_INDEX_SETTINGS item
+    """
+    return {
+        'refresh_interval': settings['refresh_interval'],
+        'number_of_replicas': settings['number_of_replicas'],
+    }
+
+
 class Docstore(docstore.Docstore):
 
     def __init__(self, index_prefix, host, settings):
@@ -51,16 +75,178 @@ class Docstore(docstore.Docstore):
 
 
 class DocstoreManager(docstore.DocstoreManager):
+    # appended to index names (see versioned)
+    index_suffix = ''
 
     def __init__(self, index_prefix, host, settings):
         super(DocstoreManager, self).__init__(index_prefix, host, settings)
 
+    def index_name(self, doctype):
+        return super(DocstoreManager, self).index_name(doctype) + self.index_suffix
+
+    def versioned(self, version):
+        """Copy of this DocstoreManager that reads and writes the indices of
+        a reindex version (e.g. encycarticle-v7) instead of the aliases
+        
+        @param version: int
+        @returns: DocstoreManager
+        """
+        ds = copy.copy(self)
+        ds.index_suffix = VERSION_SUFFIX % version
+        return ds
+
+    def index_versions(self):
+        """Versioned indices and the version each alias points to
+        
+        @returns: (dict {version: [doctypes]}, dict {doctype: version or None})
+        """
+        doctypes = {
+            self.index_name(item['doctype']): item['doctype']
+            for item in ELASTICSEARCH_CLASSES['all']
+        }
+        versions = {}
+        live = {doctype: None for doctype in doctypes.values()}
+        for index,data in self.es.indices.get_alias(index='%s*' % self.index_name('')).items():
+            match = VERSION_PATTERN.match(index)
+            if not (match and match.group(1) in doctypes):
+                continue
+            doctype,version = doctypes[match.group(1)], int(match.group(2))
+            versions.setdefault(version, []).append(doctype)
+            if match.group(1) in data.get('aliases', {}):
+                live[doctype] = version
+        return versions,live
+
+    def create_versioned_indices(self, version):
+        """Create empty indices for all doctypes for a reindex version
+        
+        @param version: int
+        @returns: list of index names
+        """
+        ds = self.versioned(version)
+        indices = []
+        for item in ELASTICSEARCH_CLASSES['all']:
+            index = ds.index_name(item['doctype'])
+            item['class'].init(index=index, using=self.es)
+            self.es.indices.put_settings(
+                index=index,
+                settings={'index': _live_settings(
+                    config.DOCSTORE_INDEX_SETTINGS[item['doctype']]
+                )}
+            )
+            indices.append(index)
+        return indices
+
+    def swap_aliases(self, version, migrate=False):
+        """Point the aliases of all doctypes at a reindex version, atomically
+        
+        Indices of other versions are left in place for rollback.  An alias
+        cannot have the same name as an index: a non-versioned index (from
+        create_indices) is only removed, in the same request, if migrate.
+        It is first cloned to ORIGINAL_VERSION (e.g. encycarticle-v0) so it
+        can be swapped back in.
+        
+        @param version: int
+        @param migrate: bool Remove non-versioned indices.
+        @returns: list of alias actions
+        """
+        actions = []
+        for item in ELASTICSEARCH_CLASSES['all']:
+            alias = self.index_name(item['doctype'])
+            index = self.versioned(version).index_name(item['doctype'])
+            if self.es.indices.exists_alias(name=alias):
+                for old in self.es.indices.get_alias(name=alias):
+                    if old != index:
+                        actions.append({'remove': {'index': old, 'alias': alias}})
+            elif self.es.indices.exists(index=alias):
+                if not migrate:
+                    raise Exception(
+                        '"%s" is an index, not an alias (use --migrate)' % alias
+                    )
+                logger.debug('cloned %s' % self._keep_original(item['doctype']))
+                actions.append({'remove_index': {'index': alias}})
+            actions.append({'add': {'index': index, 'alias': alias}})
+        self.es.indices.update_aliases(actions=actions)
+        return actions
+
+    def _keep_original(self, doctype):
+        """Clone a non-versioned index to ORIGINAL_VERSION before migrate
+        
+        The source index must be read-only while it is cloned; writes are
+        allowed again afterwards.  An existing clone is kept.
+        
+        @param doctype: str
+        @returns: str index name
+        """
+        source = self.index_name(doctype)
+        index = self.versioned(ORIGINAL_VERSION).index_name(doctype)
+        if self.es.indices.exists(index=index):
+            return index
+        self.es.indices.add_block(index=source, block='write')
+        try:
+            self.es.indices.clone(
+                index=source, target=index,
+                settings={'index.blocks.write': False},
+            )
+        finally:
+            self.es.indices.put_settings(
+                index=source, settings={'index.blocks.write': False}
+            )
+        return index
+
     def create_indices(self):
-        return super(DocstoreManager,self).create_indices(ELASTICSEARCH_CLASSES['all'])
+        result = super(DocstoreManager,self).create_indices(ELASTICSEARCH_CLASSES['all'])
+        for item in ELASTICSEARCH_CLASSES['all']:
+            settings = config.DOCSTORE_INDEX_SETTINGS[item['doctype']]
+            self.es.indices.put_settings(
+                index=self.index_name(item['doctype']),
+                settings={'index': _live_settings(settings)}
+            )
+        return result
+
+    @contextmanager
+    def rebuilding(self, doctypes):
+        """Bulk-load settings for the duration of a rebuild
+        
+        Turns off refresh and replicas for the doctypes' indices.  On exit
+        the configured settings (DOCSTORE_INDEX_SETTINGS) are restored, each
+        index is refreshed once and force-merged if forcemerge_segments.
+        
+        >>> with ds.rebuilding(['article']):
+        ...     publish.articles(ds, force=True)
+        
+        @param doctypes: list of str e.g. ['article']
+        """
+        for doctype in doctypes:
+            logger.debug('rebuilding %s' % self.index_name(doctype))
+            self.es.indices.put_settings(
+                index=self.index_name(doctype),
+                settings={'index': REBUILD_SETTINGS}
+            )
+        try:
+            yield self
+        finally:
+            for doctype in doctypes:
+                index = self.index_name(doctype)
+                settings = config.DOCSTORE_INDEX_SETTINGS[doctype]
+                self.es.indices.put_settings(
+                    index=index, settings={'index': _live_settings(settings)}
+                )
+                self.es.indices.refresh(index=index)
+                if settings['forcemerge_segments']:
+                    self.es.indices.forcemerge(
+                        index=index,
+                        max_num_segments=settings['forcemerge_segments']
+                    )
+                logger.debug('rebuilt %s' % index)
 
     def delete_indices(self):
         return super(DocstoreManager,self).delete_indices(ELASTICSEARCH_CLASSES['all'])
 
+    def bulk_writer(self, **kwargs):
+        """BulkWriter for this docstore (see BulkWriter for kwargs)
+        """
+        return BulkWriter(self, **kwargs)
+
     def post(self, document, public_fields=[], additional_fields={}, force=False):
         """Add a new document to an index or update an existing one.
         
@@ -112,6 +298,190 @@ class DocstoreManager(docstore.DocstoreManager):
         return results
 
 
+class BulkWriter():
+    """Buffers documents and writes them with the Elasticsearch _bulk API.
+    
+    Documents are sent when the buffer reaches chunk_size documents or
+    roughly max_chunk_bytes, and on flush/close.  An item is ok only if the
+    bulk response says it was written (result) with no failed shards, so
+    there is no need to read documents back.  Each item in the bulk
+    response is passed to callback as a dict:
+    
+        {'doctype', 'id', 'action', 'ok', 'status', 'result', 'shards', 'error'}
+    
+    and failed items are kept in BulkWriter.failed.  Safe to use from
+    several threads.
+    
+    >>> with ds.bulk_writer(callback=print) as writer:
+    ...     for page in pages:
+    ...         writer.index('article', page)
+    >>> writer.failed
+    
+    @param docstore: DocstoreManager
+    @param chunk_size: int Max documents per bulk request.
+    @param max_chunk_bytes: int Max (approximate) size of a bulk request.
+    @param callback: function Called with the result of each item.
+    """
+    
+    def __init__(self, docstore,
+                 chunk_size=config.DOCSTORE_BULK_CHUNK_SIZE,
+                 max_chunk_bytes=config.DOCSTORE_BULK_MAX_BYTES,
+                 callback=None):
+        self.docstore = docstore
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.callback = callback
+        self.num_ok = 0
+        self.failed = []
+        self._actions = []
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._doctypes = {}
+
+    def __repr__(self):
+        return '<%s.%s %s ok, %s failed>' % (
+            self.__module__, self.__class__.__name__,
+            self.num_ok, len(self.failed)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _index_name(self, doctype):
+        index = self.docstore.index_name(doctype)
+        self._doctypes[index] = doctype
+        return index
+
+    def _doctype(self, index):
+        # writes through an alias come back with the versioned index name
+        if index not in self._doctypes:
+            match = VERSION_PATTERN.match(index or '')
+            if match:
+                index = match.group(1)
+        return self._doctypes.get(index)
+
+    def index(self, doctype, document):
+        """Add or replace a document.
+        
+        @param doctype: str e.g. 'article'
+        @param document: elasticsearch_dsl.Document
+        """
+        # same validation as Document.save
+        document.full_clean()
+        self._add({
+            '_op_type': 'index',
+            '_index': self._index_name(doctype),
+            '_id': document.meta.id,
+            '_source': document.to_dict(),
+        })
+
+    def update(self, doctype, document_id, fields):
+        """Change some fields of an existing document.
+        
+        @param doctype: str e.g. 'article'
+        @param document_id: str
+        @param fields: dict
+        """
+        self._add({
+            '_op_type': 'update',
+            '_index': self._index_name(doctype),
+            '_id': document_id,
+            'doc': fields,
+        })
+
+    def delete(self, doctype, document_id):
+        """Delete a document.
+        
+        @param doctype: str e.g. 'article'
+        @param document_id: str
+        """
+        self._add({
+            '_op_type': 'delete',
+            '_index': self._index_name(doctype),
+            '_id': document_id,
+        })
+
+    def _add(self, action):
+        size = len(json.dumps(
+            action.get('_source', action.get('doc', {})), default=str
+        ))
+        with self._lock:
+            self._actions.append(action)
+            self._bytes += size
+            full = (len(self._actions) >= self.chunk_size) \
+                or (self._bytes >= self.max_chunk_bytes)
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Send buffered documents.
+        
+        @returns: list of item result dicts
+        """
+        with self._lock:
+            actions = self._actions
+            self._actions = []
+            self._bytes = 0
+        if not actions:
+            return []
+        logger.debug('bulk %s actions' % len(actions))
+        results = []
+        for ok,item in streaming_bulk(
+                self.docstore.es, actions,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                raise_on_error=False,
+                raise_on_exception=False,
+                max_retries=3,
+        ):
+            action,data = list(item.items())[0]
+            result = {
+                'doctype': self._doctype(data.get('_index')),
+                'id': data.get('_id'),
+                'action': action,
+                'ok': ok and _bulk_item_written(action, data),
+                'status': data.get('status'),
+                'result': data.get('result'),
+                'shards': data.get('_shards', {}),
+                'error': data.get('error'),
+            }
+            with self._lock:
+                if result['ok']:
+                    self.num_ok += 1
+                else:
+                    self.failed.append(result)
+            if self.callback:
+                self.callback(result)
+            results.append(result)
+        return results
+
+    def close(self):
+        return self.flush()
+
+def _bulk_item_written(action, data):
+    """Check the result and shard status of one item in a _bulk response
+    
+    @param action: str 'index', 'delete', etc
+    @param data: dict
+    @returns: bool
+    """
+    if action == 'delete':
+        results = ['deleted', 'not_found']
+    else:
+        results = ['created', 'updated', 'noop']
+    if data.get('result') not in results:
+        return False
+    if data['result'] == 'noop':
+        return True
+    shards = data.get('_shards', {})
+    if shards.get('failed') or (shards.get('successful', 1) < 1):
+        return False
+    return True
+
+
 def make_index_name(text):
     """Takes input text and generates a legal Elasticsearch index name.
     
@@ -1,13 +1,52 @@
+"""encyc.http -- HTTP requests to MediaWiki, PSMS, DDR, encycrg
+
+get and post are thin wrappers around requests that add HTTP Basic auth.
+Each host gets its own requests.Session, so connections are kept alive and
+reused (up to HTTP_POOL_MAXSIZE per host) and auth is looked up once per host.
+
+aget is an asyncio version of get.  Requests are run by a shared pool of
+threads, so total concurrency is capped at HTTP_CONCURRENCY for the whole
+process and at HTTP_PER_HOST for any one host, no matter how many event loops
+or threads are making requests.  Requests wait for their host's limit in the
+event loop before taking a pool thread, so a burst of requests to one host
+does not hold up requests to other hosts.
+
+>>> async def both(url0, url1):
+...     return await asyncio.gather(http.aget(url0), http.aget(url1))
+>>> r0,r1 = asyncio.run(both(url0, url1))
+>>> responses = http.get_many([url0, url1, url2])
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.cookiejar import DefaultCookiePolicy
 import logging
 logger = logging.getLogger(__name__)
+import threading
+from typing import Dict, Tuple
+import weakref
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from encyc import config
 
 TIMEOUT = float(config.MEDIAWIKI_API_TIMEOUT)
 
+# pooled sessions, one per scheme+host
+_sessions: Dict[Tuple[str,str], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+# asyncio fetch layer
+_executor = None
+# process-wide, per host
+_host_limits: Dict[str, threading.BoundedSemaphore] = {}
+# per event loop, per host
+_loop_host_limits: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]' = weakref.WeakKeyDictionary()
+_limits_lock = threading.Lock()
+
 
 def get(url, timeout=TIMEOUT, headers={}, data={}, cookies={}):
     """Thin wrapper around requests.get that adds HTTP Basic auth.
@@ -15,14 +54,7 @@ def get(url, timeout=TIMEOUT, headers={}, data={}, cookies={}):
     HTTP Basic auth required when accessing editors' wiki from outside the LAN.
     """
     logger.debug('GET %s' % url)
-    htuser,htpass = htuser_htpass(url)
-    if htuser and htpass:
-        return requests.get(
-            url,
-            timeout=timeout, headers=headers, data=data, cookies=cookies,
-            auth=(htuser, htpass)
-        )
-    return requests.get(
+    return session(url).get(
         url,
         timeout=timeout, headers=headers, data=data, cookies=cookies
     )
@@ -31,18 +63,42 @@ def post(url, timeout=TIMEOUT, headers={}, data={}, cookies={}):
     """Thin wrapper around requests.post that adds HTTP Basic auth.
     """
     logger.debug('POST %s' % url)
-    htuser,htpass = htuser_htpass(url)
-    if htuser and htpass:
-        return requests.post(
-            url,
-            timeout=timeout, headers=headers, data=data, cookies=cookies,
-            auth=(htuser, htpass)
-        )
-    return requests.post(
+    return session(url).post(
         url,
         timeout=timeout, headers=headers, data=data, cookies=cookies
     )
 
+def session(url):
+    """Pooled keep-alive requests.Session for the URL's scheme and host.
+    
+    Sessions are created on first use and shared by all threads.  Auth from
+    htuser_htpass is set on the session when it is created.  Cookies from
+    responses are not kept, so each request only sends the cookies passed to
+    get/post, as with requests.get.
+    
+    @param url: str
+    @returns: requests.Session
+    """
+    u = urlparse(url)
+    key = (u.scheme, u.netloc)
+    s = _sessions.get(key)
+    if s:
+        return s
+    with _sessions_lock:
+        if key not in _sessions:
+            s = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=config.HTTP_POOL_MAXSIZE
+            )
+            s.mount('%s://' % u.scheme, adapter)
+            s.headers['Accept-Encoding'] = 'gzip, deflate'
+            s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            htuser,htpass = htuser_htpass(url)
+            if htuser and htpass:
+                s.auth = (htuser, htpass)
+            _sessions[key] = s
+        return _sessions[key]
+
 
 def htuser_htpass(url):
     """Supply username/password for domain if specified.
@@ -59,3 +115,86 @@ def htuser_htpass(url):
         password = config.SOURCES_API_HTPASS
     #print('{} -> {},{}'.format(url,username,password))
     return username,password
+
+
+def _get_executor():
+    """Thread pool shared by all aget calls; its size is the global cap.
+    """
+    global _executor
+    with _limits_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=config.HTTP_CONCURRENCY,
+                thread_name_prefix='encyc-http',
+            )
+    return _executor
+
+def _host_limit(url):
+    """Semaphore that caps concurrent requests to the URL's host.
+    
+    @param url: str
+    @returns: threading.BoundedSemaphore
+    """
+    netloc = urlparse(url).netloc
+    with _limits_lock:
+        if netloc not in _host_limits:
+            _host_limits[netloc] = threading.BoundedSemaphore(config.HTTP_PER_HOST)
+        return _host_limits[netloc]
+
+def _loop_host_limit(url):
+    """asyncio.Semaphore that caps the running event loop's requests to
+    the URL's host, so they wait in the loop rather than in pool threads.
+    
+    @param url: str
+    @returns: asyncio.Semaphore
+    """
+    loop = asyncio.get_running_loop()
+    netloc = urlparse(url).netloc
+    with _limits_lock:
+        limits = _loop_host_limits.setdefault(loop, {})
+        if netloc not in limits:
+            limits[netloc] = asyncio.Semaphore(config.HTTP_PER_HOST)
+        return limits[netloc]
+
+def _limited_get(url, **kwargs):
+    with _host_limit(url):
+        return get(url, **kwargs)
+
+async def aget(url, timeout=TIMEOUT, headers={}, data={}, cookies={}):
+    """asyncio version of get.
+    
+    Same HTTP Basic auth behavior as get.
+    
+    @param url: str
+    @returns: requests.Response
+    """
+    loop = asyncio.get_running_loop()
+    async with _loop_host_limit(url):
+        return await loop.run_in_executor(
+            _get_executor(),
+            partial(
+                _limited_get, url,
+                timeout=timeout, headers=headers, data=data, cookies=cookies
+            )
+        )
+
+def get_many(urls, timeout=TIMEOUT, headers={}):
+    """GET a list of URLs concurrently.
+    
+    Exceptions are returned in place of responses rather than raised.
+    
+    @param urls: list of str
+    @param headers: dict for all URLs, or list of dicts in the order of urls
+    @returns: list of requests.Response or Exception, in the order of urls
+    """
+    if isinstance(headers, dict):
+        headers = [headers for url in urls]
+    async def _get_all():
+        return await asyncio.gather(
+            *[
+                aget(url, timeout=timeout, headers=url_headers)
+                for url,url_headers in zip(urls, headers)
+            ],
+            return_exceptions=True
+        )
+    return asyncio.run(_get_all())
@@ -25,14 +25,18 @@ Example usage:
 """
 
 from datetime import datetime
+import hashlib
 import json
 import logging
 logger = logging.getLogger(__name__)
 import os
+import threading
+import time
 from typing import List, Set, Dict, Tuple, Optional
-from urllib.parse import unquote, urlparse
+from urllib.parse import unquote, urljoin, urlparse
 
 from dateutil import parser
+import requests
 
 from elastictools.docstore import NotFoundError
 from elastictools.docstore import elasticsearch_dsl as dsl
@@ -43,6 +47,7 @@ from encyc import http
 from encyc.models import citations
 from encyc.models.legacy import Proxy
 from encyc import repo_models
+from encyc import state
 from encyc import urls
 
 if not config.DEBUG:
@@ -50,6 +55,18 @@ if not config.DEBUG:
     from encyc.models.wikipage import remove_status_markers
 
 MAX_SIZE = 10000
+# hits per request when scanning a whole index (see scan_index)
+SCAN_SIZE = 1000
+# encycrg articles per request, and state file (see Page.rg_titles)
+RG_TITLES_LIMIT = 1000
+RG_TITLES_STATE = 'rg_titles'
+# seconds between checks of the topics vocab version (see TopicsIndex)
+TOPICS_CHECK_SECONDS = 60
+
+# fields needed to compare ES documents with MediaWiki/PSMS
+PAGE_LIST_FIELDS = ['url_title', 'title', 'title_sort', 'modified']
+AUTHOR_LIST_FIELDS = ['url_title', 'title', 'title_sort', 'modified']
+SOURCE_LIST_FIELDS = ['encyclopedia_id', 'headword', 'modified']
 
 SEARCH_PARAM_WHITELIST = [
     'published_encyc',
@@ -138,6 +155,132 @@ def none_strip(text):
         text = ''
     return text.strip()
 
+def scan_index(docstore, doctype, model, fields):
+    """Generator of light objects for every document in an index.
+    
+    Unlike Page.pages etc this is not capped at MAX_SIZE: hits are fetched
+    SCAN_SIZE at a time with the scroll API and are not all held in memory.
+    
+    @param docstore: DocstoreManager
+    @param doctype: str e.g. 'article'
+    @param model: Document class for the hits e.g. Page
+    @param fields: list Fields to include in each hit.
+    @returns: generator of model objects
+    """
+    s = dsl.Search(
+        using=docstore.es, index=docstore.index_name(doctype)
+    ).doc_type(model).source(fields).params(size=SCAN_SIZE)
+    for hit in s.scan():
+        yield hit
+
+# not part of content_hash: a new revision that renders the same only
+# needs its modified date updated (see content_hashes)
+CONTENT_HASH_EXCLUDED = ['content_hash', 'modified']
+
+def content_hash(document):
+    """Stable hash of a document's contents.
+    
+    Fields are serialized with sorted keys so the same rendered document
+    always has the same hash.  CONTENT_HASH_EXCLUDED fields are left out.
+    
+    @param document: Page, Author, or Source
+    @returns: str
+    """
+    data = document.to_dict()
+    for field in CONTENT_HASH_EXCLUDED:
+        data.pop(field, None)
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+
+def content_hashes(docstore, doctype, model):
+    """content_hash and modified of every document in an index, by ID.
+    
+    @param docstore: DocstoreManager
+    @param doctype: str e.g. 'article'
+    @param model: Document class for the hits e.g. Page
+    @returns: dict {id: (content_hash, modified)}
+    """
+    return {
+        hit.meta.id: (
+            getattr(hit, 'content_hash', None), getattr(hit, 'modified', None)
+        )
+        for hit in scan_index(docstore, doctype, model, ['content_hash', 'modified'])
+    }
+
+def compare_hashes(hashes, document):
+    """Compare a document with its content_hash and modified in the index
+    
+    @param hashes: dict (see content_hashes)
+    @param document: Page, Author, or Source
+    @returns: str 'changed', 'unchanged', or 'modified' (only modified differs)
+    """
+    content_hash,modified = hashes.get(document.meta.id, (None, None))
+    if (not content_hash) or (content_hash != document.content_hash):
+        return 'changed'
+    if modified != getattr(document, 'modified', None):
+        return 'modified'
+    return 'unchanged'
+
+def mget(docstore, doctype, model, ids):
+    """Fetch documents by ID in one multi-get request.
+    
+    @param docstore: DocstoreManager
+    @param doctype: str e.g. 'source'
+    @param model: Document class e.g. Source
+    @param ids: list of document IDs (duplicates are requested once)
+    @returns: dict {id: document} Missing documents are left out.
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return {}
+    return {
+        doc.meta.id: doc
+        for doc in model.mget(
+            ids, index=docstore.index_name(doctype), using=docstore.es,
+            missing='skip'
+        )
+    }
+
+def _next_page_url(url, data):
+    """URL of the next page of a paginated API response, if any.
+    
+    Handles "next" at the top level or in "meta", absolute or relative.
+    
+    @param url: str URL of this page
+    @param data: dict Response body
+    @returns: str or None
+    """
+    next_url = data.get('next') or data.get('meta', {}).get('next')
+    if next_url:
+        return urljoin(url, next_url)
+    return None
+
+def _rg_titleset(pages):
+    """Titles from saved encycrg article list pages, spaces and underscores
+    
+    @param pages: list of dicts with 'ids' (see Page.rg_titles)
+    @returns: frozenset
+    """
+    titles = set()
+    for page in pages:
+        for title in page['ids']:
+            titles.add(title)
+            titles.add(title.replace('_', ' '))
+            titles.add(title.replace(' ', '_'))
+    return frozenset(titles)
+
+def count_index(docstore, doctype):
+    """Number of documents in an index.
+    
+    @param docstore: DocstoreManager
+    @param doctype: str e.g. 'article'
+    @returns: int
+    """
+    return dsl.Search(
+        using=docstore.es, index=docstore.index_name(doctype)
+    ).count()
+
 
 class Author(repo_models.Author):
 
@@ -197,6 +340,22 @@ class Author(repo_models.Author):
         )
         return searcher.execute(MAX_SIZE, 0)
 
+    @staticmethod
+    def iter_authors(docstore, fields=AUTHOR_LIST_FIELDS):
+        """Generator of light Author objects for all authors (see scan_index).
+        
+        @returns: generator
+        """
+        return scan_index(docstore, 'author', Author, fields)
+
+    @staticmethod
+    def count(docstore):
+        """Number of Authors in the index.
+        
+        @returns: int
+        """
+        return count_index(docstore, 'author')
+
     def scrub(self):
         """Removes internal editorial markers.
         Must be run on a full (non-list) Page object.
@@ -242,6 +401,7 @@ class Author(repo_models.Author):
                 body = none_strip(mwauthor.body),
                 article_titles = [title for title in mwauthor.author_articles],
             )
+        author.content_hash = content_hash(author)
         return author
 
 
@@ -273,19 +433,23 @@ class Page(repo_models.Page):
     def absolute_url(self):
         return urls.reverse('wikiprox-page', args=([self.title]))
 
-    def authors(self):
+    def authors(self, docstore):
         """Returns list of published light Author objects for this Page.
         
+        Authors not in the index are returned as their url_title.
+        
+        @param docstore: DocstoreManager
         @returns: list
         """
-        objects = []
-        for url_title in self.authors_data['display']:
-            try:
-                author = Author.get(url_title)
-            except NotFoundError:
-                author = url_title
-            objects.append(author)
-        return objects
+        return self._authors(
+            mget(docstore, 'author', Author, self.authors_data['display'])
+        )
+
+    def _authors(self, found):
+        return [
+            found.get(url_title, url_title)
+            for url_title in self.authors_data['display']
+        ]
 
     def first_letter(self):
         return self.title_sort[0]
@@ -329,6 +493,22 @@ class Page(repo_models.Page):
             wildcards=False,
         )
         return searcher.execute(MAX_SIZE, 0)
+
+    @staticmethod
+    def iter_pages(docstore, fields=PAGE_LIST_FIELDS):
+        """Generator of light Page objects for all pages (see scan_index).
+        
+        @returns: generator
+        """
+        return scan_index(docstore, 'article', Page, fields)
+
+    @staticmethod
+    def count(docstore):
+        """Number of Pages in the index.
+        
+        @returns: int
+        """
+        return count_index(docstore, 'article')
     
     @staticmethod
     def pages_by_category():
@@ -361,40 +541,62 @@ class Page(repo_models.Page):
         if (not config.DEBUG) and hasattr(self,'body') and self.body:
             self.body = str(remove_status_markers(BeautifulSoup(self.body)))
     
-    def sources(self):
+    def sources(self, docstore):
         """Returns list of published light Source objects for this Page.
         
+        Sources not in the index are left out.
+        
+        @param docstore: DocstoreManager
         @returns: list
         """
-        return [Source.get(sid) for sid in self.source_ids]
+        return self._sources(
+            mget(docstore, 'source', Source, self.source_ids)
+        )
+
+    def _sources(self, found):
+        missing = [sid for sid in self.source_ids if sid not in found]
+        if missing:
+            logging.warning('%s: sources not found %s' % (self.url_title, missing))
+        return [found[sid] for sid in self.source_ids if sid in found]
+
+    @staticmethod
+    def sources_authors(docstore, pages):
+        """Sources and Authors for many Pages, in two multi-get requests.
+        
+        @param docstore: DocstoreManager
+        @param pages: list of Page
+        @returns: dict {url_title: {'sources': list, 'authors': list}}
+        """
+        sources = mget(docstore, 'source', Source, [
+            sid for page in pages for sid in page.source_ids
+        ])
+        authors = mget(docstore, 'author', Author, [
+            url_title for page in pages for url_title in page.authors_data['display']
+        ])
+        return {
+            page.url_title: {
+                'sources': page._sources(sources),
+                'authors': page._authors(authors),
+            }
+            for page in pages
+        }
     
-    def topics(self):
+    def topics(self, docstore):
         """List of DDR topics associated with this page.
         
+        @param docstore: DocstoreManager
         @returns: list
         """
         # return list of dicts rather than an Elasticsearch results object
-        terms = []
-        for t in Elasticsearch.topics_by_url().get(self.absolute_url(), []):
-            term = {
-                key: val
-                for key,val in t.items()
-            }
-            term.pop('encyc_urls')
-            term['ddr_topic_url'] = '%s/%s/' % (
-                config.DDR_TOPICS_BASE,
-                term['id']
-            )
-            terms.append(term)
-        return terms
+        return get_topics_index().terms(docstore, self.absolute_url())
     
-    def ddr_terms_objects(self, size=100):
+    def ddr_terms_objects(self, docstore, size=100):
         """Get dict of DDR objects for article's DDR topic terms.
         
         Ironic: this uses DDR's REST UI rather than ES.
         """
         if not hasattr(self, '_related_terms_docs'):
-            terms = self.topics()
+            terms = self.topics(docstore)
             objects = ddr.related_by_topic(
                 term_ids=[term['id'] for term in terms],
                 size=size
@@ -403,26 +605,73 @@ class Page(repo_models.Page):
                 term['objects'] = objects[term['id']]
         return terms
     
-    def ddr_objects(self, size=5):
+    def ddr_objects(self, docstore, size=5):
         """Get list of objects for terms from DDR.
         
         Ironic: this uses DDR's REST UI rather than ES.
         """
         objects = ddr.related_by_topic(
-            term_ids=[term['id'] for term in self.topics()],
+            term_ids=[term['id'] for term in self.topics(docstore)],
             size=size
         )
         return ddr._balance(objects, size)
     
     @staticmethod
     def rg_titles():
-        """List of articles appearing in the Resource Guide (encycrg)
+        """Set of articles appearing in the Resource Guide (encycrg)
+        
+        All pages of the encycrg articles list are fetched.  Each page is
+        requested with the ETag/Last-Modified of the last response for that
+        page (saved in PUBLISH_STATE_DIR) and reused if not modified.
+        Titles are included both with spaces and with underscores so that
+        link marking (wikipage._mark_offsite_encyc_rg_links) is a set lookup.
+        If any page fails the complete list from the last run is returned;
+        with no saved list ConnectionError is raised.
+        
+        @returns: frozenset
         """
-        url = os.path.join(config.ENCYCRG_API, 'articles/?limit=1000')
-        r = http.get(url)
-        logging.debug(r.status_code)
-        articles = json.loads(r.text)['objects']
-        return [a['id'] for a in articles]
+        cached = state.load(RG_TITLES_STATE) or {}
+        pages = {}
+        url = os.path.join(config.ENCYCRG_API, 'articles/?limit=%s' % RG_TITLES_LIMIT)
+        offset = 0
+        while url:
+            headers = {}
+            if cached.get(url, {}).get('etag'):
+                headers['If-None-Match'] = cached[url]['etag']
+            if cached.get(url, {}).get('last_modified'):
+                headers['If-Modified-Since'] = cached[url]['last_modified']
+            r = http.get(url, headers=headers)
+            logging.debug('%s %s' % (r.status_code, url))
+            if r.status_code == 304:
+                pages[url] = cached[url]
+            elif r.status_code == 200:
+                data = json.loads(r.text)
+                pages[url] = {
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                    'ids': [a['id'] for a in data['objects']],
+                    'next': _next_page_url(url, data),
+                }
+            else:
+                # don't save or return a partial list
+                logging.error('%s %s' % (r.status_code, url))
+                if not cached:
+                    raise requests.exceptions.ConnectionError(
+                        'Error %s %s' % (r.status_code, url))
+                logging.error('Using cached encycrg titles')
+                return _rg_titleset(cached.values())
+            if pages[url]['next']:
+                url = pages[url]['next']
+            elif len(pages[url]['ids']) == RG_TITLES_LIMIT:
+                offset += RG_TITLES_LIMIT
+                url = os.path.join(
+                    config.ENCYCRG_API,
+                    'articles/?limit=%s&offset=%s' % (RG_TITLES_LIMIT, offset)
+                )
+            else:
+                url = None
+        state.dump(RG_TITLES_STATE, pages)
+        return _rg_titleset(pages.values())
 
     @staticmethod
     def from_mw(mwpage, page=None):
@@ -494,7 +743,7 @@ class Page(repo_models.Page):
             ]
             if databoxes:
                 setattr(page, 'databoxes', databoxes)
-        
+        page.content_hash = content_hash(page)
         return page
 
 
@@ -585,6 +834,22 @@ class Source(repo_models.Source):
         )
         return searcher.execute(MAX_SIZE, 0)
 
+    @staticmethod
+    def iter_sources(docstore, fields=SOURCE_LIST_FIELDS):
+        """Generator of light Source objects for all sources (see scan_index).
+        
+        @returns: generator
+        """
+        return scan_index(docstore, 'source', Source, fields)
+
+    @staticmethod
+    def count(docstore):
+        """Number of Sources in the index.
+        
+        @returns: int
+        """
+        return count_index(docstore, 'source')
+
     @staticmethod
     def from_psms(ps_source):
         """Creates an Source object from a models.legacy.Proxy.source object.
@@ -644,6 +909,7 @@ class Source(repo_models.Source):
             filename = filename,
             img_path = img_path,
         )
+        source.content_hash = content_hash(source)
         return source
 
     @staticmethod
@@ -880,24 +1146,153 @@ class Facet(repo_models.Facet):
         ]
         return data
     
+    @staticmethod
+    def url(facet_id):
+        return '%s/%s.json' % (config.DDR_VOCABS_BASE, facet_id)
+    
     @staticmethod
     def retrieve(facet_id):
-        url = '%s/%s.json' % (config.DDR_VOCABS_BASE, facet_id)
+        url = Facet.url(facet_id)
         logging.debug(url)
         r = http.get(url)
         logging.debug(r.status_code)
-        data = json.loads(r.text)
+        return Facet.from_json(facet_id, r.content)
+    
+    @staticmethod
+    def from_json(facet_id, rawjson):
+        """Facet and its terms from DDR vocab JSON
+        
+        @param facet_id: str
+        @param rawjson: bytes
+        @returns: Facet with .terms list and .source_hash
+        """
+        data = json.loads(rawjson)
         facet = Facet(
             meta = {'id': facet_id},
             id=data['id'],
             title=data['title'],
             description=data['description'],
+            source_hash=Facet.source_hash_of(rawjson),
         )
         facet.terms = [
             FacetTerm.from_dict(facet_id, d)
             for d in data['terms']
         ]
         return facet
+    
+    @staticmethod
+    def source_hash_of(rawjson):
+        return hashlib.sha1(rawjson).hexdigest()
+
+
+class TopicsIndex():
+    """DDR topic terms by encyclopedia URL, kept in memory
+    
+    Built from the topics vocab document the first time it is used and
+    rebuilt only when the document's _version or the index it was read
+    from changes (i.e. another docstore, or an alias swapped to a new
+    version).  The version is checked at most every TOPICS_CHECK_SECONDS
+    and whenever the docstore's vocab index name changes.
+    """
+
+    def __init__(self):
+        # vocab index name as requested, concrete index it was read from
+        self.index = None
+        self.source_index = None
+        self.version = None
+        self.checked = 0
+        # url: list of term dicts
+        self._by_url = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<%s.%s %s v%s %s urls>' % (
+            self.__module__, self.__class__.__name__,
+            self.source_index, self.version, len(self._by_url)
+        )
+
+    def refresh(self, docstore, force=False):
+        """Rebuild if the topics vocab document has changed
+        
+        @param docstore: DocstoreManager
+        @param force: bool Check the version now
+        @returns: bool True if rebuilt
+        """
+        with self._lock:
+            now = time.monotonic()
+            index = docstore.index_name('vocab')
+            if not force and self.version is not None \
+            and index == self.index \
+            and (now - self.checked) < TOPICS_CHECK_SECONDS:
+                return False
+            self.checked = now
+            try:
+                doc = docstore.es.get(index=index, id='topics', source=False)
+                version = doc['_version']
+                source_index = doc.get('_index', index)
+            except NotFoundError:
+                version = 0
+                source_index = None
+            if (index, source_index, version) == \
+            (self.index, self.source_index, self.version):
+                return False
+            # terms, version, and index from one response, in case the
+            # document changed since the check
+            try:
+                doc = docstore.es.get(index=index, id='topics')
+                version = doc['_version']
+                source_index = doc.get('_index', index)
+            except NotFoundError:
+                doc = None
+                version = 0
+                source_index = None
+            by_url = {}
+            if doc:
+                for term in Elasticsearch._topic_terms(doc):
+                    data = {
+                        'id': term['id'],
+                        'title': term['title'],
+                        '_title': term['_title'],
+                        'ddr_topic_url': '%s/%s/' % (
+                            config.DDR_TOPICS_BASE, term['id']
+                        ),
+                    }
+                    for url in term['encyc_urls']:
+                        by_url.setdefault(url, []).append(data)
+            self._by_url = by_url
+            self.index = index
+            self.source_index = source_index
+            self.version = version
+            logging.debug('rebuilt %s' % self)
+            return True
+
+    def terms(self, docstore, url):
+        """Topic terms for an encyclopedia URL
+        
+        @param docstore: DocstoreManager
+        @param url: str Page.absolute_url()
+        @returns: list of dicts (copies; callers may modify them)
+        """
+        self.refresh(docstore)
+        return [dict(term) for term in self._by_url.get(url, [])]
+
+    def by_url(self, docstore):
+        """
+        @param docstore: DocstoreManager
+        @returns: dict {url: list of term dicts}
+        """
+        self.refresh(docstore)
+        return self._by_url
+
+
+_topics_index = TopicsIndex()
+
+def get_topics_index():
+    """The process's TopicsIndex
+    
+    @returns: TopicsIndex
+    """
+    return _topics_index
 
 
 class Elasticsearch(object):
@@ -906,9 +1301,23 @@ class Elasticsearch(object):
     """
 
     @staticmethod
-    def topics():
+    def topics(docstore):
+        try:
+            results = docstore.es.get(
+                index=docstore.index_name('vocab'), id='topics'
+            )
+        except NotFoundError:
+            results = None
+        return Elasticsearch._topic_terms(results)
+
+    @staticmethod
+    def _topic_terms(results):
+        """Topic terms from a GET of the topics vocab document
+        
+        @param results: dict GET response or None
+        @returns: list of term dicts
+        """
         terms = []
-        results = docstore.get(model='vocab', document_id='topics')
         if results and (results['_source']['terms']):
             terms = [
                 {
@@ -922,14 +1331,13 @@ class Elasticsearch(object):
         return terms
 
     @staticmethod
-    def topics_by_url():
-        data = {}
-        for term in Elasticsearch.topics():
-            for url in term['encyc_urls']:
-                if not data.get(url, None):
-                    data[url] = []
-                data[url].append(term)
-        return data
+    def topics_by_url(docstore):
+        """DDR topic terms by encyclopedia URL (see TopicsIndex).
+        
+        @param docstore: DocstoreManager
+        @returns: dict {url: list of term dicts}
+        """
+        return get_topics_index().by_url(docstore)
     
     @staticmethod
     def index_articles(titles=[], start=0, num=1000000):
@@ -1025,7 +1433,7 @@ class Elasticsearch(object):
         
         @param mw_author_titles: list of author page titles
         @param mw_articles: list of MediaWiki author page dicts.
-        @param es_articles: list of elastic.Page objects.
+        @param es_articles: iterable of elastic.Page objects (e.g. Page.iter_pages).
         @returns: (update,delete)
         """
         return Elasticsearch._new_update_deleted(
@@ -1038,7 +1446,7 @@ class Elasticsearch(object):
         """Returns encyclopedia_ids of sources to update/delete
         
         @param ps_sources: list of PSMS sources
-        @param es_sources: list of elastic.Source objects.
+        @param es_sources: iterable of elastic.Source objects (e.g. Source.iter_sources).
         @returns: (update,delete)
         """
         # sid:lastmod dict for comparisons
@@ -1079,7 +1487,7 @@ class Elasticsearch(object):
         
         @param mw_author_titles: list of author page titles
         @param mw_articles: list of MediaWiki author page dicts.
-        @param es_authors: list of elastic.Author objects.
+        @param es_authors: iterable of elastic.Author objects (e.g. Author.iter_authors).
         @returns: (update,delete)
         """
         return Elasticsearch._new_update_deleted(
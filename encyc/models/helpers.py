@@ -9,8 +9,15 @@ from bs4 import BeautifulSoup
 
 from encyc import config
 from encyc import http
+from encyc.models.mirror import get_mirror
 
 TIMEOUT = float(config.MEDIAWIKI_API_TIMEOUT)
+# see make_soup
+PARSERS = ['html.parser', 'lxml', 'lxml-verify']
+# left between blocks by MediaWiki (see remove_empty_paragraphs)
+EMPTY_PARAGRAPH = '<p><br />\n</p>'
+# max length of a sources API URL (see primary_sources_urls)
+SOURCES_URL_MAX = 2000
 
 
 def columnizer(things, cols):
@@ -64,16 +71,54 @@ def page_lastmod(api_url, page_title):
     @param page_title: Page title from MediaWiki URL.
     @returns: datetime or None
     """
-    lastmod = None
     url = _lastmod_data_url(api_url, page_title)
     logging.debug(url)
     r = http.get(url, timeout=TIMEOUT)
-    if r.status_code == 200:
-        pagedata = r.json()
-        pages = list(pagedata['query']['pages'].values())
-        ts = pages[0]['revisions'][0]['timestamp']
-        lastmod = datetime.strptime(ts, config.MEDIAWIKI_DATETIME_FORMAT_TZ)
-    return lastmod
+    return lastmod_from_response(r)
+
+def page_revision(api_url, page_title):
+    """Retrieves page ID, revision ID, and timestamp of latest revision.
+    
+    @parap api_url: str Base URL for MediaWiki API.
+    @param page_title: Page title from MediaWiki URL.
+    @returns: dict or None
+    """
+    url = _lastmod_data_url(api_url, page_title)
+    logging.debug(url)
+    r = http.get(url, timeout=TIMEOUT)
+    return revision_from_response(r)
+
+def lastmod_from_response(r):
+    """Timestamp of last modification from a _lastmod_data_url response.
+    
+    @param r: requests.Response
+    @returns: datetime or None
+    """
+    revision = revision_from_response(r)
+    if revision:
+        return revision['timestamp']
+    return None
+
+def revision_from_response(r):
+    """Latest revision from a _lastmod_data_url response.
+    
+    @param r: requests.Response
+    @returns: dict {'pageid', 'revid', 'timestamp'} or None
+    """
+    if r.status_code != 200:
+        return None
+    pagedata = r.json()
+    pages = list(pagedata['query']['pages'].values())
+    if not pages[0].get('revisions'):
+        return None
+    rev = pages[0]['revisions'][0]
+    return {
+        'pageid': pages[0]['pageid'],
+        'revid': rev['revid'],
+        'timestamp': datetime.strptime(
+            rev['timestamp'], config.MEDIAWIKI_DATETIME_FORMAT_TZ
+        ),
+    }
 
 def extract_encyclopedia_id(uri):
     """Attempts to extract a valid Densho encyclopedia ID from the URI
@@ -94,7 +139,8 @@ def extract_encyclopedia_id(uri):
 def find_primary_sources(api_url, images):
     """Given list of page images, get the ones with encyclopedia IDs.
     
-    Called by parse_mediawiki_text.
+    Called by parse_mediawiki_text.  Sources in the local source mirror are
+    not requested from the sources API.
     
     @param api_url: SOURCES_URL
     @param images: list
@@ -102,21 +148,85 @@ def find_primary_sources(api_url, images):
     """
     logging.debug('find_primary_sources(%s, %s)' % (api_url, images))
     logging.debug('looking for %s' % len(images))    
-    sources = []
+    mirror = get_mirror()
+    sources,missing = mirror.lookup(primary_source_ids(images))
+    # get others via sources API
+    for url in primary_sources_urls(api_url, missing):
+        r = http.get(url)
+        found = sources_from_response(r)
+        mirror.update(found)
+        sources += found
+    logging.debug('retrieved %s' % len(sources))
+    return sources
+
+def primary_source_ids(images):
+    """Anything in the list of page images that might be an encyclopedia_id
+    
+    @param images: list
+    @returns: list of encyclopedia_ids
+    """
     eids = []
-    # anything that might be an encyclopedia_id
     for img in images:
         encyclopedia_id = extract_encyclopedia_id(img)
         if encyclopedia_id:
             eids.append(encyclopedia_id)
-    # get sources via sources API
-    if eids:
-        url = '%s/sources/%s' % (api_url, ','.join(eids))
-        r = http.get(url)
-        if r.status_code == 200:
-            sources = json.loads(r.text)
-    logging.debug('retrieved %s' % len(sources))
-    return sources
+    return eids
+
+def _primary_sources_url(api_url, eids):
+    """URL of sources API call to get the specified sources.
+    
+    @param api_url: SOURCES_URL
+    @param eids: list of encyclopedia_ids
+    @returns: url
+    """
+    return '%s/sources/%s' % (api_url, ','.join(eids))
+
+def primary_sources_batches(api_url, eids, max_url=SOURCES_URL_MAX):
+    """Split encyclopedia_ids into batches that fit in a sources API URL.
+    
+    @param api_url: SOURCES_URL
+    @param eids: list of encyclopedia_ids
+    @param max_url: int Max length of each URL.
+    @returns: list of lists of encyclopedia_ids
+    """
+    batches = []
+    batch = []
+    length = len(_primary_sources_url(api_url, []))
+    for eid in eids:
+        if batch and (length + 1 + len(eid) > max_url):
+            batches.append(batch)
+            batch = []
+            length = len(_primary_sources_url(api_url, []))
+        length += len(eid) + (1 if batch else 0)
+        batch.append(eid)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def primary_sources_urls(api_url, eids, max_url=SOURCES_URL_MAX):
+    """URLs of sources API calls to get the specified sources.
+    
+    Unlike _primary_sources_url, no URL is longer than max_url.
+    
+    @param api_url: SOURCES_URL
+    @param eids: list of encyclopedia_ids
+    @param max_url: int Max length of each URL.
+    @returns: list of urls
+    """
+    return [
+        _primary_sources_url(api_url, batch)
+        for batch in primary_sources_batches(api_url, eids, max_url)
+    ]
+
+def sources_from_response(r):
+    """List of sources from a _primary_sources_url response.
+    
+    @param r: requests.Response
+    @returns: list of sources
+    """
+    if r.status_code == 200:
+        return json.loads(r.text)
+    return []
 
 def find_databoxcamps_coordinates(text):
     """Given the raw wikitext, search for coordinates with Databox-Camps.
@@ -152,6 +262,54 @@ def find_databoxcamps_coordinates(text):
             coordinates = (lng,lat)
     return coordinates
 
+def make_soup(html, parser=None):
+    """Parse page HTML; pass through soup that has already been parsed.
+    
+    Parsing a long article is the most expensive part of rendering it,
+    so encyc.models.wikipage.render_page parses the page once and hands
+    the same soup to each of the extractors and transforms.
+    
+    With parser='lxml' the tree is built by lxml.  lxml wraps fragments in
+    <html><body>, which are removed so that the transforms see the same
+    tree as with html.parser.  Any other value (including 'lxml-verify',
+    which is handled in render_page) uses html.parser.
+    
+    @param html: str HTML or BeautifulSoup
+    @param parser: str One of PARSERS (default: config.HTML_PARSER)
+    @returns: BeautifulSoup
+    """
+    if isinstance(html, BeautifulSoup):
+        return html
+    if parser is None:
+        parser = config.HTML_PARSER
+    if parser == 'lxml':
+        soup = BeautifulSoup(html, features='lxml')
+        if soup.html:
+            if soup.html.body:
+                soup.html.body.unwrap()
+            if soup.html.head:
+                soup.html.head.unwrap()
+            soup.html.unwrap()
+        return soup
+    return BeautifulSoup(html, features='html.parser')
+
+def remove_empty_paragraphs(soup):
+    """Remove the empty paragraphs MediaWiki leaves in page bodies.
+    
+    Does to a parsed page what text.replace(EMPTY_PARAGRAPH,'') does to
+    the HTML.  Only used for the rendered body; extractors such as
+    wikipage.extract_databoxes see the page as MediaWiki sent it.
+    
+    @param soup: BeautifulSoup
+    @returns: BeautifulSoup
+    """
+    for p in soup.find_all('p'):
+        if (len(p.contents) == 2) \
+        and (p.contents[0].name == 'br') and not p.contents[0].attrs \
+        and (p.contents[1] == '\n'):
+            p.decompose()
+    return soup
+
 def find_author_info(text):
     """Given raw HTML, extract author display and citation formats.
     
@@ -179,18 +337,17 @@ def find_author_info(text):
       Scheiber,Jane; Scheiber,Harry
     </div>
     
-    @param text: str HTML
+    @param text: str HTML or BeautifulSoup
     @returns: dict of authors
     """
     authors = {'display':[], 'parsed':[],}
-    soup = BeautifulSoup(
-        text.replace('<p><br />\n</p>',''),
-        features='html.parser'
-    )
+    if isinstance(text, str):
+        text = text.replace(EMPTY_PARAGRAPH,'')
+    soup = make_soup(text)
     for byline in soup.find_all('div', id='authorByline'):
         for a in byline.find_all('a'):
             if hasattr(a,'contents') and a.contents:
-                authors['display'].append(a.contents[0])
+                authors['display'].append(str(a.contents[0]))
     for citation in soup.find_all('div', id='citationAuthor'):
         if hasattr(citation,'contents') and citation.contents:
             names = []
@@ -1,3 +1,4 @@
+import asyncio
 import codecs
 from datetime import datetime
 import json
@@ -5,7 +6,7 @@ import logging
 logger = logging.getLogger(__name__)
 import os
 import re
-from typing import List, Set, Dict, Tuple, Optional
+from typing import Any, List, Set, Dict, Tuple, Optional
 
 from dateutil import parser
 
@@ -14,11 +15,13 @@ from encyc import config
 from encyc import csvfile
 from encyc import ddr
 from encyc import http
+from encyc import pagecache
 from encyc import urls
 from encyc import wiki
 from encyc.models import citations
 from encyc.models import sources
 from encyc.models import helpers
+from encyc.models.mirror import get_mirror
 from encyc.models import wikipage
 
 STOP_WORDS = ['a', 'an', 'the']
@@ -106,10 +109,94 @@ class Page(object):
         return urls.reverse('wikiprox-page', args=([self.title]))
     
     @staticmethod
-    def pagedata(mw: wiki.MediaWiki, url_title: str) -> str:
+    def pagedata(mw: Optional[wiki.MediaWiki], url_title: str,
+                 revision: Optional[Dict[str,Any]]=None) -> str:
+        """Page data JSON from pagecache if revision is cached, else MediaWiki.
+        
+        @param mw: wiki.MediaWiki
+        @param url_title: str
+        @param revision: dict Latest revision (see helpers.page_revision).
+        @returns: str
+        """
+        if revision:
+            rawtext = pagecache.get(revision['pageid'], revision['revid'])
+            if rawtext:
+                return rawtext
         url = helpers.page_data_url(config.MEDIAWIKI_API, url_title)
         r = http.get(url)
-        return str(r.text)
+        rawtext = str(r.text)
+        pagecache.put(rawtext)
+        return rawtext
+    
+    @staticmethod
+    async def afetch(url_title: str, resolver=None) -> Dict[str,Any]:
+        """Get everything Page.get needs from MediaWiki and PSMS.
+        
+        If pagecache is enabled each request depends on the one before:
+        the latest revision, then page data only if that revision is not
+        cached.  Otherwise page data and lastmod are requested at the same
+        time.  Primary sources are requested as soon as the page data (list
+        of images) is available, or taken from resolver if it has them.
+        All requests go through http.aget and its concurrency limits.
+        
+        @param url_title: str
+        @param resolver: encyc.models.sources.SourceResolver (optional)
+        @returns: dict with rawtext, lastmod, sources
+        """
+        pagedata_url = helpers.page_data_url(config.MEDIAWIKI_API, url_title)
+        lastmod_url = helpers._lastmod_data_url(config.MEDIAWIKI_API, url_title)
+        if pagecache.enabled():
+            revision = helpers.revision_from_response(
+                await http.aget(lastmod_url, timeout=helpers.TIMEOUT)
+            )
+            rawtext = None
+            if revision:
+                rawtext = pagecache.get(revision['pageid'], revision['revid'])
+            if not rawtext:
+                rawtext = str((await http.aget(pagedata_url)).text)
+                pagecache.put(rawtext)
+        else:
+            r_pagedata,r_lastmod = await asyncio.gather(
+                http.aget(pagedata_url),
+                http.aget(lastmod_url, timeout=helpers.TIMEOUT),
+            )
+            rawtext = str(r_pagedata.text)
+            revision = helpers.revision_from_response(r_lastmod)
+        fetched,eids = Page._fetched(rawtext, revision)
+        if resolver:
+            fetched['sources'] = await resolver.aresolve(eids)
+        else:
+            for url in helpers.primary_sources_urls(config.SOURCES_API, eids):
+                r = await http.aget(url)
+                fetched['sources'] += helpers.sources_from_response(r)
+        return fetched
+    
+    @staticmethod
+    def fetch(url_title: str, resolver=None) -> Dict[str,Any]:
+        """Get everything Page.get needs (see Page.afetch).
+        
+        For one-off use; publish runs Page.afetch in a pipeline.AsyncStage.
+        
+        @param url_title: str
+        @param resolver: encyc.models.sources.SourceResolver (optional)
+        @returns: dict with rawtext, lastmod, sources
+        """
+        return asyncio.run(Page.afetch(url_title, resolver=resolver))
+    
+    @staticmethod
+    def _fetched(rawtext: str, revision: Optional[Dict[str,Any]]):
+        """Page.fetch output without sources, and the page's encyclopedia_ids
+        """
+        fetched: Dict[str,Any] = {
+            'rawtext': rawtext,
+            'lastmod': revision['timestamp'] if revision else None,
+            'sources': [],
+        }
+        eids = []
+        pagedata = json.loads(rawtext)
+        if pagedata.get('parse'):
+            eids = helpers.primary_source_ids(pagedata['parse']['images'])
+        return fetched,eids
     
     @staticmethod
     def get(mw: wiki.MediaWiki,
@@ -118,17 +205,38 @@ class Page(object):
             restrict_databoxes=True,
             migration=False,
             rg_titles: List[str]=[],
+            render_pool=None,
+            fetched: Optional[Dict[str,Any]]=None,
+            parser: Optional[str]=None,
     ):
         """Get page data from API and return Page object.
+        
+        @param mw: wiki.MediaWiki
+        @param url_title: str
+        @param rawtext: str Page data JSON (if already retrieved).
+        @param restrict_databoxes: bool Only extract databoxes in MEDIAWIKI_DATABOXES.
+        @param migration: bool
+        @param rg_titles: set Resource Guide url_titles (see elastic.Page.rg_titles).
+        @param render_pool: encyc.models.render.RenderPool (optional) Render
+                            in a worker process instead of this one.
+        @param fetched: dict Output of Page.fetch (if already retrieved).
+        @param parser: str HTML parser (default: config.HTML_PARSER); ignored
+                       if render_pool is used (see RenderPool).
         """
         logger.debug(url_title)
         page = Page()
         page.url_title = url_title
         page.uri = urls.reverse('wikiprox-page', args=[url_title])
-        if rawtext:
-            pagedata = json.loads(rawtext)
-        else:
-            pagedata = json.loads(Page.pagedata(mw, url_title))
+        if fetched is None:
+            fetched = {}
+        revision = None
+        if fetched:
+            rawtext = fetched['rawtext']
+        if not rawtext:
+            if pagecache.enabled():
+                revision = helpers.page_revision(config.MEDIAWIKI_API, url_title)
+            rawtext = Page.pagedata(mw, url_title, revision)
+        pagedata = json.loads(rawtext)
         if pagedata.get('error') and pagedata['error']['code'] == 'missingtitle':
             page.status_code = 404
             page.error = pagedata['error']['code']
@@ -143,7 +251,12 @@ class Page(object):
             # note: header is added by Nginx, should not appear when connected directly
             # to the app server.
             page.published = helpers.page_is_published(pagedata)
-            page.lastmod = helpers.page_lastmod(config.MEDIAWIKI_API, page.url_title)
+            if fetched:
+                page.lastmod = fetched['lastmod']
+            elif revision:
+                page.lastmod = revision['timestamp']
+            else:
+                page.lastmod = helpers.page_lastmod(config.MEDIAWIKI_API, page.url_title)
             
             # basic page context
             page.title = pagedata['parse']['displaytitle']
@@ -155,38 +268,16 @@ class Page(object):
                     title_sort = prop['*']
             page.title_sort = make_titlesort(title_sort, page.title)
             
-            page.sources = helpers.find_primary_sources(
-                config.SOURCES_API,
-                pagedata['parse']['images']
-            )
-            if restrict_databoxes:
-                databox_keys = config.MEDIAWIKI_DATABOXES
+            if fetched:
+                page.sources = fetched['sources']
             else:
-                databox_keys = {}
-            page.databoxes = wikipage.extract_databoxes(
-                pagedata['parse']['text']['*'],
-                databox_keys
-            )
-            
-            page.published_encyc = True
-            if wikipage.not_published_encyc(pagedata['parse']['text']['*']):
-                # Must be called before marker divs are removed
-                # in wikipage._remove_nonrg_divs
-                page.published_encyc = False
-            
-            page.published_rg = False
-            if hasattr(page, 'databoxes') and page.databoxes \
-            and page.databoxes.get('rgdatabox-Core',{}).get('rgmediatype'):
-                page.published_rg = True
-            
-            page.body = wikipage.parse_mediawiki_text(
-                title=url_title,
-                html=pagedata['parse']['text']['*'],
-                primary_sources=page.sources,
-                public=page.public,
-                printed=False,
-                migration=migration,
-                rg_titles=rg_titles,
+                page.sources = helpers.find_primary_sources(
+                    config.SOURCES_API,
+                    pagedata['parse']['images']
+                )
+            rendered = Page._render(
+                page, pagedata, rawtext, restrict_databoxes, migration,
+                rg_titles, render_pool, parser
             )
             
             ## rewrite media URLs on stage
@@ -196,7 +287,7 @@ class Page(object):
             
             page.is_article = mw.is_article(page.title)
             if page.is_article:
-                page.description = wikipage.extract_description(page.body)
+                page.description = rendered['description']
                 
                 # only include categories from Category:Articles
                 categories_whitelist = [
@@ -211,8 +302,8 @@ class Page(object):
                 
                 page.prev_page = mw.article_prev(page.title)
                 page.next_page = mw.article_next(page.title)
-                page.coordinates = helpers.find_databoxcamps_coordinates(pagedata['parse']['text']['*'])
-                page.authors = helpers.find_author_info(pagedata['parse']['text']['*'])
+                page.coordinates = rendered['coordinates']
+                page.authors = rendered['authors']
             
             page.is_author = mw.is_author(page.title)
             if page.is_author:
@@ -220,6 +311,89 @@ class Page(object):
             
         return page
     
+    @staticmethod
+    def _render(page, pagedata, rawtext, restrict_databoxes, migration,
+                rg_titles, render_pool, parser):
+        """Render page body and set the fields that come from it.
+        
+        @returns: dict (see wikipage.render_page)
+        """
+        if restrict_databoxes:
+            databox_keys = config.MEDIAWIKI_DATABOXES
+        else:
+            databox_keys = {}
+        if render_pool:
+            rendered = render_pool.render(
+                page.url_title, rawtext, page.sources, databox_keys,
+                public=page.public, migration=migration,
+            )
+        else:
+            rendered = wikipage.render_page(
+                page.url_title, pagedata, page.sources, databox_keys,
+                rg_titles=rg_titles,
+                public=page.public, migration=migration,
+                parser=parser,
+            )
+        page.databoxes = rendered['databoxes']
+        page.published_encyc = rendered['published_encyc']
+        page.published_rg = rendered['published_rg']
+        page.body = rendered['body']
+        return rendered
+    
+    @staticmethod
+    def rerender(rawtext: str,
+                 es_page,
+                 rg_titles: List[str]=[],
+                 render_pool=None,
+                 parser: Optional[str]=None,
+    ):
+        """Render a Page from stored page data without contacting MediaWiki.
+        
+        Everything that get() takes from the page data is re-rendered.  Things
+        that come from other MediaWiki or PSMS requests (lastmod, primary
+        sources, categories, prev/next page) are copied from the page's
+        current Elasticsearch document.
+        
+        @param rawtext: str Page data JSON (see pagecache).
+        @param es_page: encyc.models.elastic.Page
+        @param rg_titles: set Resource Guide url_titles (see elastic.Page.rg_titles).
+        @param render_pool: encyc.models.render.RenderPool (optional)
+        @param parser: str HTML parser (default: config.HTML_PARSER)
+        @returns: Page
+        """
+        pagedata = json.loads(rawtext)
+        page = Page()
+        page.url_title = es_page.url_title
+        page.uri = urls.reverse('wikiprox-page', args=[page.url_title])
+        page.status_code = 200
+        page.error = None
+        page.public = False
+        page.published = helpers.page_is_published(pagedata)
+        page.lastmod = es_page.modified
+        page.title = pagedata['parse']['displaytitle']
+        title_sort = ''
+        for prop in pagedata['parse']['properties']:
+            if prop.get('name',None) and prop['name'] \
+            and (prop['name'].lower() == 'defaultsort'):
+                title_sort = prop['*']
+        page.title_sort = make_titlesort(title_sort, page.title)
+        page.sources = [
+            {'encyclopedia_id': sid} for sid in (es_page.source_ids or [])
+        ]
+        rendered = Page._render(
+            page, pagedata, rawtext, True, False, rg_titles, render_pool, parser
+        )
+        # only articles are in the article index
+        page.is_article = True
+        page.description = rendered['description']
+        page.categories = list(es_page.categories or [])
+        page.prev_page = es_page.prev_page
+        page.next_page = es_page.next_page
+        page.coordinates = rendered['coordinates']
+        page.authors = rendered['authors']
+        page.is_author = False
+        return page
+    
     def topics(self):
         terms = Elasticsearch().topics_by_url().get(self.absolute_url(), [])
         for term in terms:
@@ -429,12 +603,19 @@ class Proxy(object):
     @staticmethod
     def sources_all():
         """Get all published sources from SOURCES_API.
+        
+        Also refreshes the local source mirror (see encyc.models.mirror).
         """
         URL = config.SOURCES_API + '/sources/'
         r = http.get(URL, headers={'content-type':'application/json'})
         if r.status_code != 200:
             raise ConnectionError(f'{r.status_code} {r.reason}')
-        return [Source.source(data) for data in json.loads(r.text)]
+        data = json.loads(r.text)
+        mirror = get_mirror()
+        counts = mirror.update(data, complete=True)
+        mirror.save()
+        logger.debug('source mirror: %s' % counts)
+        return [Source.source(source) for source in data]
 
     @staticmethod
     def citation(page):
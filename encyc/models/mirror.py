@@ -0,0 +1,170 @@
+"""encyc.models.mirror -- Local copy of the PSMS primary sources list
+
+Article publishing only needs a few fields of each primary source, and
+PSMS sources change rarely, so sources are looked up in a local mirror
+before asking PSMS.  The mirror is an in-memory index by encyclopedia_id,
+saved as a JSON snapshot at SOURCES_MIRROR_PATH.  It is refreshed from the
+full sources list whenever that is downloaded (see Proxy.sources_all):
+only records with a newer `modified` are replaced, and sources no longer
+in the list are removed.  Sources fetched from PSMS on a miss are added.
+
+Set [sources] mirror_path to an empty value to disable the mirror.
+
+>>> from encyc.models.mirror import get_mirror
+>>> mirror = get_mirror()
+>>> found,missing = mirror.lookup(eids)
+"""
+
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+import threading
+
+from dateutil import parser
+
+from encyc import config
+
+
+class SourceMirror():
+
+    def __init__(self, path=None):
+        """
+        @param path: str Snapshot file (default: SOURCES_MIRROR_PATH)
+        """
+        self.path = path if path is not None else config.SOURCES_MIRROR_PATH
+        # lowercase encyclopedia_id: source dict
+        self._sources = {}
+        # latest `modified` of any source
+        self.modified = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<%s.%s %s sources>' % (
+            self.__module__, self.__class__.__name__, len(self)
+        )
+
+    def __len__(self):
+        return len(self._sources)
+
+    def load(self):
+        """Read snapshot from disk, if there is one
+
+        @returns: SourceMirror
+        """
+        if not (self.path and os.path.exists(self.path)):
+            return self
+        try:
+            with open(self.path, 'r') as f:
+                data = json.loads(f.read())
+        except ValueError as err:
+            logger.error('bad source mirror %s: %s' % (self.path, err))
+            return self
+        self.update(data['sources'], complete=True)
+        return self
+
+    def save(self):
+        """Write snapshot to disk (atomically)
+
+        Errors are logged, not raised: the mirror is only a cache.
+
+        @returns: bool True if saved
+        """
+        if not self.path:
+            return False
+        with self._lock:
+            data = {
+                'modified': self.modified,
+                'sources': list(self._sources.values()),
+            }
+        tmp = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(data))
+            os.replace(tmp, self.path)
+        except OSError as err:
+            logger.error('could not save source mirror %s: %s' % (self.path, err))
+            return False
+        return True
+
+    def update(self, sources, complete=False):
+        """Add new sources and replace those with a newer `modified`
+
+        @param sources: list of source dicts from the sources API
+        @param complete: bool sources is the full list; remove any others.
+        @returns: dict Numbers of sources added, changed, removed
+        """
+        counts = {'added': 0, 'changed': 0, 'removed': 0}
+        with self._lock:
+            seen = set()
+            for source in sources:
+                key = source['encyclopedia_id'].lower()
+                seen.add(key)
+                modified = source.get('modified')
+                existing = self._sources.get(key)
+                if not existing:
+                    counts['added'] += 1
+                elif modified and _newer(modified, existing.get('modified')):
+                    counts['changed'] += 1
+                else:
+                    continue
+                self._sources[key] = source
+                if modified and _newer(modified, self.modified):
+                    self.modified = modified
+            if complete:
+                for key in [key for key in self._sources if key not in seen]:
+                    self._sources.pop(key)
+                    counts['removed'] += 1
+        return counts
+
+    def get(self, encyclopedia_id):
+        """
+        @param encyclopedia_id: str
+        @returns: source dict or None
+        """
+        return self._sources.get(encyclopedia_id.lower())
+
+    def lookup(self, eids):
+        """Sources in the mirror, and IDs that are not
+
+        @param eids: list of encyclopedia_ids
+        @returns: (list of source dicts, list of encyclopedia_ids)
+        """
+        found = []
+        missing = []
+        for eid in eids:
+            source = self.get(eid)
+            if source:
+                if source not in found:
+                    found.append(source)
+            elif eid not in missing:
+                missing.append(eid)
+        return found,missing
+
+
+def _newer(a, b):
+    """True if timestamp string a is later than b (or b is empty)
+    """
+    if not b:
+        return True
+    try:
+        return parser.parse(a) > parser.parse(b)
+    except (ValueError, TypeError):
+        return a != b
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+def get_mirror():
+    """The process's SourceMirror, loaded from its snapshot on first use
+
+    @returns: SourceMirror
+    """
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            _mirror = SourceMirror().load()
+            logger.debug('loaded %s' % _mirror)
+        return _mirror
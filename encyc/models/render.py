@@ -0,0 +1,190 @@
+"""encyc.models.render -- Render MediaWiki pages in a pool of worker processes
+
+BeautifulSoup work in wikipage.render_page is pure Python and holds the GIL,
+so extra threads do not make long articles render any faster.  RenderPool
+sends the raw page data to a pool of worker processes instead.
+
+- Workers are recycled after `maxtasks` pages so memory leaked by the parser
+  does not accumulate over a long run.
+- Each page gets `timeout` seconds.  A pathological article is interrupted
+  inside its worker (SIGALRM) and raises RenderTimeout; if the worker does not
+  respond at all the pool is rebuilt.
+- No more pages are submitted than there are workers, so time a page spends
+  waiting for a worker does not count against its timeout.
+
+Example:
+
+>>> from encyc.models.render import RenderPool
+>>> with RenderPool(processes=4, rg_titles=rg_titles) as pool:
+...     mwpage = LegacyPage.get(mw, title, render_pool=pool)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import json
+import logging
+logger = logging.getLogger(__name__)
+import signal
+import threading
+from typing import Any, Dict
+
+from encyc import config
+from encyc.models import wikipage
+
+# extra seconds the parent waits for a worker before giving up on it
+TIMEOUT_GRACE = 10
+
+# config for the current worker process; see _init_worker
+_WORKER: Dict[str,Any] = {}
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+def _init_worker(hidden_tags, rg_titles, timeout, parser):
+    """Runs once in each new worker process.
+
+    Config that is the same for every page is sent here once per worker
+    rather than pickled along with every page.
+    """
+    _WORKER['hidden_tags'] = hidden_tags
+    _WORKER['rg_titles'] = rg_titles
+    _WORKER['timeout'] = timeout
+    _WORKER['parser'] = parser
+
+def _alarm(signum, frame):
+    raise RenderTimeout()
+
+def _render(url_title, rawtext, primary_sources, databox_keys, public, migration):
+    """Runs in a worker process.
+
+    @returns: dict (see wikipage.render_page)
+    """
+    timeout = _WORKER.get('timeout')
+    if timeout:
+        signal.signal(signal.SIGALRM, _alarm)
+        signal.alarm(timeout)
+    try:
+        return wikipage.render_page(
+            url_title,
+            json.loads(rawtext),
+            primary_sources,
+            databox_keys,
+            hidden_tags=_WORKER.get('hidden_tags'),
+            rg_titles=_WORKER.get('rg_titles', []),
+            public=public,
+            migration=migration,
+            parser=_WORKER.get('parser'),
+        )
+    except RenderTimeout:
+        raise RenderTimeout('%s: render took more than %ss' % (url_title, timeout))
+    finally:
+        if timeout:
+            signal.alarm(0)
+
+
+class RenderPool():
+    """Pool of worker processes that run wikipage.render_page.
+
+    RenderPool.render is safe to call from multiple threads, e.g. from the
+    render stage of encyc.publish.articles.
+
+    @param processes: int Number of worker processes.
+    @param timeout: int Max seconds per page (0 = no limit).
+    @param maxtasks: int Pages rendered before a worker is replaced.
+    @param hidden_tags: list of "attrib=selector" strings (default: HIDDEN_TAGS)
+    @param rg_titles: set Resource Guide url_titles (see elastic.Page.rg_titles).
+    @param parser: str HTML parser (default: HTML_PARSER)
+    """
+
+    def __init__(self, processes=config.RENDER_PROCESSES,
+                 timeout=config.RENDER_TIMEOUT,
+                 maxtasks=config.RENDER_MAXTASKS,
+                 hidden_tags=None, rg_titles=[], parser=None):
+        if hidden_tags is None:
+            hidden_tags = config.HIDDEN_TAGS
+        self.processes = max(1, int(processes))
+        self.timeout = int(timeout)
+        self.maxtasks = int(maxtasks) or None
+        self.hidden_tags = hidden_tags
+        self.rg_titles = rg_titles
+        self.parser = parser or config.HTML_PARSER
+        self._lock = threading.Lock()
+        # pages submitted and not finished; see render
+        self._slots = threading.BoundedSemaphore(self.processes)
+        self._executor = self._new_executor()
+
+    def __repr__(self):
+        return '<%s.%s processes=%s timeout=%s maxtasks=%s>' % (
+            self.__module__, self.__class__.__name__,
+            self.processes, self.timeout, self.maxtasks
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            max_tasks_per_child=self.maxtasks,
+            initializer=_init_worker,
+            initargs=(self.hidden_tags, self.rg_titles, self.timeout, self.parser),
+        )
+
+    def _restart(self, executor):
+        """Replace a stuck or broken executor (unless another thread did).
+        """
+        with self._lock:
+            if self._executor is not executor:
+                return
+            logger.error('restarting render pool')
+            executor.shutdown(wait=False, cancel_futures=True)
+            # stop stuck workers now rather than when they finish (3.14+)
+            if hasattr(executor, 'terminate_workers'):
+                executor.terminate_workers()
+            self._executor = self._new_executor()
+
+    def render(self, url_title, rawtext, primary_sources, databox_keys={},
+               public=False, migration=False):
+        """Render a page in a worker process.
+
+        @param url_title: str
+        @param rawtext: str Raw JSON from MediaWiki action=parse API call.
+        @param primary_sources: list
+        @param databox_keys: dict
+        @param public: Boolean
+        @param migration: Boolean
+        @returns: dict (see wikipage.render_page)
+        """
+        args = (url_title, rawtext, primary_sources, databox_keys, public, migration)
+        # a page whose worker was killed by someone else's timeout gets one retry
+        for attempt in range(2):
+            # Wait here for a free worker so the page starts as soon as it is
+            # submitted and the timeout below only covers rendering it.
+            with self._slots:
+                executor = self._executor
+                try:
+                    future = executor.submit(_render, *args)
+                except BrokenProcessPool:
+                    self._restart(executor)
+                    continue
+                try:
+                    if self.timeout:
+                        return future.result(timeout=self.timeout + TIMEOUT_GRACE)
+                    return future.result()
+                except FuturesTimeoutError:
+                    self._restart(executor)
+                    raise RenderTimeout(
+                        '%s: worker did not respond in %ss' % (url_title, self.timeout)
+                    )
+                except BrokenProcessPool:
+                    self._restart(executor)
+        raise BrokenProcessPool('%s: render pool failed twice' % url_title)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -1,14 +1,21 @@
 from datetime import datetime
 import json
+import logging
+logger = logging.getLogger(__name__)
+import threading
 
 from bs4 import BeautifulSoup
 
 from encyc import config
 from encyc import http
+from encyc.models import helpers
+from encyc.models.mirror import get_mirror
 
 
 def source(encyclopedia_id):
-    source = None
+    source = get_mirror().get(encyclopedia_id)
+    if source:
+        return source
     url = '%s/sources/%s' % (config.SOURCES_API, encyclopedia_id)
     r = http.get(url, headers={'content-type':'application/json'})
     if r.status_code == 200:
@@ -17,6 +24,107 @@ def source(encyclopedia_id):
             source = response['objects'][0]
     return source
 
+class SourceResolver():
+    """Primary sources for many pages in a few sources API requests
+    
+    IDs are looked up in the local source mirror first (see
+    encyc.models.mirror).  Others, from many pages, are requested together
+    in batches that fit in a URL (see helpers.primary_sources_urls), the
+    batches requested concurrently.  Each page then gets its own sources from the
+    results.  IDs that are not sources (ordinary images) are remembered so
+    they are not requested again.
+    
+    >>> resolver = SourceResolver()
+    >>> resolver.prefetch(eids_from_all_pages)
+    >>> sources = resolver.resolve(page_eids)
+    >>> sources = await resolver.aresolve(page_eids)
+    """
+    
+    def __init__(self, api_url=config.SOURCES_API):
+        self.api_url = api_url
+        # lowercase encyclopedia_id: source dict, or None if not a source
+        self._sources = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+    
+    def __repr__(self):
+        return '<%s.%s %s sources>' % (
+            self.__module__, self.__class__.__name__, len(self)
+        )
+    
+    def __len__(self):
+        return len([s for s in self._sources.values() if s])
+    
+    def _missing(self, eids):
+        """Unique eids that have not been looked up yet or are not mirrored
+        """
+        mirror = get_mirror()
+        missing = []
+        for eid in eids:
+            if (eid.lower() in self._sources) or (eid in missing):
+                continue
+            source = mirror.get(eid)
+            if source:
+                with self._lock:
+                    self._sources[eid.lower()] = source
+            else:
+                missing.append(eid)
+        return missing
+    
+    def _store(self, batch, r):
+        """Record sources from a response; unreturned IDs are not sources
+        """
+        if isinstance(r, Exception) or (r.status_code != 200):
+            # leave the batch unresolved so it can be retried
+            logger.error('sources API %s: %s' % (batch, r))
+            return
+        with self._lock:
+            self.requests += 1
+            for eid in batch:
+                self._sources.setdefault(eid.lower(), None)
+            found = helpers.sources_from_response(r)
+            for source in found:
+                self._sources[source['encyclopedia_id'].lower()] = source
+        get_mirror().update(found)
+    
+    def _found(self, eids):
+        sources = []
+        for eid in eids:
+            source = self._sources.get(eid.lower())
+            if source and (source not in sources):
+                sources.append(source)
+        return sources
+    
+    def prefetch(self, eids):
+        """Look up any of the encyclopedia_ids not already known
+        
+        @param eids: list of encyclopedia_ids
+        """
+        batches = helpers.primary_sources_batches(self.api_url, self._missing(eids))
+        urls = [helpers._primary_sources_url(self.api_url, batch) for batch in batches]
+        for batch,r in zip(batches, http.get_many(urls)):
+            self._store(batch, r)
+    
+    def resolve(self, eids):
+        """Sources for one page's encyclopedia_ids, fetching any not known
+        
+        @param eids: list of encyclopedia_ids
+        @returns: list of source dicts
+        """
+        for batch in helpers.primary_sources_batches(self.api_url, self._missing(eids)):
+            r = http.get(helpers._primary_sources_url(self.api_url, batch))
+            self._store(batch, r)
+        return self._found(eids)
+    
+    async def aresolve(self, eids):
+        """asyncio version of resolve
+        """
+        for batch in helpers.primary_sources_batches(self.api_url, self._missing(eids)):
+            r = await http.aget(helpers._primary_sources_url(self.api_url, batch))
+            self._store(batch, r)
+        return self._found(eids)
+
+
 def published_sources():
     """Returns list of published Sources.
     """
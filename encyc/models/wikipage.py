@@ -15,7 +15,80 @@ from encyc.models import helpers
 TIMEOUT = float(config.MEDIAWIKI_API_TIMEOUT)
 
 
-def parse_mediawiki_text(title, html, primary_sources, public=False, printed=False, rg_titles=[], migration=False):
+def render_page(url_title, pagedata, primary_sources, databox_keys={},
+                hidden_tags=None, rg_titles=[], public=False, migration=False,
+                parser=None):
+    """Runs all the HTML extractors and transforms for a page.
+    
+    Everything here is pure CPU work on the page data: anything that talks
+    to MediaWiki or PSMS must happen before this is called.  This makes it
+    safe to run in a worker process (see encyc.models.render).
+    
+    The HTML is parsed once.  Extractors read the soup first, then the
+    transforms in transform_soup modify it in place.
+    
+    With parser='lxml-verify' the page is rendered with both lxml and
+    html.parser; if the results differ the html.parser result is used and
+    a warning is logged.
+    
+    @param url_title: str
+    @param pagedata: dict Output of MediaWiki action=parse API call.
+    @param primary_sources: list
+    @param databox_keys: dict Databox div IDs and field prefixes.
+    @param hidden_tags: list of "attrib=selector" strings (default: HIDDEN_TAGS)
+    @param rg_titles: set Resource Guide url_titles (see elastic.Page.rg_titles).
+    @param public: Boolean
+    @param migration: Boolean
+    @param parser: str One of helpers.PARSERS (default: config.HTML_PARSER)
+    @returns: dict
+    """
+    if parser is None:
+        parser = config.HTML_PARSER
+    args = (url_title, pagedata, primary_sources, databox_keys,
+            hidden_tags, rg_titles, public, migration)
+    if parser == 'lxml-verify':
+        rendered = _render_page(*args, parser='lxml')
+        expected = _render_page(*args, parser='html.parser')
+        if rendered != expected:
+            logger.warning('%s: lxml output differs, using html.parser' % url_title)
+            return expected
+        return rendered
+    return _render_page(*args, parser=parser)
+
+def _render_page(url_title, pagedata, primary_sources, databox_keys,
+                 hidden_tags, rg_titles, public, migration, parser):
+    """Called by render_page."""
+    html = pagedata['parse']['text']['*']
+    soup = helpers.make_soup(html, parser)
+    databoxes = extract_databoxes(soup, databox_keys)
+    published_rg = False
+    if databoxes and databoxes.get('rgdatabox-Core',{}).get('rgmediatype'):
+        published_rg = True
+    # Must be called before marker divs are removed in _remove_nonrg_divs
+    published_encyc = not not_published_encyc(soup)
+    helpers.remove_empty_paragraphs(soup)
+    authors = helpers.find_author_info(soup)
+    soup = transform_soup(
+        title=url_title,
+        soup=soup,
+        primary_sources=primary_sources,
+        public=public,
+        printed=False,
+        migration=migration,
+        rg_titles=rg_titles,
+        hidden_tags=hidden_tags,
+    )
+    return {
+        'databoxes': databoxes,
+        'published_encyc': published_encyc,
+        'published_rg': published_rg,
+        'body': soup_to_html(soup),
+        'description': extract_description(soup),
+        'coordinates': helpers.find_databoxcamps_coordinates(html),
+        'authors': authors,
+    }
+
+def parse_mediawiki_text(title, html, primary_sources, public=False, printed=False, rg_titles=[], migration=False, hidden_tags=None):
     """Parses the body of a MediaWiki page.
     
     @param title: str page title.
@@ -23,13 +96,34 @@ def parse_mediawiki_text(title, html, primary_sources, public=False, printed=Fal
     @param primary_sources: list
     @param public: Boolean
     @param printed: Boolean
-    @param rg_titles: list Resource Guide url_titles.
+    @param rg_titles: set Resource Guide url_titles (see elastic.Page.rg_titles).
+    @param migration: Boolean
+    @param hidden_tags: list of "attrib=selector" strings (default: HIDDEN_TAGS)
     @returns: html, list of primary sources
     """
-    soup = BeautifulSoup(
-        html.replace('<p><br />\n</p>',''),
-        'html.parser'
+    soup = transform_soup(
+        title, helpers.make_soup(html.replace(helpers.EMPTY_PARAGRAPH,'')),
+        primary_sources,
+        public=public, printed=printed, rg_titles=rg_titles,
+        migration=migration, hidden_tags=hidden_tags,
     )
+    return soup_to_html(soup)
+
+def transform_soup(title, soup, primary_sources, public=False, printed=False, rg_titles=[], migration=False, hidden_tags=None):
+    """Applies the parse_mediawiki_text transforms to soup in place.
+    
+    @param title: str page title.
+    @param soup: BeautifulSoup Parsed page body (see helpers.make_soup).
+    @param primary_sources: list
+    @param public: Boolean
+    @param printed: Boolean
+    @param rg_titles: set Resource Guide url_titles (see elastic.Page.rg_titles).
+    @param migration: Boolean
+    @param hidden_tags: list of "attrib=selector" strings (default: HIDDEN_TAGS)
+    @returns: soup
+    """
+    if hidden_tags is None:
+        hidden_tags = config.HIDDEN_TAGS
     soup = _mark_offsite_encyc_rg_links(soup, title, rg_titles)
     soup = _remove_staticpage_titles(soup)
     soup = _remove_comments(soup)
@@ -43,12 +137,20 @@ def parse_mediawiki_text(title, html, primary_sources, public=False, printed=Fal
         soup = _add_top_links(soup)
     soup = _remove_divs(
         soup,
-        selectors=config.HIDDEN_TAGS,
+        selectors=hidden_tags,
         comments=config.HIDDEN_TAG_COMMENTS
     )
     soup = _remove_nonrg_divs(soup)
     soup = _remove_primary_sources(soup, primary_sources)
     soup = _remove_SpecialUpload_links(soup)
+    return soup
+
+def soup_to_html(soup):
+    """Page body HTML from a transformed soup.
+    
+    @param soup: BeautifulSoup
+    @returns: str
+    """
     html = soup.prettify()
     html = _rewrite_mediawiki_urls(html)
     html = _rm_tags(html)
@@ -195,7 +297,7 @@ def _mark_offsite_encyc_rg_links(soup, title, rg_titles=[]):
     
     @param soup: BeautifulSoup object containing page
     @param title: str Page.url_title
-    @param rg_titles: list Resource Guide url_titles.
+    @param rg_titles: set Resource Guide url_titles (see elastic.Page.rg_titles).
     """
     for a in soup.find_all("a"):
         #print(a)
@@ -390,11 +492,11 @@ def extract_databoxes(body, databox_divs_namespaces={}):
         }
     }
     
-    @param body: str raw HTML
+    @param body: str raw HTML or BeautifulSoup
     @param databox_divs_namespaces: dict
     @returns: str,OrderedDict
     """
-    soup = BeautifulSoup(body, 'html.parser')
+    soup = helpers.make_soup(body)
     if databox_divs_namespaces:
         # get divs in the list
         tags = [
@@ -438,17 +540,41 @@ def extract_databoxes(body, databox_divs_namespaces={}):
 def extract_description(body):
     """Gets just the first paragraph of an article
     
-    @param body: str raw HTML
+    Given a transformed soup (see render_page) each candidate <p> is
+    rendered as it would be in soup_to_html, so the result is the same as
+    for the finished body HTML without having to parse the whole body again.
+    
+    @param body: str HTML from parse_mediawiki_text, or transformed BeautifulSoup
     @returns: str
     """
-    soup = BeautifulSoup(body, 'html.parser')
-    for p in soup.find_all('p'):
+    if isinstance(body, BeautifulSoup):
+        paragraphs = (_prettified_fragment(p) for p in body.find_all('p'))
+    else:
+        paragraphs = BeautifulSoup(body, 'html.parser').find_all('p')
+    for p in paragraphs:
         if p.text and not (';\n' in p.text):
             return p.text.strip()
     return ''
 
+def _prettified_fragment(tag):
+    """Soup for tag as it appears in soup_to_html output
+    
+    prettify() adds whitespace according to nesting depth, and that
+    whitespace ends up in tag.text.
+    """
+    if tag.find_parent(list(tag.preserve_whitespace_tags or [])):
+        html = tag.decode()
+    else:
+        html = tag.decode(indent_level=len(list(tag.parents)) - 1)
+    html = _rm_tags(_rewrite_mediawiki_urls(html))
+    return BeautifulSoup(html, 'html.parser')
+
 def not_published_encyc(body):
-    soup = BeautifulSoup(body, 'html.parser')
+    """
+    @param body: str raw HTML or BeautifulSoup
+    @returns: bool
+    """
+    soup = helpers.make_soup(body)
     for div in soup.find_all('div', attrs={'class':'nopublish-encycfront'}):
         return True
     return False
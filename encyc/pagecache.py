@@ -0,0 +1,143 @@
+"""encyc.pagecache -- MediaWiki parse output cached on disk by revision
+
+Page data (action=parse JSON) for a given page revision never changes, so it
+is stored as PAGEDATA_CACHE_DIR/PAGEID/REVID.json and reused until the page
+is edited.  Only the latest revision of each page is kept.  If the cache
+grows past PAGEDATA_CACHE_MAX_MB the least recently used files are removed
+(see evict).
+
+Set [mediawiki] pagedata_cache_dir to an empty value to disable the cache.
+
+>>> from encyc import pagecache
+>>> rawtext = pagecache.get(pageid, revid)  # None if not cached
+>>> pagecache.put(rawtext)
+>>> pagecache.evict()
+"""
+
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+import threading
+
+from encyc import config
+
+
+def enabled(cache_dir=None):
+    return bool(cache_dir or config.PAGEDATA_CACHE_DIR)
+
+def _path(pageid, revid, cache_dir=None):
+    return os.path.join(
+        cache_dir or config.PAGEDATA_CACHE_DIR, str(pageid), '%s.json' % revid
+    )
+
+def get(pageid, revid, cache_dir=None):
+    """Cached page data for a page revision, or None.
+
+    @param pageid: int
+    @param revid: int
+    @param cache_dir: str (default: PAGEDATA_CACHE_DIR)
+    @returns: str page data JSON or None
+    """
+    if not enabled(cache_dir):
+        return None
+    path = _path(pageid, revid, cache_dir)
+    try:
+        with open(path, 'r') as f:
+            rawtext = f.read()
+    except OSError:
+        return None
+    # mark as recently used (see evict)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    logger.debug('pagecache hit %s' % path)
+    return rawtext
+
+def put(rawtext, cache_dir=None):
+    """Store page data under its pageid and revid, replacing older revisions.
+
+    Errors (e.g. missingtitle) are not stored.  If the file can't be
+    written (e.g. disk full) the error is logged and the page is simply
+    not cached.
+
+    @param rawtext: str page data JSON
+    @param cache_dir: str (default: PAGEDATA_CACHE_DIR)
+    @returns: str path or None
+    """
+    if not enabled(cache_dir):
+        return None
+    try:
+        parse = json.loads(rawtext)['parse']
+        pageid,revid = parse['pageid'], parse['revid']
+    except (ValueError, KeyError, TypeError):
+        return None
+    path = _path(pageid, revid, cache_dir)
+    page_dir = os.path.dirname(path)
+    tmp = '%s.%s-%s.tmp' % (path, os.getpid(), threading.get_ident())
+    try:
+        os.makedirs(page_dir, exist_ok=True)
+        with open(tmp, 'w') as f:
+            f.write(rawtext)
+        os.replace(tmp, path)
+    except OSError as err:
+        logger.error('pagecache: could not write %s: %s' % (path, err))
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return None
+    for filename in os.listdir(page_dir):
+        if filename.endswith('.json') and (filename != os.path.basename(path)):
+            try:
+                os.remove(os.path.join(page_dir, filename))
+            except OSError:
+                pass
+    return path
+
+def paths(cache_dir=None):
+    """Paths of all cached page data files
+
+    @param cache_dir: str (default: PAGEDATA_CACHE_DIR)
+    @returns: generator of str
+    """
+    cache_dir = cache_dir or config.PAGEDATA_CACHE_DIR
+    if not (cache_dir and os.path.exists(cache_dir)):
+        return
+    for dirpath,dirnames,filenames in os.walk(cache_dir):
+        for filename in filenames:
+            if filename.endswith('.json'):
+                yield os.path.join(dirpath, filename)
+
+def evict(max_bytes=None, cache_dir=None):
+    """Remove least recently used files until cache is under max_bytes
+
+    @param max_bytes: int (default: PAGEDATA_CACHE_MAX_MB)
+    @param cache_dir: str (default: PAGEDATA_CACHE_DIR)
+    @returns: int Number of files removed
+    """
+    if max_bytes is None:
+        max_bytes = config.PAGEDATA_CACHE_MAX_MB * 1024 * 1024
+    files = []
+    total = 0
+    for path in paths(cache_dir):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    removed = 0
+    for mtime,size,path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        logger.debug('pagecache evicted %s files' % removed)
+    return removed
@@ -0,0 +1,238 @@
+"""encyc.pipeline -- Bounded multi-stage worker pipelines
+
+Long publish runs spend most of their time waiting on MediaWiki, then on the
+CPU, then on Elasticsearch.  A Pipeline splits the work for each item into
+Stages, each with its own pool of worker threads and its own bounded input
+queue.  When a stage falls behind its queue fills up and the stages feeding it
+block (backpressure) so memory use stays flat no matter how many items go in.
+
+Example:
+
+>>> from encyc import pipeline
+>>> stages = [
+...     pipeline.Stage('fetch', fetch_title, workers=8),
+...     pipeline.Stage('render', render_page, workers=2),
+...     pipeline.Stage('index', save_page, workers=2),
+... ]
+>>> for job in pipeline.run(titles, stages):
+...     if job.error:
+...         print(job.item, job.stage, job.error)
+
+Jobs come back in completion order, not input order.
+
+An AsyncStage runs a coroutine function on one event loop with many jobs
+in flight, e.g. to fetch with http.aget instead of a thread per request:
+
+>>> pipeline.AsyncStage('fetch', afetch_title, concurrency=8)
+"""
+
+import asyncio
+import logging
+logger = logging.getLogger(__name__)
+import queue
+import threading
+
+# marks the end of a queue
+_STOP = object()
+
+
+class Job():
+    """An item moving through the stages of a pipeline.
+
+    @param item: The original input (e.g. an article title).
+    """
+    def __init__(self, item):
+        self.item = item
+        # output of the most recent stage
+        self.data = item
+        # exception raised by a stage (if any), and name of that stage
+        self.error = None
+        self.stage = None
+
+    def __repr__(self):
+        if self.error:
+            return '<%s.%s "%s" %s:%s>' % (
+                self.__module__, self.__class__.__name__,
+                self.item, self.stage, self.error
+            )
+        return '<%s.%s "%s">' % (
+            self.__module__, self.__class__.__name__, self.item
+        )
+
+
+class Stage():
+    """A step in a pipeline, run by its own pool of worker threads.
+
+    @param name: str Used in logs and error reports.
+    @param func: function Takes the output of the previous stage, returns input
+                 for the next stage.
+    @param workers: int Number of worker threads.
+    @param maxsize: int Max jobs waiting in this stage's queue (default: 2*workers).
+    """
+    def __init__(self, name, func, workers=1, maxsize=0):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.maxsize = maxsize or (self.workers * 2)
+
+    def __repr__(self):
+        return '<%s.%s %s workers=%s>' % (
+            self.__module__, self.__class__.__name__, self.name, self.workers
+        )
+
+    def process(self, job):
+        """Run func on job unless an earlier stage failed; never raises.
+        """
+        if job.error is None:
+            try:
+                job.data = self.func(job.data)
+            except Exception as err:
+                logger.debug('%s %s: %s' % (self.name, job.item, err))
+                job.error = err
+                job.stage = self.name
+        return job
+
+
+class AsyncStage(Stage):
+    """A step in a pipeline whose func is a coroutine function.
+
+    One worker thread runs an event loop with up to concurrency jobs in
+    flight.  Jobs are taken from the input queue only when there is room, so
+    backpressure works as with Stage.
+
+    @param name: str Used in logs and error reports.
+    @param func: coroutine function Takes the output of the previous stage,
+                 returns input for the next stage.
+    @param concurrency: int Max jobs in flight.
+    @param maxsize: int Max jobs waiting in this stage's queue (default: 2*concurrency).
+    """
+    def __init__(self, name, func, concurrency=1, maxsize=0):
+        self.concurrency = max(1, int(concurrency))
+        super(AsyncStage, self).__init__(
+            name, func, workers=1, maxsize=maxsize or (self.concurrency * 2)
+        )
+
+    def __repr__(self):
+        return '<%s.%s %s concurrency=%s>' % (
+            self.__module__, self.__class__.__name__, self.name, self.concurrency
+        )
+
+    async def aprocess(self, job):
+        """Await func on job unless an earlier stage failed; never raises.
+        """
+        if job.error is None:
+            try:
+                job.data = await self.func(job.data)
+            except Exception as err:
+                logger.debug('%s %s: %s' % (self.name, job.item, err))
+                job.error = err
+                job.stage = self.name
+        return job
+
+    def process(self, job):
+        return asyncio.run(self.aprocess(job))
+
+    async def serve(self, inq, outq):
+        """Process jobs from inq until _STOP, putting them on outq
+        """
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        async def one(job):
+            try:
+                job = await self.aprocess(job)
+                await loop.run_in_executor(None, outq.put, job)
+            finally:
+                slots.release()
+        while True:
+            await slots.acquire()
+            job = await loop.run_in_executor(None, inq.get)
+            if job is _STOP:
+                slots.release()
+                break
+            task = loop.create_task(one(job))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+
+def run(items, stages, serial=False):
+    """Push items through stages; yield finished Jobs as they complete.
+
+    A Job that fails at any stage skips the remaining stages and is yielded
+    with Job.error and Job.stage set, so one bad item never stops the run.
+
+    @param items: iterable
+    @param stages: list of Stage
+    @param serial: bool Process one item at a time in the calling thread.
+    @returns: generator of Job
+    """
+    if serial:
+        return _run_serial(items, stages)
+    return _run_threaded(items, stages)
+
+def _run_serial(items, stages):
+    for item in items:
+        job = Job(item)
+        for stage in stages:
+            job = stage.process(job)
+        yield job
+
+def _run_threaded(items, stages):
+    # queues[n] feeds stages[n]; the last queue is the output
+    queues = [queue.Queue(maxsize=stage.maxsize) for stage in stages]
+    queues.append(queue.Queue(maxsize=stages[-1].maxsize))
+    feeder_errors = []
+
+    def feed():
+        try:
+            for item in items:
+                queues[0].put(Job(item))
+        except Exception as err:
+            feeder_errors.append(err)
+        finally:
+            for _ in range(stages[0].workers):
+                queues[0].put(_STOP)
+
+    def work(n, stage, remaining, lock):
+        inq = queues[n]
+        outq = queues[n+1]
+        if isinstance(stage, AsyncStage):
+            asyncio.run(stage.serve(inq, outq))
+        else:
+            while True:
+                job = inq.get()
+                if job is _STOP:
+                    break
+                outq.put(stage.process(job))
+        # last worker out tells the next stage to stop
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            if n+1 < len(stages):
+                for _ in range(stages[n+1].workers):
+                    outq.put(_STOP)
+            else:
+                outq.put(_STOP)
+
+    threads = [threading.Thread(target=feed, name='pipeline-feed', daemon=True)]
+    for n,stage in enumerate(stages):
+        remaining = [stage.workers]
+        lock = threading.Lock()
+        for x in range(stage.workers):
+            threads.append(threading.Thread(
+                target=work, args=(n, stage, remaining, lock),
+                name='pipeline-%s-%s' % (stage.name, x), daemon=True,
+            ))
+    for thread in threads:
+        thread.start()
+    outq = queues[-1]
+    while True:
+        job = outq.get()
+        if job is _STOP:
+            break
+        yield job
+    if feeder_errors:
+        raise feeder_errors[0]
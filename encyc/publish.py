@@ -1,21 +1,34 @@
 import codecs
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 import json
 import logging
 logger = logging.getLogger(__name__)
 import os
+import random
 import sys
 
 from elastictools.docstore import cluster as docstore_cluster
-from elastictools.docstore import TransportError, NotFoundError, SerializationError
+from elastictools.docstore import TransportError, NotFoundError
 from encyc import config
+from encyc.docstore import ORIGINAL_VERSION
+from encyc import http
 from encyc.models.legacy import Page as LegacyPage, Proxy
-from encyc.models.elastic import Elasticsearch
+from encyc.models.elastic import Elasticsearch, compare_hashes, content_hashes
+from encyc.models.elastic import count_index, mget
 from encyc.models.elastic import Author, Page, Source
 from encyc.models.elastic import Facet, FacetTerm
+from encyc.models.render import RenderPool
+from encyc.models.sources import SourceResolver
+from encyc import pipeline
+from encyc import pagecache
 from encyc import rsync
+from encyc import state
 from encyc import wiki
+from encyc.repo_models import ELASTICSEARCH_CLASSES
+from encyc.models import helpers
 from encyc.models import wikipage
 
 
@@ -106,9 +119,9 @@ def status(ds):
     mw_articles = Proxy.articles_lastmod(mw)
     num_mw_authors = len(mw_author_titles)
     num_mw_articles = len(mw_articles)
-    num_es_authors = Author.authors(ds).total
-    num_es_articles = Page.pages(ds).total
-    num_es_sources = Source.sources(ds).total
+    num_es_authors = Author.count(ds)
+    num_es_articles = Page.count(ds)
+    num_es_sources = Source.count(ds)
     pc_authors = float(num_es_authors) / num_mw_authors
     pc_articles = float(num_es_articles) / num_mw_articles
     logprint('debug', ' authors: {} of {} ({:.2%})'.format(
@@ -141,30 +154,48 @@ def mappings(ds):
     pass
 
 @stopwatch
-def authors(ds, report=False, dryrun=False, force=False, title=None):
+def authors(ds, report=False, dryrun=False, force=False, title=None,
+            verify_sample=config.PUBLISH_VERIFY_SAMPLE,
+            parser=config.HTML_PARSER, incremental=False,
+            max_hours=config.PUBLISH_INCREMENTAL_MAX_HOURS,
+            resume=False, run_id=None, state_name='authors'):
     logprint('debug', f'MediaWiki login ({config.MEDIAWIKI_SCHEME}://{config.MEDIAWIKI_HOST})')
     mw = wiki.MediaWiki()
     logprint('debug', '------------------------------------------------------------------------')
+    changes = None
+    if incremental and not title:
+        changes = _recent_changes(mw, 'authors', max_hours)
+    mark = changes['timestamp'] if changes else mw.current_timestamp()
+    # loops below reuse the name "title"
+    record_mark = not (title or dryrun)
     logprint('debug', f'getting mw_authors ({config.MEDIAWIKI_API})')
     mw_author_titles = Proxy.authors(mw, cached_ok=False)
     mw_articles = Proxy.articles_lastmod(mw)
     logprint('debug', 'mediawiki authors: %s' % len(mw_author_titles))
     logprint('debug', f'getting es_authors ({ds.host})')
-    es_authors = Author.authors(ds)
-    logprint('debug', 'elasticsearch authors: %s' % es_authors.total)
+    logprint('debug', 'elasticsearch authors: %s' % Author.count(ds))
     
     if title:
         authors_new = [title]
     else:
         if force:
             logprint('debug', 'forcibly update all authors')
-            authors_new = [page['title'] for page in es_authors.objects]
-            authors_delete = []
+            # all published authors in MediaWiki, not just those in the index
+            # (which may be new and empty, see reindex)
+            authors_new,authors_delete = Elasticsearch.authors_to_update(
+                mw_author_titles, mw_articles, []
+            )
+        elif changes:
+            logprint('debug', 'incremental: changes since last run...')
+            authors_new = sorted(
+                t for t in changes['updated'] if t in mw_author_titles
+            )
+            authors_delete = sorted(changes['deleted'])
         else:
             logprint('debug', 'determining new,delete...')
             authors_new,authors_delete = Elasticsearch.authors_to_update(
                 mw_author_titles, mw_articles,
-                es_authors.objects
+                Author.iter_authors(ds)
             )
         logprint('debug', 'authors to add: %s' % len(authors_new))
         #logprint('debug', 'authors to delete: %s' % len(authors_delete))
@@ -179,13 +210,22 @@ def authors(ds, report=False, dryrun=False, force=False, title=None):
     #    if not dryrun:
     #        author.delete()
      
+    journal = _journal(state_name, run_id, resume and not title, record_mark)
+    authors_new = _not_done(authors_new, journal)
     logprint('debug', 'adding...')
+    hashes = {} if title else content_hashes(ds, 'author', Author)
+    posted = 0
+    unchanged = 0
     errors = []
+    def saved(result):
+        if _check_saved(ds, Author, result, errors, verify_sample):
+            journal.add(result['id'])
+    writer = ds.bulk_writer(callback=saved)
     for n,title in enumerate(authors_new):
         logprint('debug', '--------------------')
         logprint('debug', '%s/%s %s' % (n, len(authors_new), title))
         logprint('debug', 'getting from mediawiki')
-        mwauthor = LegacyPage.get(mw, title)
+        mwauthor = LegacyPage.get(mw, title, parser=parser)
         try:
             existing_author = Author.get(title)
             logprint('debug', 'exists in elasticsearch')
@@ -193,52 +233,121 @@ def authors(ds, report=False, dryrun=False, force=False, title=None):
             existing_author = None
         logprint('debug', 'creating author')
         author = Author.from_mw(mwauthor, author=existing_author)
+        compared = compare_hashes(hashes, author)
+        if compared != 'changed':
+            logprint('debug', 'unchanged')
+            unchanged += 1
+            if compared == 'modified' and not dryrun:
+                writer.update('author', author.meta.id, {'modified': author.modified})
+            else:
+                journal.add(author.meta.id)
+            continue
+        posted += 1
         if not dryrun:
             logprint('debug', 'saving')
-            out = author.save(ds)
-            try:
-                a = Author.get(ds, title)
-            except NotFoundError:
-                logprint('error', 'ERROR: Author(%s) NOT SAVED!' % title)
-                errors.append(title)
+            writer.index('author', author)
+    writer.close()
+    logprint('info', 'authors posted: %s, unchanged (skipped): %s' % (posted, unchanged))
     if errors:
         logprint('info', 'ERROR: %s titles were unpublishable:' % len(errors))
         for title in errors:
             logprint('info', 'ERROR: %s' % title)
+    _finish(journal, errors)
+    if record_mark and not journal.resumed:
+        _write_mark(state_name, mark, errors)
+    _evict_pagecache()
     logprint('debug', 'DONE')
 
 @stopwatch
-def articles(ds, report=False, dryrun=False, force=False, title=None):
+def articles(ds, report=False, dryrun=False, force=False, title=None,
+             workers=config.PUBLISH_WORKERS,
+             fetch_concurrency=config.PUBLISH_FETCH_CONCURRENCY,
+             render_processes=config.RENDER_PROCESSES,
+             verify_sample=config.PUBLISH_VERIFY_SAMPLE,
+             parser=config.HTML_PARSER, incremental=False,
+             max_hours=config.PUBLISH_INCREMENTAL_MAX_HOURS,
+             resume=False, run_id=None, state_name='articles'):
+    """Publish articles from MediaWiki to Elasticsearch.
+    
+    Each title goes through three stages: fetch (MediaWiki), render
+    (parse and build the Page), and index (Elasticsearch).  If workers or
+    fetch_concurrency is greater than 1 the stages run as a pipeline, each
+    with a bounded queue.  Render and index have their own pools of threads;
+    fetch runs up to fetch_concurrency titles at a time on one event loop,
+    with requests limited by HTTP_CONCURRENCY and HTTP_PER_HOST.
+    
+    With incremental, only titles in the MediaWiki recentchanges feed since
+    the last completed run are published.  If there is no record of a
+    previous run, or it is older than max_hours, all articles are compared
+    with Elasticsearch as usual.
+    
+    Completed titles are recorded in a journal (see state.Journal).  With
+    resume, titles completed by an interrupted run are skipped.  A resumed
+    run does not advance the incremental high-water mark.
+    
+    @param ds: DocstoreManager
+    @param report: bool Just report number of records to be updated.
+    @param dryrun: bool Do everything except write to Elasticsearch.
+    @param force: bool Update all articles whether they need it or not.
+    @param title: str Publish a single article.
+    @param workers: int Threads for the render and index stages.
+    @param fetch_concurrency: int Titles in flight in the fetch stage.
+    @param render_processes: int Render in a pool of worker processes.
+    @param verify_sample: float Read back this fraction of saved pages.
+    @param parser: str HTML parser (see helpers.PARSERS).
+    @param incremental: bool Only publish titles changed since the last run.
+    @param max_hours: int Max age of last run for incremental.
+    @param resume: bool Skip titles completed by an interrupted run.
+    @param run_id: str Journal run ID (default: resume the last run).
+    @param state_name: str Name of the journal and high-water mark.
+    """
     logprint('debug', '------------------------------------------------------------------------')
     logprint('debug', f'MediaWiki login ({config.MEDIAWIKI_SCHEME}://{config.MEDIAWIKI_HOST})')
     mw = wiki.MediaWiki()
+    changes = None
+    if incremental and not title:
+        changes = _recent_changes(mw, 'articles', max_hours)
+    mark = changes['timestamp'] if changes else mw.current_timestamp()
+    # loops below reuse the name "title"
+    record_mark = not (title or dryrun)
     # authors need to be refreshed
     logprint('debug', f'getting mw_authors,articles ({config.MEDIAWIKI_API})')
     mw_author_titles = Proxy.authors(mw, cached_ok=False)
     mw_articles = Proxy.articles_lastmod(mw)
     logprint('debug', f'getting es_articles ({ds.host})')
-    es_articles = Page.pages(ds)
     logprint('debug', 'mediawiki articles: %s' % len(mw_articles))
-    logprint('debug', 'elasticsearch articles: %s' % es_articles.total)
+    logprint('debug', 'elasticsearch articles: %s' % Page.count(ds))
     
     if title:
         articles_update = [title]
     else:
         if force:
             logprint('debug', 'forcibly update all articles')
-            articles_update = [page['title'] for page in es_articles.objects]
-            articles_delete = []
+            # all published articles in MediaWiki, not just those in the index
+            # (which may be new and empty, see reindex)
+            articles_update,articles_delete = Elasticsearch.articles_to_update(
+                mw_author_titles, mw_articles, []
+            )
+        elif changes:
+            logprint('debug', 'incremental: changes since last run...')
+            articles_update = _incremental_articles(
+                ds, changes, mw_author_titles, mw_articles
+            )
+            articles_delete = sorted(changes['deleted'])
         else:
             logprint('debug', 'determining new,delete...')
             articles_update,articles_delete = Elasticsearch.articles_to_update(
                 mw_author_titles, mw_articles,
-                es_articles.objects
+                Page.iter_pages(ds)
             )
         logprint('debug', 'articles to update: %s' % len(articles_update))
         #logprint('debug', 'articles to delete: %s' % len(articles_delete))
         if report:
             return
     
+    journal = _journal(state_name, run_id, resume and not title, record_mark)
+    articles_update = _not_done(articles_update, journal)
+    
     logprint('debug', 'getting encycrg titles...')
     rg_titles = Page.rg_titles()
     logprint('debug', 'encycrg titles: %s' % len(rg_titles))
@@ -246,46 +355,66 @@ def articles(ds, report=False, dryrun=False, force=False, title=None):
         logprint('info', 'NO ENCYC-RG ARTICLES!!!')
         logprint('info', 'RUN "encyc articles --force" AFTER THIS PASS TO MARK rg/notrg LINKS')
     
-    logprint('debug', 'adding articles...')
+    logprint('debug', 'getting primary sources...')
+    resolver = _source_resolver(mw, articles_update)
+    logprint('debug', 'primary sources: %s (%s requests)' % (
+        len(resolver), resolver.requests
+    ))
+    
+    serial = (workers <= 1) and (fetch_concurrency <= 1)
+    if serial:
+        logprint('debug', 'adding articles...')
+    else:
+        logprint('debug', 'adding articles (fetch %s, render %s, index %s workers)...' % (
+            fetch_concurrency, workers, workers
+        ))
+    stages = [
+        pipeline.AsyncStage(
+            'fetch', lambda title: _article_fetch(title, resolver),
+            concurrency=fetch_concurrency
+        ),
+        pipeline.Stage(
+            'render', lambda item: _article_render(
+                ds, mw, item, rg_titles, render_pool, parser, dryrun
+            ),
+            workers=workers
+        ),
+        pipeline.Stage(
+            'index', lambda item: _article_index(writer, item, hashes, dryrun),
+            workers=workers
+        ),
+    ]
+    hashes = {} if title else content_hashes(ds, 'article', Page)
     posted = 0
+    unchanged = 0
     could_not_post = []
     unpublished = []
     errors = []
-    for n,title in enumerate(articles_update):
-        logprint('debug', '--------------------')
-        logprint('debug', '%s/%s %s' % (n+1, len(articles_update), title))
-        logprint('debug', 'getting from mediawiki')
-        mwpage = LegacyPage.get(mw, title, rg_titles=rg_titles)
-        try:
-            existing_page = Page.get(title)
-            logprint('debug', 'exists in elasticsearch')
-        except:
-            existing_page = None
-        
-        if (mwpage.published or config.MEDIAWIKI_SHOW_UNPUBLISHED):
-            
-            logprint('debug', 'creating page')
-            page = Page.from_mw(mwpage, page=existing_page)
-            if not dryrun:
-                logprint('debug', 'saving %s "%s"' % ('articles', page.url_title))
-                try:
-                    page.save(ds)
-                except SerializationError:
-                    logprint('error', 'ERROR: Could not serialize to Elasticsearch!')
-                try:
-                    p = Page.get(ds, title)
-                except NotFoundError:
-                    logprint('error', 'ERROR: Page(%s) NOT SAVED!' % title)
-                    errors.append(title)
-                logprint('debug', 'ok')
-        
-        else:
-            # delete from ES if present
-            logprint('debug', 'not publishable: %s' % mwpage)
-            if existing_page:
-                logprint('debug', 'deleting...')
-                existing_page.delete(ds)
-                unpublished.append(mwpage)
+    num = len(articles_update)
+    def saved(result):
+        if _check_saved(ds, Page, result, errors, verify_sample):
+            journal.add(result['id'])
+    # buffered writes are sent and render workers stopped even if the run fails
+    with _render_pool(render_processes, rg_titles, parser) as render_pool, \
+    ds.bulk_writer(callback=saved) as writer:
+        for n,job in enumerate(pipeline.run(articles_update, stages, serial=serial)):
+            if job.error:
+                logprint('error', 'ERROR: %s/%s %s (%s) %s' % (
+                    n+1, num, job.item, job.stage, job.error
+                ))
+                could_not_post.append(job.item)
+                continue
+            item = job.data
+            if item.get('unpublished'):
+                unpublished.append(item['unpublished'])
+                journal.add(job.item)
+            elif item.get('unchanged'):
+                unchanged += 1
+                journal.add(job.item)
+            elif item.get('page'):
+                posted += 1
+            logprint('debug', '%s/%s %s ok' % (n+1, num, job.item))
+    logprint('info', 'articles posted: %s, unchanged (skipped): %s' % (posted, unchanged))
     
     if could_not_post:
         logprint('debug', '========================================================================')
@@ -301,10 +430,363 @@ def articles(ds, report=False, dryrun=False, force=False, title=None):
         logprint('info', 'NO ENCYC-RG ARTICLES!!!')
         logprint('info', 'RUN "encyc articles --force" AFTER THIS PASS TO MARK rg/notrg LINKS')
         logprint('info', 'NOTE: ENCYC-RG MUST BE ACCESSIBLE IN ORDER TO BUILD RG ARTICLES LIST.')
+    _finish(journal, could_not_post + errors)
+    if record_mark and not journal.resumed:
+        _write_mark(state_name, mark, could_not_post + errors)
+    _evict_pagecache()
+    logprint('debug', 'DONE')
+
+# fields of existing Pages used by rerender (see LegacyPage.rerender)
+RERENDER_FIELDS = [
+    'url_title', 'title', 'modified', 'source_ids', 'categories',
+    'prev_page', 'next_page',
+]
+
+@stopwatch
+def rerender(ds, dryrun=False, title=None,
+             workers=config.PUBLISH_WORKERS,
+             render_processes=config.RENDER_PROCESSES,
+             verify_sample=config.PUBLISH_VERIFY_SAMPLE,
+             parser=config.HTML_PARSER):
+    """Re-render published articles from cached page data.
+    
+    Applies changes to rendering (HIDDEN_TAGS, databoxes, link marking,
+    etc) without requesting anything from MediaWiki.  Every page in the
+    pagedata cache (see pagecache) that is also in Elasticsearch is rendered
+    with LegacyPage.rerender and Page.from_mw and bulk-written.  Pages whose
+    rendered content is unchanged are skipped.  New, changed, or unpublished
+    pages are left to "encyc articles".
+    
+    @param ds: DocstoreManager
+    @param dryrun: bool Do everything except write to Elasticsearch.
+    @param title: str Rerender a single article.
+    @param workers: int Threads for the render and index stages.
+    @param render_processes: int Render in a pool of worker processes.
+    @param verify_sample: float Read back this fraction of saved pages.
+    @param parser: str HTML parser (see helpers.PARSERS).
+    """
+    logprint('debug', '------------------------------------------------------------------------')
+    if not pagecache.enabled():
+        logprint('error', 'Page data cache is disabled ([mediawiki] pagedata_cache_dir)')
+        return
+    logprint('debug', f'getting es_articles ({ds.host})')
+    es_pages = {
+        page.meta.id: page
+        for page in Page.iter_pages(ds, fields=RERENDER_FIELDS)
+        if (not title) or (page.meta.id == title)
+    }
+    logprint('debug', 'elasticsearch articles: %s' % len(es_pages))
+    hashes = content_hashes(ds, 'article', Page)
+    
+    logprint('debug', 'getting encycrg titles...')
+    rg_titles = Page.rg_titles()
+    logprint('debug', 'encycrg titles: %s' % len(rg_titles))
+    
+    stages = [
+        pipeline.Stage(
+            'render', lambda path: _rerender_page(
+                path, es_pages, rg_titles, render_pool, parser
+            ),
+            workers=workers
+        ),
+        pipeline.Stage(
+            'index', lambda item: _article_index(writer, item, hashes, dryrun),
+            workers=workers
+        ),
+    ]
+    posted = 0
+    unchanged = 0
+    not_indexed = 0
+    could_not_render = []
+    errors = []
+    def saved(result):
+        _check_saved(ds, Page, result, errors, verify_sample)
+    with _render_pool(render_processes, rg_titles, parser) as render_pool, \
+    ds.bulk_writer(callback=saved) as writer:
+        jobs = pipeline.run(pagecache.paths(), stages, serial=(workers <= 1))
+        for n,job in enumerate(jobs):
+            if job.error:
+                logprint('error', 'ERROR: %s (%s) %s' % (job.item, job.stage, job.error))
+                could_not_render.append(job.item)
+                continue
+            item = job.data
+            if item.get('unchanged'):
+                unchanged += 1
+            elif item.get('page'):
+                posted += 1
+                logprint('debug', '%s %s ok' % (n+1, item['title']))
+            else:
+                not_indexed += 1
+    logprint('info', 'articles posted: %s, unchanged (skipped): %s, not in index: %s' % (
+        posted, unchanged, not_indexed
+    ))
+    if could_not_render:
+        logprint('debug', '========================================================================')
+        logprint('debug', 'Could not render these: %s' % could_not_render)
+    if errors:
+        logprint('info', 'ERROR: %s titles were unpublishable:' % len(errors))
+        for title in errors:
+            logprint('info', 'ERROR: %s' % title)
     logprint('debug', 'DONE')
 
+def _render_pool(processes, rg_titles, parser):
+    """RenderPool for the articles and rerender pipelines, or a no-op
+    context manager if processes is 0
+    """
+    if not processes:
+        return nullcontext()
+    logprint('debug', 'starting %s render processes' % processes)
+    return RenderPool(processes=processes, rg_titles=rg_titles, parser=parser)
+
+def _rerender_page(path, es_pages, rg_titles, render_pool, parser):
+    """rerender render stage: cached page data to an elastic.Page
+    
+    Pages that are not in Elasticsearch, or not published according to the
+    cached page data, are passed through without a 'page'.
+    
+    @returns: dict
+    """
+    with open(path, 'r') as f:
+        rawtext = f.read()
+    title = json.loads(rawtext)['parse']['title']
+    item = {'title': title}
+    es_page = es_pages.get(title)
+    if not es_page:
+        return item
+    mwpage = LegacyPage.rerender(
+        rawtext, es_page,
+        rg_titles=rg_titles, render_pool=render_pool, parser=parser,
+    )
+    if mwpage.published or config.MEDIAWIKI_SHOW_UNPUBLISHED:
+        item['page'] = Page.from_mw(mwpage)
+    return item
+
+def _recent_changes(mw, name, max_hours):
+    """Changes since the high-water mark of the last completed run
+    
+    @param mw: wiki.MediaWiki
+    @param name: str 'articles' or 'authors'
+    @param max_hours: int
+    @returns: dict (see wiki.MediaWiki.recent_changes) or None if a full
+              diff is needed
+    """
+    since = state.read_mark(name)
+    if not since:
+        logprint('info', 'No record of last %s run: doing full diff' % name)
+        return None
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    if now - since > timedelta(hours=max_hours):
+        logprint('info', 'Last %s run (%s) is too old: doing full diff' % (name, since))
+        return None
+    logprint('debug', 'getting recent changes since %s' % since)
+    changes = mw.recent_changes(since)
+    logprint('debug', 'updated: %s, deleted: %s' % (
+        len(changes['updated']), len(changes['deleted'])
+    ))
+    return changes
+
+def _incremental_articles(ds, changes, mw_author_titles, mw_articles):
+    """Titles an incremental articles run should publish or unpublish
+    
+    Updated titles that are published, plus updated titles that are still
+    in Elasticsearch but no longer published (e.g. removed from
+    Category:Published) so _article_render removes them.
+    
+    @param ds: DocstoreManager
+    @param changes: dict (see wiki.MediaWiki.recent_changes)
+    @param mw_author_titles: list
+    @param mw_articles: list of dicts (see Proxy.articles_lastmod)
+    @returns: list of titles
+    """
+    published = set(
+        a['title'] for a in mw_articles if a['title'] not in mw_author_titles
+    )
+    updated = set(t for t in changes['updated'] if t not in mw_author_titles)
+    unpublished = mget(ds, 'article', Page, sorted(updated - published))
+    if unpublished:
+        logprint('debug', 'no longer published: %s' % len(unpublished))
+    return sorted((updated & published) | set(unpublished.keys()))
+
+def _journal(name, run_id, resume, record):
+    """Open the run journal and log what is being resumed
+    
+    @returns: state.Journal
+    """
+    journal = state.Journal(name, run_id=run_id, resume=resume, record=record)
+    if journal.resumed:
+        logprint('info', 'resuming %s run %s (%s done)' % (
+            name, journal.run_id, len(journal)
+        ))
+    elif record:
+        logprint('debug', '%s run %s' % (name, journal.run_id))
+    return journal
+
+def _not_done(titles, journal):
+    """Titles not already completed according to the journal
+    """
+    if not len(journal):
+        return titles
+    remaining = [title for title in titles if title not in journal]
+    logprint('info', 'skipping %s titles already done' % (len(titles) - len(remaining)))
+    return remaining
+
+def _finish(journal, failed):
+    """Close the journal; mark the run finished if nothing failed
+    
+    Failed titles stay out of the journal so --resume retries them.
+    """
+    if not journal.record:
+        journal.close()
+    elif failed:
+        logprint('info', 'run %s not finished: %s failed (use --resume)' % (
+            journal.run_id, len(failed)
+        ))
+        journal.close()
+    else:
+        journal.finish()
+
+def _write_mark(name, mark, failed):
+    """Record high-water mark unless some titles failed
+    
+    Titles that failed are retried by the next run if the mark stays put.
+    """
+    if failed:
+        logprint('info', 'Not updating %s high-water mark: %s titles failed' % (
+            name, len(failed)
+        ))
+        return
+    state.write_mark(name, mark)
+    logprint('debug', '%s high-water mark: %s' % (name, mark))
+
+def _evict_pagecache():
+    """Keep the page data cache under PAGEDATA_CACHE_MAX_MB
+    """
+    if pagecache.enabled():
+        removed = pagecache.evict()
+        if removed:
+            logprint('debug', 'pagecache: removed %s pages' % removed)
+
+def _source_resolver(mw, titles):
+    """SourceResolver preloaded with primary sources for the titles
+    
+    Images for the pages are listed in one MediaWiki request per
+    wiki.TITLES_PER_REQUEST titles and their sources looked up in a few PSMS
+    requests, instead of one request per page.
+    
+    @param mw: wiki.MediaWiki
+    @param titles: list
+    @returns: SourceResolver
+    """
+    resolver = SourceResolver()
+    if not titles:
+        return resolver
+    page_images = mw.page_images(titles)
+    eids = []
+    for title in titles:
+        eids += helpers.primary_source_ids(page_images.get(title, []))
+    resolver.prefetch(eids)
+    return resolver
+
+async def _article_fetch(title, resolver=None):
+    """articles fetch stage: get page data from MediaWiki and PSMS
+    
+    @returns: dict
+    """
+    logprint('debug', 'getting from mediawiki %s' % title)
+    return {
+        'title': title,
+        'fetched': await LegacyPage.afetch(title, resolver=resolver),
+    }
+
+def _article_render(ds, mw, item, rg_titles, render_pool, parser, dryrun):
+    """articles render stage: parse page data and make an elastic.Page
+    
+    Unpublished pages are removed from Elasticsearch here.
+    
+    @returns: dict
+    """
+    title = item['title']
+    mwpage = LegacyPage.get(
+        mw, title, fetched=item.pop('fetched'),
+        rg_titles=rg_titles, render_pool=render_pool, parser=parser,
+    )
+    try:
+        existing_page = Page.get(ds, title)
+        logprint('debug', 'exists in elasticsearch %s' % title)
+    except NotFoundError:
+        existing_page = None
+    if (mwpage.published or config.MEDIAWIKI_SHOW_UNPUBLISHED):
+        logprint('debug', 'creating page %s' % title)
+        item['page'] = Page.from_mw(mwpage, page=existing_page)
+    else:
+        # delete from ES if present
+        logprint('debug', 'not publishable: %s' % mwpage)
+        if existing_page:
+            logprint('debug', 'deleting %s' % title)
+            if not dryrun:
+                existing_page.delete(ds)
+            item['unpublished'] = mwpage
+    return item
+
+def _article_index(writer, item, hashes, dryrun):
+    """articles index stage: queue the page for a bulk write
+    
+    Pages whose content_hash matches the one in Elasticsearch are not
+    written; if only modified is different it is updated by itself.
+    Results of the write are checked by _check_saved when the BulkWriter
+    flushes.
+    
+    @param hashes: dict (see content_hashes)
+    @returns: dict
+    """
+    page = item.get('page')
+    compared = compare_hashes(hashes, page) if page else 'changed'
+    if compared != 'changed':
+        logprint('debug', 'unchanged %s' % page.url_title)
+        item['unchanged'] = True
+        if compared == 'modified' and not dryrun:
+            writer.update('article', page.meta.id, {'modified': page.modified})
+        return item
+    if page and not dryrun:
+        logprint('debug', 'saving %s "%s"' % ('articles', page.url_title))
+        writer.index('article', page)
+    return item
+
+def _check_saved(ds, model, result, errors, verify_sample=0):
+    """BulkWriter callback: check that a bulk-indexed document landed
+    
+    The bulk response already reports the result and shard status of each
+    document.  With verify_sample, that fraction of saved documents is also
+    read back from Elasticsearch.
+    
+    @param ds: DocstoreManager
+    @param model: elastic.Page, Author, or Source
+    @param result: dict (see docstore.BulkWriter)
+    @param errors: list Failed IDs are appended here.
+    @param verify_sample: float 0.0-1.0
+    @returns: bool True if the document was saved
+    """
+    document_id = result['id']
+    if not result['ok']:
+        logprint('error', 'ERROR: %s(%s) NOT SAVED! %s %s %s' % (
+            model.__name__, document_id,
+            result['status'], result['result'], result['error'] or result['shards']
+        ))
+        errors.append(document_id)
+        return False
+    if verify_sample and (random.random() < verify_sample):
+        try:
+            model.get(ds, document_id)
+        except NotFoundError:
+            logprint('error', 'ERROR: %s(%s) NOT SAVED!' % (model.__name__, document_id))
+            errors.append(document_id)
+            return False
+    return True
+
 @stopwatch
-def sources(ds, report=False, dryrun=False, force=False, psms_id=None):
+def sources(ds, report=False, dryrun=False, force=False, psms_id=None,
+            verify_sample=config.PUBLISH_VERIFY_SAMPLE,
+            resume=False, run_id=None, state_name='sources'):
     logprint(
         'debug',
         '------------------------------------------------------------------------')
@@ -321,11 +803,7 @@ def sources(ds, report=False, dryrun=False, force=False, psms_id=None):
         logprint('error', ps_sources)
     
     logprint('debug', f'getting sources from Elasticsearch ({ds.host})')
-    es_sources = Source.sources(ds)
-    if es_sources and isinstance(es_sources, list):
-        logprint('debug', 'es_sources: %s' % len(es_sources))
-    else:
-        logprint('error', 'error: %s' % es_sources)
+    logprint('debug', 'es_sources: %s' % Source.count(ds))
     
     if psms_id:
         sources_update = [psms_id]
@@ -341,7 +819,7 @@ def sources(ds, report=False, dryrun=False, force=False, psms_id=None):
         else:
             logprint('debug', 'crunching numbers...')
             sources_update,sources_delete = Elasticsearch.sources_to_update(
-                ps_sources, es_sources.objects
+                ps_sources, Source.iter_sources(ds)
             )
         logprint('debug', 'updates:   %s' % len(sources_update))
         logprint('debug', 'deletions: %s' % len(sources_delete))
@@ -353,12 +831,23 @@ def sources(ds, report=False, dryrun=False, force=False, psms_id=None):
         for source in ps_sources
     }
         
+    journal = _journal(
+        state_name, run_id, resume and not psms_id, not (psms_id or dryrun)
+    )
+    sources_update = _not_done(sources_update, journal)
     logprint('debug', 'adding sources...')
+    hashes = {} if psms_id else content_hashes(ds, 'source', Source)
     posted = 0
+    unchanged = 0
     to_rsync = []
     could_not_post = []
     unpublished = []
     errors = []
+    saved_ids = []
+    def saved(result):
+        if _check_saved(ds, Source, result, errors, verify_sample):
+            saved_ids.append(result['id'])
+    writer = ds.bulk_writer(callback=saved)
     for n,sid in enumerate(sources_update):
         logprint('debug', '--------------------')
         logprint('debug', '%s/%s %s' % (n+1, len(sources_update), sid))
@@ -385,18 +874,20 @@ def sources(ds, report=False, dryrun=False, force=False, psms_id=None):
             
             es_source = Source.from_psms(ps_source)
             logprint('debug', es_source)
+            # files are rsynced even if the document is unchanged
+            compared = compare_hashes(hashes, es_source)
+            if compared != 'changed':
+                logprint('debug', 'unchanged')
+                unchanged += 1
+                saved_ids.append(es_source.meta.id)
+                if compared == 'modified' and not dryrun:
+                    writer.update('source', es_source.meta.id, {'modified': es_source.modified})
+            else:
+                posted += 1
+                if not dryrun:
+                    logprint('debug', 'saving')
+                    writer.index('source', es_source)
             if not dryrun:
-                logprint('debug', 'saving')
-                try:
-                    es_source.save(ds)
-                except SerializationError:
-                    logprint('error', 'ERROR: Could not serialize to Elasticsearch!')
-                try:
-                    s = Source.get(ds, sid)
-                except NotFoundError:
-                    logprint('error', 'ERROR: Source(%s) NOT SAVED!' % sid)
-                    errors.append(sid)
-                
                 # IMPORTANT! WE ASSUME THAT encyc-core RUNS ON SAME MACHINE AS PSMS!
                 if es_source.original:
                     logprint('debug', 'original_path_abs %s' % es_source.original_path_abs)
@@ -414,6 +905,8 @@ def sources(ds, report=False, dryrun=False, force=False, psms_id=None):
                 logprint('debug', 'deleting...')
                 existing_page.delete()
                 unpublished.append(mwpage)
+    writer.close()
+    logprint('info', 'sources posted: %s, unchanged (skipped): %s' % (posted, unchanged))
 
     # rsync source files to media server
     logprint('debug', '--------------------')
@@ -440,6 +933,11 @@ def sources(ds, report=False, dryrun=False, force=False, psms_id=None):
         logprint('debug', result)
         if result != '0':
             errors.append('Could not upload %s' % result)
+        else:
+            # sources are only done once their files are on the media server
+            for sid in saved_ids:
+                journal.add(sid)
+    _finish(journal, could_not_post + errors)
         
     if could_not_post:
         logprint('debug', '========================================================================')
@@ -456,33 +954,255 @@ def sources(ds, report=False, dryrun=False, force=False, psms_id=None):
             logprint('info', 'ERROR: %s' % title)
     logprint('debug', 'DONE')
 
+# state file for vocab HTTP validators and hashes (see vocabs)
+VOCABS_STATE = 'vocabs'
+
 @stopwatch
 def vocabs(ds, report=False, dryrun=False, force=False):
+    """Index DDR vocabulary facets and terms
+    
+    Facets are downloaded concurrently with conditional GETs.  Facets that
+    are not modified, or whose JSON has the same hash as the indexed
+    Facet.source_hash, are skipped unless force.  Terms are bulk-indexed.
+    """
     logprint('debug', '------------------------------------------------------------------------')
     logprint('debug', 'indexing facet terms...')
-    facets = {}
-    for f in config.DDR_VOCABS:
-        logprint('debug', f)
-        facet = Facet.retrieve(f)
+    facet_ids = config.DDR_VOCABS
+    validators = state.load(VOCABS_STATE) or {}
+    try:
+        indexed = {
+            facet_id: getattr(facet, 'source_hash', None)
+            for facet_id,facet in mget(ds, 'facet', Facet, facet_ids).items()
+        }
+    except NotFoundError:
+        indexed = {}
+    responses = _vocabs_retrieve(facet_ids, validators, indexed, force)
+    
+    facets = []
+    skipped = []
+    errors = []
+    for facet_id,r in zip(facet_ids, responses):
+        if isinstance(r, Exception) or (r.status_code not in [200, 304]):
+            logprint('error', 'ERROR: %s %s' % (facet_id, r))
+            errors.append(facet_id)
+            continue
+        if r.status_code == 304:
+            skipped.append(facet_id)
+            continue
+        source_hash = Facet.source_hash_of(r.content)
+        validators[facet_id] = {
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'source_hash': source_hash,
+        }
+        if (not force) and (indexed.get(facet_id) == source_hash):
+            skipped.append(facet_id)
+            continue
+        facets.append(Facet.from_json(facet_id, r.content))
+    logprint('debug', '%s facets changed, %s unchanged' % (len(facets), len(skipped)))
+    if report or dryrun:
+        for facet in facets:
+            logprint('info', '%s: %s terms' % (facet.meta.id, len(facet.terms)))
+        return
+    
+    def saved(result):
+        if not result['ok']:
+            logprint('error', 'ERROR: %s(%s) NOT SAVED! %s %s' % (
+                result['doctype'], result['id'], result['status'], result['error']
+            ))
+            errors.append(result['id'])
+    # terms first; a facet (with its source_hash) is only saved if all its
+    # terms were, so a partly-saved facet is redone by the next run
+    writer = ds.bulk_writer(callback=saved)
+    for facet in facets:
         logprint('debug', facet)
-        terms = facet.terms
+        for term in facet.terms:
+            writer.index('facetterm', term)
+    writer.close()
+    failed = set(
+        facet.meta.id for facet in facets
+        for term in facet.terms if term.meta.id in errors
+    )
+    writer = ds.bulk_writer(callback=saved)
+    for facet in facets:
         delattr(facet, 'terms')
-        facet.save(ds)
-        for term in terms:
-            logprint('debug', '- %s' % term)
-            term.save(ds)
-        
+        if facet.meta.id in failed:
+            validators.pop(facet.meta.id, None)
+        else:
+            writer.index('facet', facet)
+    writer.close()
+    for facet_id in errors:
+        validators.pop(facet_id, None)
+    state.dump(VOCABS_STATE, validators)
+    if errors:
+        logprint('info', 'ERROR: %s facets/terms were not saved:' % len(errors))
+        for oid in errors:
+            logprint('info', 'ERROR: %s' % oid)
     logprint('debug', 'DONE')
 
+def _vocabs_retrieve(facet_ids, validators, indexed, force):
+    """GET vocab JSON for facets concurrently
+    
+    Requests are conditional (If-None-Match/If-Modified-Since) for facets
+    whose last downloaded hash is the one in the index.
+    
+    @returns: list of requests.Response or Exception, in order of facet_ids
+    """
+    headers = []
+    for facet_id in facet_ids:
+        v = validators.get(facet_id, {})
+        h = {}
+        if (not force) and v and (v.get('source_hash') == indexed.get(facet_id)):
+            if v.get('etag'):
+                h['If-None-Match'] = v['etag']
+            if v.get('last_modified'):
+                h['If-Modified-Since'] = v['last_modified']
+        headers.append(h)
+    return http.get_many(
+        [Facet.url(facet_id) for facet_id in facet_ids], headers=headers
+    )
+
+# reindex does not swap if a new index has fewer than this fraction of
+# the documents in the live one
+REINDEX_MIN_RATIO = 0.9
+
+# start time of a reindex build (see state.write_mark), and the live
+# high-water marks it becomes when the build is swapped in
+REINDEX_MARK = 'reindex-v%s'
+REINDEX_MARKED = ['authors', 'articles']
+
+@stopwatch
+def reindex(ds, version=None, swap=True, migrate=False, resume=False,
+            workers=config.PUBLISH_WORKERS,
+            fetch_concurrency=config.PUBLISH_FETCH_CONCURRENCY,
+            render_processes=config.RENDER_PROCESSES,
+            parser=config.HTML_PARSER):
+    """Rebuild all doctypes into new versioned indices and swap aliases
+    
+    Indices named e.g. encycarticle-v7 are created and filled in parallel
+    (one thread per publish function) with bulk-load settings (see
+    DocstoreManager.rebuilding).  If nothing raised, the read aliases
+    (encycarticle etc) are moved to the new indices in one request.  Not
+    swapped if any new index is empty or has fewer than REINDEX_MIN_RATIO
+    of the live index's documents.  Old versions are kept; use swap_version
+    to roll back (or to swap anyway).
+    
+    The jobs keep their own journals and high-water marks (reindex-articles
+    etc) so they don't move the marks of the live indices.  The time the
+    build started is recorded (REINDEX_MARK) and becomes the live marks when
+    the version is swapped in, so the next incremental run replays changes
+    made during the build.
+    
+    @param version: int Version to build (default: one after the latest)
+                        Use with resume to finish an interrupted build.
+    @param swap: bool Swap aliases when done.
+    @param migrate: bool Replace non-versioned indices with aliases.
+    @returns: int version
+    """
+    versions,live = ds.index_versions()
+    logprint('debug', 'live versions: %s' % live)
+    if version is None:
+        version = max(list(versions.keys()) + [0]) + 1
+    vds = ds.versioned(version)
+    if version not in versions:
+        for index in ds.create_versioned_indices(version):
+            logprint('debug', 'created %s' % index)
+    run_id = 'reindex-v%s' % version
+    if not (resume and state.read_mark(REINDEX_MARK % version)):
+        state.write_mark(REINDEX_MARK % version, wiki.MediaWiki().current_timestamp())
+    jobs = {
+        'vocabs': (vocabs, dict(force=True)),
+        'sources': (sources, dict(
+            force=True, resume=resume, run_id=run_id, state_name='reindex-sources',
+        )),
+        'authors': (authors, dict(
+            force=True, resume=resume, run_id=run_id, state_name='reindex-authors',
+        )),
+        'articles': (articles, dict(
+            force=True, resume=resume, run_id=run_id, state_name='reindex-articles',
+            workers=workers,
+            fetch_concurrency=fetch_concurrency,
+            render_processes=render_processes, parser=parser,
+        )),
+    }
+    errors = []
+    doctypes = [item['doctype'] for item in ELASTICSEARCH_CLASSES['all']]
+    with vds.rebuilding(doctypes):
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = {
+                name: executor.submit(fn, vds, **kwargs)
+                for name,(fn,kwargs) in jobs.items()
+            }
+            for name,future in futures.items():
+                try:
+                    future.result()
+                except (Exception, SystemExit) as err:
+                    logprint('error', 'ERROR: reindex %s: %r' % (name, err))
+                    errors.append(name)
+    for doctype in doctypes:
+        new_count,live_count = count_index(vds, doctype), _live_count(ds, doctype)
+        logprint('info', '%s: %s documents (live: %s)' % (
+            vds.index_name(doctype), new_count, live_count
+        ))
+        if (not new_count) or (new_count < live_count * REINDEX_MIN_RATIO):
+            errors.append(doctype)
+    if errors:
+        logprint('info', 'ERROR: v%s not swapped, failed or short: %s' % (
+            version, errors
+        ))
+        return version
+    if swap:
+        swap_version(ds, version, migrate)
+    return version
+
+def _live_count(ds, doctype):
+    """Number of documents the site currently reads for a doctype
+    """
+    try:
+        return count_index(ds, doctype)
+    except NotFoundError:
+        return 0
+
+def swap_version(ds, version, migrate=False):
+    """Point read aliases at an existing reindex version (or roll back)
+    
+    The authors and articles high-water marks are set to the time the
+    version's build started so incremental runs catch up from there.
+    
+    @param version: int
+    @param migrate: bool Replace non-versioned indices with aliases.
+    """
+    versions,live = ds.index_versions()
+    doctypes = [item['doctype'] for item in ELASTICSEARCH_CLASSES['all']]
+    if sorted(versions.get(version, [])) != sorted(doctypes):
+        raise Exception('Version %s is incomplete: %s' % (
+            version, versions.get(version, [])
+        ))
+    if migrate and not state.read_mark(REINDEX_MARK % ORIGINAL_VERSION):
+        # the original indices (kept as v0) are as current as the live marks
+        marks = [state.read_mark(name) for name in REINDEX_MARKED]
+        if all(marks):
+            state.write_mark(REINDEX_MARK % ORIGINAL_VERSION, min(marks))
+    for action in ds.swap_aliases(version, migrate):
+        logprint('debug', action)
+    logprint('info', 'aliases now point to v%s' % version)
+    started = state.read_mark(REINDEX_MARK % version)
+    if not started:
+        logprint('info', 'No build time for v%s: run a full (not incremental) publish' % version)
+        return
+    for name in REINDEX_MARKED:
+        state.write_mark(name, started)
+        logprint('debug', '%s high-water mark: %s' % (name, started))
+
 def listdocs(ds, doctype):
-    if   doctype == 'article': results = Page.pages()
-    elif doctype == 'author': results = Author.authors()
-    elif doctype == 'source': results = Source.sources()
+    if   doctype == 'article': model,results = Page,Page.iter_pages(ds)
+    elif doctype == 'author': model,results = Author,Author.iter_authors(ds)
+    elif doctype == 'source': model,results = Source,Source.iter_sources(ds)
     else:
         logprint('error', '"%s" is not a recognized doc_type!' % doctype)
         return
-    total = results.total
-    for n,r in enumerate(results.objects):
+    total = model.count(ds)
+    for n,r in enumerate(results):
         if doctype == 'source':
             print('%s/%s| %s' % (n, total, r.encyclopedia_id))
         else:
@@ -18,6 +18,7 @@ class Author(dsl.Document):
     title = dsl.Text()
     body = dsl.Text()
     article_titles = dsl.Keyword(multi=True)
+    content_hash = dsl.Keyword(index=False)
     
     #class Index:
     #    name = ???
@@ -84,6 +85,7 @@ class Page(dsl.Document):
     rg_chronology = dsl.Keyword(multi=True)
     rg_hasteachingaids = dsl.Keyword()
     rg_warnings = dsl.Text()
+    content_hash = dsl.Keyword(index=False)
     #rg_primarysecondary = dsl.Keyword(multi=True)
     #rg_lexile = dsl.Keyword(multi=True)
     #rg_guidedreadinglevel = dsl.Keyword(multi=True)
@@ -144,6 +146,7 @@ class Source(dsl.Document):
     courtesy = dsl.Keyword()
     filename = dsl.Keyword()
     img_path = dsl.Keyword()
+    content_hash = dsl.Keyword(index=False)
     
     #class Index:
     #    name = ???
@@ -170,6 +173,8 @@ class Facet(dsl.Document):
     links_children = dsl.Keyword()
     title = dsl.Text()
     description = dsl.Text()
+    # sha1 of the vocab JSON this facet was indexed from
+    source_hash = dsl.Keyword(index=False)
     
     #class Index:
     #    name = ???
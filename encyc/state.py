@@ -0,0 +1,193 @@
+"""encyc.state -- Values that persist between publish runs
+
+High-water marks record how far an incremental publish got (see
+wiki.MediaWiki.recent_changes) so the next run can start from there.
+Each mark is a small JSON file in PUBLISH_STATE_DIR.
+
+>>> from encyc import state
+>>> state.write_mark('articles', timestamp)
+>>> state.read_mark('articles')
+datetime.datetime(2024, 1, 2, 3, 4, 5)
+
+Journals record the titles completed by a publish run so an interrupted
+run can be resumed (see Journal).
+
+load and dump keep other small values, e.g. cached API responses.
+"""
+
+from datetime import datetime
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+import threading
+
+from encyc import config
+from encyc import fileio
+
+
+def _path(name, state_dir=None):
+    return os.path.join(state_dir or config.PUBLISH_STATE_DIR, '%s.json' % name)
+
+def load(name, state_dir=None):
+    """Data saved with dump, or None.
+    
+    @param name: str
+    @param state_dir: str (default: PUBLISH_STATE_DIR)
+    @returns: object or None
+    """
+    path = _path(name, state_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        return json.loads(fileio.read_text(path))
+    except ValueError as err:
+        logger.error('bad state file %s: %s' % (path, err))
+        return None
+
+def dump(name, data, state_dir=None):
+    """Save JSON-serializable data.
+    
+    The file is replaced atomically so a crash never leaves half a file.
+    
+    @param name: str
+    @param data: object
+    @param state_dir: str (default: PUBLISH_STATE_DIR)
+    """
+    path = _path(name, state_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(json.dumps(data))
+    os.replace(tmp, path)
+
+def read_mark(name, state_dir=None):
+    """Timestamp of the last completed run, or None.
+    
+    @param name: str e.g. 'articles'
+    @param state_dir: str (default: PUBLISH_STATE_DIR)
+    @returns: datetime or None
+    """
+    data = load(name, state_dir)
+    if not data:
+        return None
+    try:
+        return datetime.strptime(data['timestamp'], config.MEDIAWIKI_DATETIME_FORMAT_TZ)
+    except (ValueError, KeyError, TypeError) as err:
+        logger.error('bad high-water mark %s: %s' % (_path(name, state_dir), err))
+        return None
+
+def write_mark(name, timestamp, state_dir=None):
+    """Record timestamp of a completed run.
+    
+    @param name: str e.g. 'articles'
+    @param timestamp: datetime (UTC)
+    @param state_dir: str (default: PUBLISH_STATE_DIR)
+    """
+    dump(name, {
+        'timestamp': timestamp.strftime(config.MEDIAWIKI_DATETIME_FORMAT_TZ),
+    }, state_dir)
+
+
+class Journal():
+    """Titles completed by a publish run, so an interrupted run can resume
+    
+    The journal is a text file in PUBLISH_STATE_DIR: a "# run RUN_ID" line,
+    one line per completed title, and a "# done" line if the run finished.
+    Each title is flushed as soon as it is added.
+    
+    >>> journal = Journal('articles', resume=True)
+    >>> [title for title in titles if title not in journal]
+    >>> journal.add(title)
+    >>> journal.finish()
+    
+    With resume, an unfinished journal with the same run_id (or any run_id
+    if none is given) is continued.  Otherwise a new run is started.
+    """
+    
+    def __init__(self, name, run_id=None, resume=False, record=True, state_dir=None):
+        """
+        @param name: str e.g. 'articles'
+        @param run_id: str (default: current date and time)
+        @param resume: bool Continue the previous run.
+        @param record: bool If False, titles are not written to the journal.
+        @param state_dir: str (default: PUBLISH_STATE_DIR)
+        """
+        self.path = os.path.join(
+            state_dir or config.PUBLISH_STATE_DIR, '%s.journal' % name
+        )
+        self.record = record
+        self.done = set()
+        self.resumed = False
+        self._lock = threading.Lock()
+        self._file = None
+        last_run,done,finished = self._read()
+        if resume and last_run and (not finished) and (run_id in [None, last_run]):
+            self.run_id = last_run
+            self.done = done
+            self.resumed = True
+        else:
+            if resume:
+                logger.warning('nothing to resume in %s' % self.path)
+            self.run_id = run_id or datetime.now().strftime('%Y%m%d-%H%M%S')
+        if self.record:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if self.resumed:
+                self._file = open(self.path, 'a')
+            else:
+                self._file = open(self.path, 'w')
+                self._write('# run %s' % self.run_id)
+    
+    def __contains__(self, title):
+        return title in self.done
+    
+    def __len__(self):
+        return len(self.done)
+    
+    def _read(self):
+        """Run ID, completed titles, and finished flag from the journal file
+        
+        @returns: (str, set, bool)
+        """
+        run_id = None
+        done = set()
+        finished = False
+        if not os.path.exists(self.path):
+            return run_id,done,finished
+        with open(self.path, 'r') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line.startswith('# run '):
+                    run_id = line.replace('# run ', '', 1)
+                elif line == '# done':
+                    finished = True
+                elif line:
+                    done.add(line)
+        return run_id,done,finished
+    
+    def _write(self, line):
+        self._file.write(line + '\n')
+        self._file.flush()
+    
+    def add(self, title):
+        """Record a completed title.
+        
+        Safe to call from multiple threads.
+        """
+        with self._lock:
+            self.done.add(title)
+            if self._file:
+                self._write(title)
+    
+    def finish(self):
+        """Mark the run finished: the next --resume starts a new run.
+        """
+        with self._lock:
+            if self._file:
+                self._write('# done')
+        self.close()
+    
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
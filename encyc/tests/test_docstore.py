@@ -0,0 +1,199 @@
+from encyc import docstore
+from encyc.models.elastic import Page
+
+
+class FakeDocstore():
+    es = None
+    def index_name(self, doctype):
+        return 'encyc' + doctype
+
+
+def _fake_bulk(calls, fail_ids=[], shard_fail_ids=[], index_suffix=''):
+    def streaming_bulk(client, actions, **kwargs):
+        actions = list(actions)
+        calls.append(actions)
+        for action in actions:
+            op = action['_op_type']
+            if action['_id'] in fail_ids:
+                yield False, {op: {
+                    '_index': action['_index'], '_id': action['_id'],
+                    'status': 400, 'error': {'type': 'mapper_parsing_exception'},
+                }}
+                continue
+            shards = {'total': 2, 'successful': 1, 'failed': 0}
+            if action['_id'] in shard_fail_ids:
+                shards = {'total': 2, 'successful': 0, 'failed': 2}
+            yield True, {op: {
+                '_index': action['_index'] + index_suffix, '_id': action['_id'],
+                'status': 201,
+                'result': 'deleted' if op == 'delete' else 'created',
+                '_shards': shards,
+            }}
+    return streaming_bulk
+
+def test_bulkwriter_chunks(monkeypatch):
+    calls = []
+    monkeypatch.setattr(docstore, 'streaming_bulk', _fake_bulk(calls))
+    results = []
+    with docstore.BulkWriter(FakeDocstore(), chunk_size=2, callback=results.append) as writer:
+        for n in range(5):
+            writer.index('article', Page(meta={'id': 'Page%s' % n}, title='Page %s' % n))
+    assert [len(actions) for actions in calls] == [2, 2, 1]
+    assert calls[0][0]['_index'] == 'encycarticle'
+    assert calls[0][0]['_source'] == {'title': 'Page 0'}
+    assert [r['id'] for r in results] == ['Page%s' % n for n in range(5)]
+    assert results[0]['doctype'] == 'article'
+    assert writer.num_ok == 5
+    assert writer.failed == []
+
+def test_bulkwriter_failures(monkeypatch):
+    calls = []
+    monkeypatch.setattr(docstore, 'streaming_bulk', _fake_bulk(calls, ['Bad']))
+    writer = docstore.BulkWriter(FakeDocstore())
+    writer.index('article', Page(meta={'id': 'Good'}, title='Good'))
+    writer.index('article', Page(meta={'id': 'Bad'}, title='Bad'))
+    writer.delete('article', 'Old')
+    assert calls == []
+    results = writer.close()
+    assert len(calls) == 1
+    assert calls[0][2] == {'_op_type': 'delete', '_index': 'encycarticle', '_id': 'Old'}
+    assert [r['ok'] for r in results] == [True, False, True]
+    assert writer.num_ok == 2
+    assert [r['id'] for r in writer.failed] == ['Bad']
+    assert writer.failed[0]['status'] == 400
+
+def test_bulkwriter_shard_failures(monkeypatch):
+    calls = []
+    monkeypatch.setattr(docstore, 'streaming_bulk', _fake_bulk(calls, [], ['Lost']))
+    writer = docstore.BulkWriter(FakeDocstore())
+    writer.index('article', Page(meta={'id': 'Good'}, title='Good'))
+    writer.index('article', Page(meta={'id': 'Lost'}, title='Lost'))
+    results = writer.close()
+    assert [r['ok'] for r in results] == [True, False]
+    assert writer.failed[0]['shards']['failed'] == 2
+
+def test_bulkwriter_alias(monkeypatch):
+    # writing through an alias, the response has the versioned index name
+    calls = []
+    monkeypatch.setattr(docstore, 'streaming_bulk', _fake_bulk(calls, index_suffix='-v7'))
+    writer = docstore.BulkWriter(FakeDocstore())
+    writer.index('article', Page(meta={'id': 'Good'}, title='Good'))
+    writer.delete('author', 'Old')
+    results = writer.close()
+    assert [r['doctype'] for r in results] == ['article', 'author']
+
+def test_bulkwriter_update(monkeypatch):
+    calls = []
+    monkeypatch.setattr(docstore, 'streaming_bulk', _fake_bulk(calls))
+    writer = docstore.BulkWriter(FakeDocstore())
+    writer.update('article', 'Good', {'title': 'Better'})
+    writer.close()
+    assert calls[0] == [{
+        '_op_type': 'update', '_index': 'encycarticle', '_id': 'Good',
+        'doc': {'title': 'Better'},
+    }]
+
+def test_rebuilding(monkeypatch):
+    calls = []
+    class FakeIndices():
+        def put_settings(self, index, settings):
+            calls.append(('settings', index, settings['index']))
+        def refresh(self, index):
+            calls.append(('refresh', index))
+        def forcemerge(self, index, max_num_segments):
+            calls.append(('forcemerge', index, max_num_segments))
+    class FakeES():
+        indices = FakeIndices()
+    ds = FakeDocstore()
+    ds.es = FakeES()
+    monkeypatch.setattr(docstore.config, 'DOCSTORE_INDEX_SETTINGS', {
+        'article': {'refresh_interval': '1s', 'number_of_replicas': 1, 'forcemerge_segments': 1},
+        'author': {'refresh_interval': '30s', 'number_of_replicas': 2, 'forcemerge_segments': 0},
+    })
+    try:
+        with docstore.DocstoreManager.rebuilding(ds, ['article', 'author']):
+            assert calls == [
+                ('settings', 'encycarticle', {'refresh_interval': '-1', 'number_of_replicas': 0}),
+                ('settings', 'encycauthor', {'refresh_interval': '-1', 'number_of_replicas': 0}),
+            ]
+            calls.clear()
+            raise RuntimeError('interrupted')
+    except RuntimeError:
+        pass
+    # settings are restored even if the load fails
+    assert calls == [
+        ('settings', 'encycarticle', {'refresh_interval': '1s', 'number_of_replicas': 1}),
+        ('refresh', 'encycarticle'),
+        ('forcemerge', 'encycarticle', 1),
+        ('settings', 'encycauthor', {'refresh_interval': '30s', 'number_of_replicas': 2}),
+        ('refresh', 'encycauthor'),
+    ]
+
+class FakeAliasIndices():
+    def __init__(self, indices):
+        # index: list of aliases
+        self.indices = indices
+        self.actions = []
+        self.blocks = []
+    def get_alias(self, index=None, name=None):
+        return {
+            i: {'aliases': {a: {} for a in aliases}}
+            for i,aliases in self.indices.items()
+            if (name in aliases) or (index and not name)
+        }
+    def exists_alias(self, name):
+        return any(name in aliases for aliases in self.indices.values())
+    def exists(self, index):
+        return index in self.indices
+    def update_aliases(self, actions):
+        self.actions.append(actions)
+    def add_block(self, index, block):
+        self.blocks.append((index, block))
+    def put_settings(self, index, settings):
+        self.blocks.append((index, settings))
+    def clone(self, index, target, settings):
+        self.indices[target] = []
+        self.blocks.append((index, target))
+
+def test_versioned_indices():
+    from encyc.cli import FakeSettings
+    ds = docstore.DocstoreManager(docstore.INDEX_PREFIX, 'localhost:9200', FakeSettings('localhost:9200'))
+    v7 = ds.versioned(7)
+    assert v7.index_name('article') == 'encycarticle-v7'
+    assert ds.index_name('article') == 'encycarticle'
+    indices = {'encycarticle': []}
+    for doctype in ['author', 'article', 'source', 'facet', 'facetterm']:
+        indices['encyc%s-v6' % doctype] = []
+    indices['encycauthor-v6'] = ['encycauthor']
+    class FakeES():
+        pass
+    ds.es = FakeES()
+    ds.es.indices = FakeAliasIndices(indices)
+    versions,live = ds.index_versions()
+    assert sorted(versions[6]) == ['article', 'author', 'facet', 'facetterm', 'source']
+    assert live['author'] == 6
+    assert live['article'] is None
+    # non-versioned index in the way
+    try:
+        ds.swap_aliases(6)
+        assert False
+    except Exception as err:
+        assert 'encycarticle' in str(err)
+    actions = ds.swap_aliases(6, migrate=True)
+    assert {'remove_index': {'index': 'encycarticle'}} in actions
+    assert {'add': {'index': 'encycarticle-v6', 'alias': 'encycarticle'}} in actions
+    assert ds.es.indices.actions == [actions]
+    # the original is kept as v0 for rollback, and writable again
+    assert ds.es.indices.blocks == [
+        ('encycarticle', 'write'),
+        ('encycarticle', 'encycarticle-v0'),
+        ('encycarticle', {'index.blocks.write': False}),
+    ]
+    assert 'encycarticle-v0' in indices
+    # swapping to v7 removes the aliases from v6
+    indices['encycauthor-v7'] = []
+    actions = ds.swap_aliases(7, migrate=True)
+    assert actions[:2] == [
+        {'remove': {'index': 'encycauthor-v6', 'alias': 'encycauthor'}},
+        {'add': {'index': 'encycauthor-v7', 'alias': 'encycauthor'}},
+    ]
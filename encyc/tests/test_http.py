@@ -0,0 +1,75 @@
+import threading
+import time
+
+from encyc import config
+from encyc import http
+
+
+def test_htuser_htpass():
+    assert http.htuser_htpass('http://example.com/') == (None,None)
+
+def test_get_many(monkeypatch):
+    active = {}
+    peak = {}
+    lock = threading.Lock()
+    def fake_get(url, **kwargs):
+        host = url.split('/')[2]
+        with lock:
+            active[host] = active.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), active[host])
+        time.sleep(0.01)
+        with lock:
+            active[host] -= 1
+        if url.endswith('/fail'):
+            raise ConnectionError(url)
+        return url
+    monkeypatch.setattr(http, 'get', fake_get)
+    urls = ['http://a.example.com/%s' % n for n in range(40)]
+    urls += ['http://b.example.com/%s' % n for n in range(5)]
+    urls.append('http://b.example.com/fail')
+    responses = http.get_many(urls)
+    # order is preserved, exceptions are returned not raised
+    assert responses[:-1] == urls[:-1]
+    assert isinstance(responses[-1], ConnectionError)
+    # per-host cap
+    assert peak['a.example.com'] <= config.HTTP_PER_HOST
+    assert peak['a.example.com'] > 1
+
+def test_get_many_other_hosts(monkeypatch):
+    # a burst to one host must not take every pool thread
+    monkeypatch.setattr(config, 'HTTP_CONCURRENCY', 4)
+    monkeypatch.setattr(config, 'HTTP_PER_HOST', 2)
+    monkeypatch.setattr(http, '_executor', None)
+    monkeypatch.setattr(http, '_host_limits', {})
+    done = []
+    def fake_get(url, **kwargs):
+        if 'a.example.com' in url:
+            time.sleep(0.1)
+        done.append(url.split('/')[2])
+        return url
+    monkeypatch.setattr(http, 'get', fake_get)
+    urls = ['http://a.example.com/%s' % n for n in range(8)]
+    urls.append('http://b.example.com/0')
+    assert http.get_many(urls) == urls
+    assert done[0] == 'b.example.com'
+
+def test_get_many_headers(monkeypatch):
+    monkeypatch.setattr(http, 'get', lambda url, **kwargs: (url, kwargs['headers']))
+    urls = ['http://a.example.com/1', 'http://a.example.com/2']
+    assert http.get_many(urls, headers={'A': '1'}) == [
+        (urls[0], {'A': '1'}), (urls[1], {'A': '1'})
+    ]
+    assert http.get_many(urls, headers=[{'If-None-Match': '"x"'}, {}]) == [
+        (urls[0], {'If-None-Match': '"x"'}), (urls[1], {})
+    ]
+
+def test_session(monkeypatch):
+    monkeypatch.setattr(http, '_sessions', {})
+    monkeypatch.setattr(config, 'MEDIAWIKI_HTTP_USERNAME', 'user')
+    monkeypatch.setattr(config, 'MEDIAWIKI_HTTP_PASSWORD', 'pass')
+    s0 = http.session('http://a.example.com/x')
+    assert http.session('http://a.example.com/y?z=1') is s0
+    assert http.session('https://a.example.com/x') is not s0
+    assert http.session('http://b.example.com/x') is not s0
+    assert s0.auth is None
+    assert http.session(config.MEDIAWIKI_API).auth == ('user', 'pass')
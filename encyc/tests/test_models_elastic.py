@@ -0,0 +1,259 @@
+from datetime import datetime
+import json
+import pytest
+
+from encyc.models import elastic
+from encyc.models.elastic import Elasticsearch, Page
+
+
+class FakeDocstore():
+    es = None
+    def index_name(self, doctype):
+        return 'encyc' + doctype
+
+
+def test_scan_index(monkeypatch):
+    searches = []
+    def scan(self):
+        searches.append(self)
+        for n in range(3):
+            yield self._get_result({
+                '_index': 'encycarticle', '_id': 'Page%s' % n,
+                '_source': {'title': 'Page %s' % n, 'modified': '2020-01-01T00:00:00'},
+            })
+    monkeypatch.setattr(elastic.dsl.Search, 'scan', scan)
+    pages = Page.iter_pages(FakeDocstore(), fields=['title', 'modified'])
+    assert searches == []  # lazy
+    pages = list(pages)
+    assert [page.title for page in pages] == ['Page 0', 'Page 1', 'Page 2']
+    assert isinstance(pages[0], Page)
+    assert isinstance(pages[0].modified, datetime)
+    s = searches[0]
+    assert s._index == ['encycarticle']
+    assert s.to_dict()['_source'] == ['title', 'modified']
+    assert s._params['size'] == elastic.SCAN_SIZE
+
+def test_articles_to_update_generator():
+    mw_articles = [
+        {'title': 'New', 'lastmod': datetime(2020,1,2)},
+        {'title': 'Changed', 'lastmod': datetime(2020,1,2)},
+        {'title': 'Same', 'lastmod': datetime(2020,1,1)},
+    ]
+    es_articles = (
+        Page(title=title, modified=datetime(2020,1,1))
+        for title in ['Changed', 'Same', 'Gone']
+    )
+    update,delete = Elasticsearch.articles_to_update([], mw_articles, es_articles)
+    assert sorted(update) == ['Changed', 'New']
+    assert delete == ['Gone']
+
+def test_content_hash():
+    page = Page(
+        meta={'id': 'Sansei'}, title='Sansei', modified=datetime(2020,1,1),
+        categories=['Generations'], body='<p>third generation</p>',
+    )
+    h = elastic.content_hash(page)
+    assert h == elastic.content_hash(Page(
+        meta={'id': 'Sansei'}, body='<p>third generation</p>',
+        categories=['Generations'], modified=datetime(2020,1,1), title='Sansei',
+    ))
+    page.content_hash = h
+    assert elastic.content_hash(page) == h
+    # a new revision that renders the same
+    page.modified = datetime(2020,2,2)
+    assert elastic.content_hash(page) == h
+    hashes = {'Sansei': (h, datetime(2020,1,1))}
+    assert elastic.compare_hashes(hashes, page) == 'modified'
+    hashes['Sansei'] = (h, datetime(2020,2,2))
+    assert elastic.compare_hashes(hashes, page) == 'unchanged'
+    assert elastic.compare_hashes({}, page) == 'changed'
+    page.body = '<p>third-generation</p>'
+    assert elastic.content_hash(page) != h
+    page.content_hash = elastic.content_hash(page)
+    assert elastic.compare_hashes(hashes, page) == 'changed'
+
+class FakeResponse():
+    def __init__(self, status_code, data=None, headers={}):
+        self.status_code = status_code
+        self.text = json.dumps(data)
+        self.headers = headers
+
+def test_Page_rg_titles(tmpdir, monkeypatch):
+    monkeypatch.setattr(elastic.config, 'PUBLISH_STATE_DIR', str(tmpdir))
+    monkeypatch.setattr(elastic.config, 'ENCYCRG_API', 'http://rg/api')
+    monkeypatch.setattr(elastic, 'RG_TITLES_LIMIT', 2)
+    first = 'http://rg/api/articles/?limit=2'
+    second = 'http://rg/api/articles/?limit=2&offset=2'
+    pages = {
+        first: {'objects': [{'id': 'Ansel Adams'}, {'id': 'Manzanar'}],
+                'meta': {'next': '/api/articles/?limit=2&offset=2'}},
+        second: {'objects': [{'id': 'Tule_Lake'}]},
+    }
+    requests = []
+    def get(url, headers={}):
+        requests.append((url, dict(headers)))
+        if headers.get('If-None-Match') == '"%s"' % url:
+            return FakeResponse(304)
+        return FakeResponse(200, pages[url], {'ETag': '"%s"' % url})
+    monkeypatch.setattr(elastic.http, 'get', get)
+
+    titles = Page.rg_titles()
+    assert isinstance(titles, frozenset)
+    assert [url for url,headers in requests] == [first, second]
+    assert requests[0][1] == {}
+    for title in ['Ansel Adams', 'Ansel_Adams', 'Manzanar', 'Tule_Lake', 'Tule Lake']:
+        assert title in titles
+    # unchanged pages are reused
+    requests.clear()
+    assert Page.rg_titles() == titles
+    assert requests[1] == (second, {'If-None-Match': '"%s"' % second})
+
+def test_Page_rg_titles_error(tmpdir, monkeypatch):
+    monkeypatch.setattr(elastic.config, 'PUBLISH_STATE_DIR', str(tmpdir))
+    monkeypatch.setattr(elastic.config, 'ENCYCRG_API', 'http://rg/api')
+    monkeypatch.setattr(elastic, 'RG_TITLES_LIMIT', 2)
+    first = 'http://rg/api/articles/?limit=2'
+    second = 'http://rg/api/articles/?limit=2&offset=2'
+    pages = {
+        first: {'objects': [{'id': 'Ansel Adams'}, {'id': 'Manzanar'}]},
+        second: {'objects': [{'id': 'Tule_Lake'}]},
+    }
+    statuses = {first: 200, second: 500}
+    def get(url, headers={}):
+        return FakeResponse(statuses[url], pages[url])
+    monkeypatch.setattr(elastic.http, 'get', get)
+    # no saved list: raise rather than return a partial one
+    with pytest.raises(elastic.requests.exceptions.ConnectionError):
+        Page.rg_titles()
+    statuses[second] = 200
+    titles = Page.rg_titles()
+    assert 'Tule Lake' in titles
+    # later failure falls back to the complete saved list
+    statuses[second] = 500
+    pages[first] = {'objects': [{'id': 'Heart Mountain'}, {'id': 'Manzanar'}]}
+    assert Page.rg_titles() == titles
+
+def test_Page_sources_authors(monkeypatch):
+    requests = []
+    def fake_mget(model, docs):
+        @classmethod
+        def mget(cls, ids, index=None, using=None, missing='none'):
+            requests.append((index, ids))
+            return [
+                cls(meta={'id': i}, title=i) for i in ids if i in docs
+            ]
+        monkeypatch.setattr(model, 'mget', mget)
+    fake_mget(elastic.Source, ['en-a-1', 'en-b-1'])
+    fake_mget(elastic.Author, ['Tetsuden Kashima'])
+    pages = [
+        Page(url_title='A', source_ids=['en-a-1', 'en-missing'],
+             authors_data={'display': ['Tetsuden Kashima', 'Brian Niiya']}),
+        Page(url_title='B', source_ids=['en-b-1', 'en-a-1'],
+             authors_data={'display': ['Tetsuden Kashima']}),
+    ]
+    sources = pages[0].sources(FakeDocstore())
+    assert [s.meta.id for s in sources] == ['en-a-1']
+    assert requests == [('encycsource', ['en-a-1', 'en-missing'])]
+    authors = pages[0].authors(FakeDocstore())
+    assert authors[0].meta.id == 'Tetsuden Kashima'
+    assert authors[1] == 'Brian Niiya'
+    # one request per doctype for all pages
+    requests.clear()
+    related = Page.sources_authors(FakeDocstore(), pages)
+    assert requests == [
+        ('encycsource', ['en-a-1', 'en-missing', 'en-b-1']),
+        ('encycauthor', ['Tetsuden Kashima', 'Brian Niiya']),
+    ]
+    assert [s.meta.id for s in related['B']['sources']] == ['en-b-1', 'en-a-1']
+    assert [a.meta.id for a in related['B']['authors']] == ['Tetsuden Kashima']
+
+def test_TopicsIndex(monkeypatch):
+    monkeypatch.setattr(elastic.config, 'DDR_TOPICS_BASE', 'http://ddr/topics')
+    monkeypatch.setattr(elastic.urls, 'reverse', lambda name,args: '/%s' % args[0])
+    doc = {'_version': 1, '_source': {'terms': [
+        {'id': 1, 'title': 'Camps', '_title': 'Camps', 'encyc_urls': ['/Manzanar', '/Tule_Lake']},
+        {'id': 2, 'title': 'Art', '_title': 'Art', 'encyc_urls': ['/Manzanar']},
+    ]}}
+    gets = []
+    class FakeES():
+        def get(self, index, id, source=None):
+            gets.append(source)
+            return doc
+    docstore = FakeDocstore()
+    docstore.es = FakeES()
+    index = elastic.TopicsIndex()
+    monkeypatch.setattr(elastic, '_topics_index', index)
+    terms = Page(title='Manzanar').topics(docstore)
+    assert [t['id'] for t in terms] == [1, 2]
+    assert terms[0]['ddr_topic_url'] == 'http://ddr/topics/1/'
+    assert 'encyc_urls' not in terms[0]
+    assert gets == [False, None]
+    terms[0]['objects'] = []  # callers' changes don't leak
+    assert Page(title='Tule_Lake').topics(docstore) == [{
+        'id': 1, 'title': 'Camps', '_title': 'Camps',
+        'ddr_topic_url': 'http://ddr/topics/1/',
+    }]
+    assert gets == [False, None]
+    # unchanged version: not reloaded
+    assert index.refresh(docstore, force=True) == False
+    assert gets == [False, None, False]
+    doc['_version'] = 2
+    doc['_source']['terms'].pop()
+    assert index.refresh(docstore, force=True) == True
+    assert [t['id'] for t in Page(title='Manzanar').topics(docstore)] == [1]
+    # alias swapped to a new version index with the same _version
+    doc['_index'] = 'encycvocab-v2'
+    doc['_source']['terms'].append(
+        {'id': 3, 'title': 'Food', '_title': 'Food', 'encyc_urls': ['/Manzanar']}
+    )
+    assert index.refresh(docstore, force=True) == True
+    assert [t['id'] for t in Page(title='Manzanar').topics(docstore)] == [1, 3]
+    # another docstore is checked right away
+    other = FakeDocstore()
+    other.es = FakeES()
+    other.index_name = lambda doctype: 'other' + doctype
+    del gets[:]
+    doc['_source']['terms'].pop()
+    assert [t['id'] for t in Page(title='Manzanar').topics(other)] == [1]
+    assert gets == [False, None]
+    assert index.index == 'othervocab'
+
+def test_TopicsIndex_rewritten(monkeypatch):
+    # vocab document rewritten between the version check and the full GET
+    monkeypatch.setattr(elastic.config, 'DDR_TOPICS_BASE', 'http://ddr/topics')
+    docs = [
+        {'_version': 2, '_index': 'encycvocab-v1', '_source': {'terms': []}},
+        {'_version': 3, '_index': 'encycvocab-v1', '_source': {'terms': [
+            {'id': 1, 'title': 'Camps', '_title': 'Camps', 'encyc_urls': ['/Manzanar']},
+        ]}},
+    ]
+    class FakeES():
+        def get(self, index, id, source=None):
+            return docs[0] if source is False else docs[1]
+    docstore = FakeDocstore()
+    docstore.es = FakeES()
+    index = elastic.TopicsIndex()
+    assert index.refresh(docstore) == True
+    assert index.version == 3
+    assert [t['id'] for t in index.terms(docstore, '/Manzanar')] == [1]
+    docs[0] = docs[1]
+    assert index.refresh(docstore, force=True) == False
+
+def test_Facet_from_json():
+    rawjson = json.dumps({
+        'id': 'facility', 'title': 'Facility', 'description': '',
+        'terms': [{
+            'id': 1, 'title': 'Manzanar', 'type': 'Concentration Camp',
+            'location': {}, 'elinks': [
+                {'label': 'Manzanar', 'url': 'http://encyclopedia.densho.org/Manzanar/'}
+            ],
+        }],
+    }).encode('utf-8')
+    facet = elastic.Facet.from_json('facility', rawjson)
+    assert facet.meta.id == 'facility'
+    assert facet.source_hash == elastic.Facet.source_hash_of(rawjson)
+    assert [term.meta.id for term in facet.terms] == ['facility-1']
+    assert facet.terms[0].encyc_urls[0]['url_title'] == 'Manzanar'
+    assert elastic.Facet.from_json(
+        'facility', rawjson.replace(b'Manzanar', b'Amache')
+    ).source_hash != facet.source_hash
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from bs4 import BeautifulSoup
 from deepdiff import DeepDiff
 import pytest
@@ -40,6 +42,26 @@ def test_lastmod_data_url():
 
 #def test_page_lastmod():
 
+class FakeResponse():
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+    def json(self):
+        return self.data
+
+def test_revision_from_response():
+    r = FakeResponse(200, {'query': {'pages': {'123': {
+        'pageid': 123, 'title': 'Sansei',
+        'revisions': [{'revid': 4567, 'parentid': 4566, 'timestamp': '2020-01-02T03:04:05Z'}],
+    }}}})
+    assert helpers.revision_from_response(r) == {
+        'pageid': 123, 'revid': 4567, 'timestamp': datetime(2020,1,2,3,4,5),
+    }
+    assert helpers.lastmod_from_response(r) == datetime(2020,1,2,3,4,5)
+    r = FakeResponse(200, {'query': {'pages': {'-1': {'title': 'Nope', 'missing': ''}}}})
+    assert helpers.revision_from_response(r) == None
+    assert helpers.revision_from_response(FakeResponse(500, {})) == None
+
 def test_extract_encyclopedia_id():
     in0 = 'en-denshopd-i37-00239-1.jpg'
     in1 = '/mediawiki/images/thumb/a/a1/en-denshopd-i37-00239-1.jpg/200px-en-denshopd-i37-00239-1.jpg'
@@ -118,3 +118,56 @@ def test_Proxy_sources_all():
 #Proxy.citation
 
 #Contents
+
+class FakeESPage():
+    url_title = 'Amache'
+    modified = datetime(2020,1,1)
+    source_ids = ['en-denshopd-i37-00239-1']
+    categories = ['Camps']
+    prev_page = 'Ainu'
+    next_page = 'Angel Island'
+
+def test_Page_rerender():
+    rawtext = json.dumps({'parse': {
+        'title': 'Amache', 'displaytitle': 'Amache', 'pageid': 7, 'revid': 70,
+        'properties': [{'name': 'defaultsort', '*': 'Amache (Granada)'}],
+        'categories': [{'*': 'Published'}, {'*': 'Camps'}], 'images': [],
+        'text': {'*': '<div class="mw-parser-output"><p>Amache was a camp.</p></div>'},
+    }})
+    page = legacy.Page.rerender(rawtext, FakeESPage())
+    assert page.title == 'Amache'
+    assert page.title_sort == 'amachegranada'
+    assert page.published == True
+    assert page.lastmod == datetime(2020,1,1)
+    assert page.sources == [{'encyclopedia_id': 'en-denshopd-i37-00239-1'}]
+    assert page.categories == ['Camps']
+    assert page.next_page == 'Angel Island'
+    assert 'Amache was a camp.' in page.body
+
+class FakeResponse():
+    def __init__(self, data):
+        self.status_code = 200
+        self.text = json.dumps(data)
+    def json(self):
+        return json.loads(self.text)
+
+def test_Page_fetch_pagecache(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'PAGEDATA_CACHE_DIR', str(tmpdir))
+    monkeypatch.setattr(config, 'MEDIAWIKI_API', 'http://mw/api.php')
+    pagedata = {'parse': {'pageid': 7, 'revid': 70, 'images': []}}
+    lastmod = {'query': {'pages': {'7': {'pageid': 7, 'revisions': [
+        {'revid': 70, 'timestamp': '2020-01-01T00:00:00Z'}
+    ]}}}}
+    requests = []
+    async def aget(url, **kwargs):
+        requests.append('revisions' if 'prop=revisions' in url else 'parse')
+        return FakeResponse(lastmod if 'prop=revisions' in url else pagedata)
+    monkeypatch.setattr(legacy.http, 'aget', aget)
+    fetched = legacy.Page.fetch('Amache')
+    assert requests == ['revisions', 'parse']
+    assert json.loads(fetched['rawtext']) == pagedata
+    assert fetched['sources'] == []
+    # cached revision: page data is not requested again
+    requests.clear()
+    assert legacy.Page.fetch('Amache')['rawtext'] == fetched['rawtext']
+    assert requests == ['revisions']
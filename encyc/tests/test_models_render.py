@@ -0,0 +1,73 @@
+import json
+import signal
+import threading
+import time
+
+import pytest
+
+from encyc.models import render
+from encyc.models import wikipage
+
+RENDER_in0 = """<div class="mw-parser-output">
+<div id="databox-Camps" style="display:none;">
+<p>SoSUID: w-amache;
+</p>
+</div>
+<p>The <a href="/Amache">Granada Relocation Center</a>, commonly known as Amache.</p>
+<h2><span class="mw-headline" id="History">History</span></h2>
+<p>Some history here.</p>
+</div>"""
+
+def test_RenderPool_render():
+    pagedata = {'parse': {'text': {'*': RENDER_in0}}}
+    expected = wikipage.render_page(
+        'Amache', pagedata, [], {'databox-Camps': ''},
+        hidden_tags=[], rg_titles=['Amache'],
+    )
+    with render.RenderPool(
+            processes=1, timeout=30, maxtasks=1,
+            hidden_tags=[], rg_titles=['Amache']) as pool:
+        # maxtasks=1 so the second page is rendered by a new worker
+        for n in range(2):
+            out = pool.render(
+                'Amache', json.dumps(pagedata), [], {'databox-Camps': ''}
+            )
+            assert out == expected
+
+def _slow_render_page(url_title, pagedata, *args, **kwargs):
+    if pagedata.get('stuck'):
+        # does not respond to the timeout
+        signal.signal(signal.SIGALRM, signal.SIG_IGN)
+    time.sleep(pagedata['sleep'])
+    return {'title': url_title}
+
+def test_RenderPool_timeout(monkeypatch):
+    monkeypatch.setattr(wikipage, 'render_page', _slow_render_page)
+    monkeypatch.setattr(render, 'TIMEOUT_GRACE', 0.5)
+    # maxtasks=0 so workers are forked (and see the patched render_page)
+    with render.RenderPool(processes=1, timeout=1, maxtasks=0, hidden_tags=[]) as pool:
+        # a page that takes too long is interrupted in its worker
+        with pytest.raises(render.RenderTimeout):
+            pool.render('Slow', json.dumps({'sleep': 5}), [])
+        # pages waiting for the worker are not timed while they wait:
+        # 3 x 0.6s is more than timeout + TIMEOUT_GRACE
+        results = []
+        def render_one(n):
+            results.append(pool.render('Page%s' % n, json.dumps({'sleep': 0.6}), []))
+        threads = [threading.Thread(target=render_one, args=(n,)) for n in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sorted(r['title'] for r in results) == ['Page0', 'Page1', 'Page2']
+
+def test_RenderPool_restart(monkeypatch):
+    monkeypatch.setattr(wikipage, 'render_page', _slow_render_page)
+    monkeypatch.setattr(render, 'TIMEOUT_GRACE', 0.5)
+    with render.RenderPool(processes=1, timeout=1, maxtasks=0, hidden_tags=[]) as pool:
+        executor = pool._executor
+        with pytest.raises(render.RenderTimeout):
+            pool.render('Stuck', json.dumps({'sleep': 3, 'stuck': True}), [])
+        # the pool is rebuilt and keeps working
+        assert pool._executor is not executor
+        assert pool.render('Page', json.dumps({'sleep': 0}), []) == {'title': 'Page'}
@@ -0,0 +1,104 @@
+import json
+
+from encyc.models import helpers
+from encyc.models import mirror
+from encyc.models import sources
+
+
+class FakeResponse():
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.text = json.dumps(data)
+
+def fake_psms(known):
+    """Returns (get_many, calls): responds with the known sources in each URL"""
+    calls = []
+    def get_many(urls, **kwargs):
+        responses = []
+        for url in urls:
+            calls.append(url)
+            eids = url.split('/sources/')[1].split(',')
+            responses.append(FakeResponse(200, [
+                {'encyclopedia_id': eid.lower()} for eid in eids if eid.lower() in known
+            ]))
+        return responses
+    return get_many,calls
+
+def test_primary_sources_urls():
+    eids = ['en-denshopd-i37-%05d-1' % n for n in range(200)]
+    urls = helpers.primary_sources_urls('http://psms/api/2.0', eids, max_url=500)
+    assert len(urls) > 1
+    assert max([len(url) for url in urls]) <= 500
+    assert ','.join(
+        [url.split('/sources/')[1] for url in urls]
+    ) == ','.join(eids)
+    assert helpers.primary_sources_urls('http://psms/api/2.0', []) == []
+
+def test_SourceResolver(monkeypatch):
+    known = ['en-denshopd-i37-00239-1', 'en-denshopd-i35-00049-1']
+    get_many,calls = fake_psms(known)
+    monkeypatch.setattr(sources.http, 'get_many', get_many)
+    monkeypatch.setattr(sources.http, 'get', lambda url: get_many([url])[0])
+    monkeypatch.setattr(sources, 'get_mirror', lambda: mirror.SourceMirror(path=''))
+    resolver = sources.SourceResolver(api_url='http://psms/api/2.0')
+    resolver.prefetch([
+        'En-denshopd-i37-00239-1', 'Map.png', 'En-denshopd-i35-00049-1',
+        'En-denshopd-i37-00239-1',
+    ])
+    assert len(calls) == 1
+    assert len(resolver) == 2
+    # each page gets its own subset; nothing new is requested
+    assert resolver.resolve(['En-denshopd-i35-00049-1', 'Map.png']) == [
+        {'encyclopedia_id': 'en-denshopd-i35-00049-1'}
+    ]
+    assert len(calls) == 1
+    # misses are fetched
+    assert resolver.resolve(['Other.jpg']) == []
+    assert len(calls) == 2
+
+def test_SourceResolver_mirror(monkeypatch):
+    get_many,calls = fake_psms(['en-denshopd-i37-00239-1', 'en-denshopd-i35-00049-1'])
+    monkeypatch.setattr(sources.http, 'get_many', get_many)
+    local = mirror.SourceMirror(path='')
+    local.update([{'encyclopedia_id': 'en-denshopd-i37-00239-1', 'caption': 'mirrored'}])
+    monkeypatch.setattr(sources, 'get_mirror', lambda: local)
+    resolver = sources.SourceResolver(api_url='http://psms/api/2.0')
+    resolver.prefetch(['En-denshopd-i37-00239-1', 'En-denshopd-i35-00049-1'])
+    # only the source not in the mirror is requested...
+    assert calls == ['http://psms/api/2.0/sources/En-denshopd-i35-00049-1']
+    assert resolver.resolve(['En-denshopd-i37-00239-1']) == [
+        {'encyclopedia_id': 'en-denshopd-i37-00239-1', 'caption': 'mirrored'}
+    ]
+    # ...and is then added to the mirror
+    assert local.get('en-denshopd-i35-00049-1')
+
+def test_SourceMirror(tmp_path):
+    path = str(tmp_path / 'sources.json')
+    m = mirror.SourceMirror(path=path)
+    counts = m.update([
+        {'encyclopedia_id': 'a', 'modified': '2020-01-01T00:00:00', 'caption': 'A'},
+        {'encyclopedia_id': 'b', 'modified': '2020-01-01T00:00:00', 'caption': 'B'},
+    ], complete=True)
+    assert counts == {'added': 2, 'changed': 0, 'removed': 0}
+    assert m.save() == True
+    m = mirror.SourceMirror(path=path).load()
+    assert len(m) == 2
+    # can't write: logged, not raised
+    open(str(tmp_path / 'file'), 'w').close()
+    assert mirror.SourceMirror(path=str(tmp_path / 'file' / 'sources.json')).save() == False
+    assert m.modified == '2020-01-01T00:00:00'
+    counts = m.update([
+        {'encyclopedia_id': 'a', 'modified': '2020-01-01T00:00:00', 'caption': 'A'},
+        {'encyclopedia_id': 'B', 'modified': '2021-01-01T00:00:00', 'caption': 'B2'},
+        {'encyclopedia_id': 'c', 'modified': '2019-01-01T00:00:00', 'caption': 'C'},
+    ], complete=True)
+    assert counts == {'added': 1, 'changed': 1, 'removed': 0}
+    assert m.get('b')['caption'] == 'B2'
+    assert m.modified == '2021-01-01T00:00:00'
+    counts = m.update([
+        {'encyclopedia_id': 'a', 'modified': '2020-01-01T00:00:00', 'caption': 'A'},
+    ], complete=True)
+    assert counts == {'added': 0, 'changed': 0, 'removed': 2}
+    found,missing = m.lookup(['A', 'b', 'A'])
+    assert [s['caption'] for s in found] == ['A']
+    assert missing == ['b']
@@ -2,6 +2,7 @@ from bs4 import BeautifulSoup
 from deepdiff import DeepDiff
 import pytest
 
+from encyc.models import helpers
 from encyc.models import wikipage
 
 
@@ -242,3 +243,76 @@ def test_rm_tags():
 #def test_extract_databoxes():
 #def test_extract_description():
 #def test_not_published_encyc():
+
+RENDER_PAGE_in0 = """<div class="mw-parser-output"><div id="authorByline"><b>Authored by <a href="/Brian_Niiya" title="Brian Niiya">Brian Niiya</a></b></div>
+<div id="citationAuthor" style="display:none;">Niiya, Brian</div>
+<div id="databox-Camps" style="display:none;">
+<p>SoSUID: w-amache;
+GISLat: 38.0500;
+GISLng: -102.3000;
+</p>
+</div>
+<p>The <b>Granada Relocation Center</b>, commonly known as <a href="/Amache">Amache</a>, was one of ten camps.
+</p>
+<div class="nopublish-encycfront"><p>RG only</p></div>
+<h2><span class="mw-headline" id="History">History</span></h2>
+<p>Some history here.</p>
+</div>"""
+
+def test_render_page():
+    pagedata = {'parse': {'text': {'*': RENDER_PAGE_in0}}}
+    out = wikipage.render_page(
+        'Amache', pagedata, [], {'databox-Camps': ''}, hidden_tags=[],
+    )
+    assert out['databoxes']['databox-Camps']['gislat'] == ['38.0500']
+    assert out['published_encyc'] == False
+    assert out['published_rg'] == False
+    assert 'RG only' not in out['body']
+    assert out['description'].startswith('The')
+    assert out['coordinates'] == (-102.3, 38.05)
+    assert out['authors'] == {'display': ['Brian Niiya'], 'parsed': [['Niiya', 'Brian']]}
+
+def test_render_page_single_parse():
+    # render_page parses once; results must match the separate str functions
+    html = RENDER_PAGE_in0
+    pagedata = {'parse': {'text': {'*': html}}}
+    out = wikipage.render_page('Amache', pagedata, [], {}, hidden_tags=[])
+    body = wikipage.parse_mediawiki_text('Amache', html, [], hidden_tags=[])
+    assert out['body'] == body
+    assert out['description'] == wikipage.extract_description(body)
+    assert out['databoxes'] == wikipage.extract_databoxes(html, {})
+    assert out['authors'] == helpers.find_author_info(html)
+
+def test_render_page_empty_paragraphs():
+    # empty paragraphs are removed from the body, not from the extractors' input
+    html = RENDER_PAGE_in0.replace('<h2>', '<p><br />\n</p>\n<h2>')
+    assert '<br/>' in str(helpers.make_soup(html))
+    pagedata = {'parse': {'text': {'*': html}}}
+    out = wikipage.render_page('Amache', pagedata, [], {}, hidden_tags=[])
+    assert '<br' not in out['body']
+    assert out['body'] == wikipage.parse_mediawiki_text('Amache', html, [], hidden_tags=[])
+    out = wikipage.render_page('Amache', pagedata, [], {}, hidden_tags=[], parser='lxml')
+    assert '<br' not in out['body']
+
+def test_extract_description_soup():
+    html = '<div><p>Deep <i>nested</i> <a href="/mediawiki/index.php/Foo">link</a> &amp; stuff</p></div>'
+    soup = helpers.make_soup(html)
+    body = wikipage.soup_to_html(helpers.make_soup(html))
+    assert wikipage.extract_description(soup) == wikipage.extract_description(body)
+
+def test_render_page_lxml():
+    pagedata = {'parse': {'text': {'*': RENDER_PAGE_in0}}}
+    expected = wikipage.render_page('Amache', pagedata, [], {}, hidden_tags=[], parser='html.parser')
+    out = wikipage.render_page('Amache', pagedata, [], {}, hidden_tags=[], parser='lxml')
+    assert out == expected
+    out = wikipage.render_page('Amache', pagedata, [], {}, hidden_tags=[], parser='lxml-verify')
+    assert out == expected
+
+def test_render_page_lxml_verify_fallback():
+    # unclosed <p>: lxml closes it, html.parser nests the next one inside it
+    pagedata = {'parse': {'text': {'*': '<p>first<p>second</div>'}}}
+    expected = wikipage.render_page('Test', pagedata, [], {}, hidden_tags=[], parser='html.parser')
+    lxml_out = wikipage.render_page('Test', pagedata, [], {}, hidden_tags=[], parser='lxml')
+    assert lxml_out != expected
+    out = wikipage.render_page('Test', pagedata, [], {}, hidden_tags=[], parser='lxml-verify')
+    assert out == expected
@@ -0,0 +1,46 @@
+import json
+import os
+
+from encyc import pagecache
+
+
+def pagedata(pageid, revid, text='<p>Sansei</p>'):
+    return json.dumps({'parse': {
+        'title': 'Sansei', 'pageid': pageid, 'revid': revid, 'text': {'*': text},
+    }})
+
+def test_put_get(tmp_path):
+    cache_dir = str(tmp_path)
+    assert pagecache.get(123, 1, cache_dir) == None
+    rawtext = pagedata(123, 1)
+    path = pagecache.put(rawtext, cache_dir)
+    assert path == os.path.join(cache_dir, '123', '1.json')
+    assert pagecache.get(123, 1, cache_dir) == rawtext
+    # new revision replaces the old one
+    pagecache.put(pagedata(123, 2), cache_dir)
+    assert pagecache.get(123, 1, cache_dir) == None
+    assert pagecache.get(123, 2, cache_dir) == pagedata(123, 2)
+    # errors are not cached
+    error = json.dumps({'error': {'code': 'missingtitle'}})
+    assert pagecache.put(error, cache_dir) == None
+    assert list(pagecache.paths(cache_dir)) == [os.path.join(cache_dir, '123', '2.json')]
+
+def test_put_unwritable(tmp_path):
+    # a file where the cache directory should be
+    cache_dir = str(tmp_path / 'pagedata')
+    open(cache_dir, 'w').close()
+    assert pagecache.put(pagedata(123, 1), cache_dir) == None
+    assert pagecache.get(123, 1, cache_dir) == None
+
+def test_evict(tmp_path):
+    cache_dir = str(tmp_path)
+    for pageid in [1, 2, 3]:
+        path = pagecache.put(pagedata(pageid, 10, text='x' * 1000), cache_dir)
+        os.utime(path, (pageid * 1000, pageid * 1000))
+    # reading marks page 1 as recently used
+    pagecache.get(1, 10, cache_dir)
+    size = os.path.getsize(path)
+    assert pagecache.evict(size * 2, cache_dir) == 1
+    assert pagecache.get(2, 10, cache_dir) == None
+    assert pagecache.get(1, 10, cache_dir)
+    assert pagecache.get(3, 10, cache_dir)
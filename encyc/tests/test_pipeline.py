@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from encyc import pipeline
+
+
+def _double(n):
+    return n * 2
+
+def _reject_six(n):
+    if n == 6:
+        raise ValueError('bad item')
+    return n
+
+def test_run_serial():
+    stages = [
+        pipeline.Stage('double', _double),
+        pipeline.Stage('check', _reject_six),
+    ]
+    jobs = list(pipeline.run(range(5), stages, serial=True))
+    assert [job.item for job in jobs] == [0, 1, 2, 3, 4]
+    assert [job.data for job in jobs if not job.error] == [0, 2, 4, 8]
+    failed = [job for job in jobs if job.error]
+    assert len(failed) == 1
+    assert failed[0].item == 3
+    assert failed[0].stage == 'check'
+    assert isinstance(failed[0].error, ValueError)
+
+def test_run_threaded():
+    stages = [
+        pipeline.Stage('double', _double, workers=4),
+        pipeline.Stage('check', _reject_six, workers=2),
+    ]
+    jobs = list(pipeline.run(range(100), stages))
+    assert sorted(job.item for job in jobs) == list(range(100))
+    ok = sorted(job.data for job in jobs if not job.error)
+    assert ok == [n * 2 for n in range(100) if n != 3]
+    assert [job.item for job in jobs if job.error] == [3]
+
+def test_run_failed_jobs_skip_later_stages():
+    seen = []
+    def record(n):
+        seen.append(n)
+        return n
+    stages = [
+        pipeline.Stage('check', _reject_six, workers=2),
+        pipeline.Stage('record', record, workers=2),
+    ]
+    jobs = list(pipeline.run([2, 6, 8], stages))
+    assert len(jobs) == 3
+    assert sorted(seen) == [2, 8]
+
+def test_run_backpressure():
+    # a slow last stage must keep the first stage from running ahead
+    started = []
+    lock = threading.Lock()
+    def fast(n):
+        with lock:
+            started.append(n)
+        return n
+    def slow(n):
+        time.sleep(0.01)
+        return n
+    stages = [
+        pipeline.Stage('fast', fast, workers=1, maxsize=1),
+        pipeline.Stage('slow', slow, workers=1, maxsize=1),
+    ]
+    jobs = pipeline.run(range(50), stages)
+    next(jobs)
+    time.sleep(0.05)
+    with lock:
+        num_started = len(started)
+    assert num_started < 10
+    assert len(list(jobs)) == 49
+
+def test_run_feeder_error():
+    def items():
+        yield 1
+        raise RuntimeError('listing failed')
+    stages = [pipeline.Stage('double', _double)]
+    with pytest.raises(RuntimeError):
+        list(pipeline.run(items(), stages))
+
+def test_run_async_stage():
+    in_flight = [0, 0]
+    async def adouble(n):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        await asyncio.sleep(0.001)
+        in_flight[0] -= 1
+        return n * 2
+    stages = [
+        pipeline.AsyncStage('double', adouble, concurrency=4),
+        pipeline.Stage('check', _reject_six, workers=2),
+    ]
+    jobs = list(pipeline.run(range(40), stages))
+    assert sorted(job.item for job in jobs) == list(range(40))
+    assert [job.item for job in jobs if job.error] == [3]
+    # jobs overlap on the stage's event loop, up to concurrency
+    assert 1 < in_flight[1] <= 4
+    jobs = list(pipeline.run(range(5), stages, serial=True))
+    assert [job.data for job in jobs if not job.error] == [0, 2, 4, 8]
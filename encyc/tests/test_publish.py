@@ -0,0 +1,247 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+
+from encyc import config
+from encyc import publish
+from encyc import state
+from encyc.models.elastic import Author, Page, content_hash
+
+
+DOCTYPES = ['author', 'article', 'source', 'facet', 'facetterm']
+
+
+class FakeWriter():
+    def __init__(self, ds):
+        self.ds = ds
+    def index(self, doctype, document):
+        index = self.ds.index_name(doctype)
+        self.ds.indices.setdefault(index, []).append(document.meta.id)
+    def close(self):
+        pass
+
+
+class FakeDocstore():
+    host = 'localhost:9200'
+    suffix = ''
+    def __init__(self, indices, versions=None):
+        # index name: list of document IDs
+        self.indices = indices
+        # version: doctypes
+        self.versions = versions if versions is not None else {6: DOCTYPES}
+        self.swapped = []
+    def index_name(self, doctype):
+        return 'encyc' + doctype + self.suffix
+    def versioned(self, version):
+        ds = FakeDocstore(self.indices, self.versions)
+        ds.suffix = '-v%s' % version
+        ds.swapped = self.swapped
+        return ds
+    def index_versions(self):
+        return self.versions, {d: max(self.versions) for d in DOCTYPES}
+    def create_versioned_indices(self, version):
+        self.versions[version] = DOCTYPES
+        return [self.versioned(version).index_name(d) for d in DOCTYPES]
+    @contextmanager
+    def rebuilding(self, doctypes):
+        yield self
+    def bulk_writer(self, callback=None):
+        return FakeWriter(self)
+    def swap_aliases(self, version, migrate=False):
+        # counts at the time of the swap
+        self.swapped.append((version, {
+            index: len(ids) for index,ids in self.indices.items()
+        }))
+        return []
+
+
+def _fake_count(ds, doctype):
+    return len(ds.indices.get(ds.index_name(doctype), []))
+
+def _fake_job(doctype, ids, calls=None):
+    def job(ds, **kwargs):
+        if calls is not None:
+            calls.append(kwargs)
+        for i in ids:
+            ds.indices.setdefault(ds.index_name(doctype), []).append(i)
+    return job
+
+class FakeMW():
+    def current_timestamp(self):
+        return datetime(2020,1,1)
+
+def test_authors_force_empty_index(tmpdir, monkeypatch):
+    # force takes titles from MediaWiki, not from the (empty) index
+    monkeypatch.setattr(config, 'PUBLISH_STATE_DIR', str(tmpdir))
+    monkeypatch.setattr(config, 'PAGEDATA_CACHE_DIR', '')
+    monkeypatch.setattr(publish.wiki, 'MediaWiki', FakeMW)
+    monkeypatch.setattr(publish.Proxy, 'authors',
+                        staticmethod(lambda mw, cached_ok=True: ['Brian Niiya']))
+    monkeypatch.setattr(publish.Proxy, 'articles_lastmod', staticmethod(lambda mw: [
+        {'title': 'Brian Niiya', 'lastmod': datetime(2020,1,1)},
+        {'title': 'Manzanar', 'lastmod': datetime(2020,1,1)},
+    ]))
+    monkeypatch.setattr(publish.Author, 'count', staticmethod(lambda ds: 0))
+    monkeypatch.setattr(publish.Author, 'iter_authors',
+                        staticmethod(lambda ds, fields=None: iter([])))
+    monkeypatch.setattr(publish, 'content_hashes', lambda ds, doctype, model: {})
+    monkeypatch.setattr(publish.LegacyPage, 'get',
+                        staticmethod(lambda mw, title, parser=None: title))
+    monkeypatch.setattr(publish.Author, 'from_mw', staticmethod(
+        lambda mwauthor, author=None: Author(
+            meta={'id': mwauthor}, title=mwauthor, content_hash='x'
+        )
+    ))
+    ds = FakeDocstore({}).versioned(7)
+    publish.authors(ds, force=True)
+    assert ds.indices == {'encycauthor-v7': ['Brian Niiya']}
+
+def test_reindex(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'PUBLISH_STATE_DIR', str(tmpdir))
+    monkeypatch.setattr(publish.wiki, 'MediaWiki', FakeMW)
+    monkeypatch.setattr(publish, 'count_index', _fake_count)
+    calls = []
+    monkeypatch.setattr(publish, 'sources', _fake_job('source', ['en-a-1']))
+    monkeypatch.setattr(publish, 'authors', _fake_job('author', ['Brian Niiya'], calls))
+    monkeypatch.setattr(publish, 'articles', _fake_job('article', ['A', 'B'], calls))
+    # live mark moved on by incremental runs while the build ran
+    state.write_mark('articles', datetime(2020,1,2))
+    ds = FakeDocstore({
+        'encycauthor': ['Brian Niiya'], 'encycarticle': ['A', 'B'],
+        'encycsource': ['en-a-1'], 'encycfacet': ['topics'],
+    })
+    def vocabs(ds, **kwargs):
+        _fake_job('facet', ['topics'])(ds)
+        _fake_job('facetterm', ['topics-1'])(ds)
+    monkeypatch.setattr(publish, 'vocabs', vocabs)
+    assert publish.reindex(ds) == 7
+    assert len(ds.swapped) == 1
+    version,counts = ds.swapped[0]
+    assert version == 7
+    assert counts['encycarticle-v7'] == 2
+    assert counts['encycauthor-v7'] == 1
+    assert counts['encycfacetterm-v7'] == 1
+    # jobs don't touch the live journals and marks
+    assert sorted(c['state_name'] for c in calls) == ['reindex-articles', 'reindex-authors']
+    # changes made during the build are replayed by the next incremental run
+    assert state.read_mark('articles') == datetime(2020,1,1)
+    assert state.read_mark('authors') == datetime(2020,1,1)
+
+def test_reindex_not_filled(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'PUBLISH_STATE_DIR', str(tmpdir))
+    monkeypatch.setattr(publish.wiki, 'MediaWiki', FakeMW)
+    monkeypatch.setattr(publish, 'count_index', _fake_count)
+    def vocabs(ds, **kwargs):
+        _fake_job('facet', ['topics'])(ds)
+        _fake_job('facetterm', ['topics-1'])(ds)
+    monkeypatch.setattr(publish, 'vocabs', vocabs)
+    monkeypatch.setattr(publish, 'sources', _fake_job('source', ['en-a-1']))
+    monkeypatch.setattr(publish, 'authors', _fake_job('author', ['Brian Niiya']))
+    # articles job publishes nothing, or much less than the live index
+    for new_articles in [[], ['A']]:
+        monkeypatch.setattr(publish, 'articles', _fake_job('article', new_articles))
+        ds = FakeDocstore({'encycarticle': ['A', 'B', 'C']})
+        publish.reindex(ds)
+        assert ds.swapped == []
+    assert state.read_mark('articles') is None
+
+def test_swap_version_migrate(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'PUBLISH_STATE_DIR', str(tmpdir))
+    state.write_mark('authors', datetime(2020,1,3))
+    state.write_mark('articles', datetime(2020,1,2))
+    ds = FakeDocstore({})
+    publish.swap_version(ds, 6, migrate=True)
+    assert ds.swapped[0][0] == 6
+    # rolling back to the original indices (v0) replays from the older mark
+    assert state.read_mark(publish.REINDEX_MARK % 0) == datetime(2020,1,2)
+    ds.versions[0] = DOCTYPES
+    publish.swap_version(ds, 0)
+    assert state.read_mark('articles') == datetime(2020,1,2)
+
+def test_article_index_modified():
+    class Writer():
+        def __init__(self):
+            self.calls = []
+        def index(self, doctype, document):
+            self.calls.append(('index', document.meta.id))
+        def update(self, doctype, document_id, fields):
+            self.calls.append(('update', document_id, fields))
+    page = Page(meta={'id': 'A'}, url_title='A', title='A', modified=datetime(2020,2,2))
+    page.content_hash = content_hash(page)
+    writer = Writer()
+    # same rendered content, new revision: only modified is written
+    hashes = {'A': (page.content_hash, datetime(2020,1,1))}
+    item = publish._article_index(writer, {'page': page}, hashes, dryrun=False)
+    assert item['unchanged']
+    assert writer.calls == [('update', 'A', {'modified': datetime(2020,2,2)})]
+    writer.calls.clear()
+    hashes = {'A': (page.content_hash, datetime(2020,2,2))}
+    publish._article_index(writer, {'page': page}, hashes, dryrun=False)
+    assert writer.calls == []
+    publish._article_index(writer, {'page': page}, {}, dryrun=False)
+    assert writer.calls == [('index', 'A')]
+
+def test_incremental_articles(monkeypatch):
+    def mget(ds, doctype, model, ids):
+        return {i: i for i in ids if i in ['Unpublished']}
+    monkeypatch.setattr(publish, 'mget', mget)
+    changes = {'updated': set(['A', 'Brian Niiya', 'Unpublished', 'Draft'])}
+    mw_articles = [{'title': 'A'}, {'title': 'B'}, {'title': 'Brian Niiya'}]
+    titles = publish._incremental_articles(None, changes, ['Brian Niiya'], mw_articles)
+    # removed from Category:Published but still live: goes to be unpublished
+    assert titles == ['A', 'Unpublished']
+
+def test_article_render_unpublished(monkeypatch):
+    class FakeMWPage():
+        published = False
+    monkeypatch.setattr(publish.LegacyPage, 'get', staticmethod(
+        lambda mw, title, **kwargs: FakeMWPage()
+    ))
+    deleted = []
+    class ExistingPage():
+        def delete(self, ds):
+            deleted.append(ds)
+    gets = []
+    def get(ds, title):
+        gets.append((ds, title))
+        return ExistingPage()
+    monkeypatch.setattr(publish.Page, 'get', staticmethod(get))
+    ds = FakeDocstore({})
+    item = publish._article_render(
+        ds, None, {'title': 'A', 'fetched': {}}, [], None, None, dryrun=False
+    )
+    assert gets == [(ds, 'A')]
+    assert deleted == [ds]
+    assert item['unpublished']
+
+def test_articles_pipeline_error(tmpdir, monkeypatch):
+    # writer and render pool are closed even if the pipeline raises
+    monkeypatch.setattr(config, 'PUBLISH_STATE_DIR', str(tmpdir))
+    monkeypatch.setattr(publish.wiki, 'MediaWiki', FakeMW)
+    monkeypatch.setattr(publish.Proxy, 'authors',
+                        staticmethod(lambda mw, cached_ok=True: []))
+    monkeypatch.setattr(publish.Proxy, 'articles_lastmod', staticmethod(lambda mw: [
+        {'title': 'A', 'lastmod': datetime(2020,1,1)},
+    ]))
+    monkeypatch.setattr(publish.Page, 'count', staticmethod(lambda ds: 0))
+    monkeypatch.setattr(publish.Page, 'rg_titles', staticmethod(lambda: frozenset(['A'])))
+    monkeypatch.setattr(publish, '_source_resolver', lambda mw, titles: publish.SourceResolver())
+    monkeypatch.setattr(publish, 'content_hashes', lambda ds, doctype, model: {})
+    closed = []
+    class Closing():
+        def __init__(self, name):
+            self.name = name
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            closed.append(self.name)
+    monkeypatch.setattr(publish, '_render_pool', lambda *args: Closing('render_pool'))
+    ds = FakeDocstore({})
+    ds.bulk_writer = lambda callback=None: Closing('writer')
+    def run(items, stages, serial=False):
+        raise RuntimeError('pipeline failed')
+    monkeypatch.setattr(publish.pipeline, 'run', run)
+    with pytest.raises(RuntimeError):
+        publish.articles(ds, force=True, render_processes=1)
+    assert closed == ['writer', 'render_pool']
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from encyc import state
+
+
+def test_mark(tmp_path):
+    state_dir = str(tmp_path / 'state')
+    assert state.read_mark('articles', state_dir) == None
+    state.write_mark('articles', datetime(2024,1,2,3,4,5), state_dir)
+    assert state.read_mark('articles', state_dir) == datetime(2024,1,2,3,4,5)
+    assert state.read_mark('authors', state_dir) == None
+
+def test_mark_bad(tmp_path):
+    (tmp_path / 'articles.json').write_text('{"timestamp": "yesterday"}')
+    assert state.read_mark('articles', str(tmp_path)) == None
+
+def test_journal(tmp_path):
+    state_dir = str(tmp_path)
+    journal = state.Journal('articles', run_id='run1', state_dir=state_dir)
+    journal.add('Sansei')
+    journal.add('Nisei')
+    journal.close()  # interrupted
+    # resume the last run
+    journal = state.Journal('articles', resume=True, state_dir=state_dir)
+    assert journal.resumed
+    assert journal.run_id == 'run1'
+    assert 'Sansei' in journal
+    assert 'Issei' not in journal
+    journal.add('Issei')
+    journal.finish()
+    # finished runs are not resumed
+    journal = state.Journal('articles', resume=True, state_dir=state_dir)
+    assert not journal.resumed
+    assert len(journal) == 0
+    journal.close()
+
+def test_journal_run_id(tmp_path):
+    state_dir = str(tmp_path)
+    journal = state.Journal('articles', run_id='run1', state_dir=state_dir)
+    journal.add('Sansei')
+    journal.close()
+    journal = state.Journal('articles', run_id='run2', resume=True, state_dir=state_dir)
+    assert not journal.resumed
+    assert 'Sansei' not in journal
+    journal.close()
+
+def test_journal_no_record(tmp_path):
+    state_dir = str(tmp_path)
+    journal = state.Journal('articles', run_id='run1', state_dir=state_dir)
+    journal.add('Sansei')
+    journal.close()
+    # e.g. --dryrun: reads the journal but does not write
+    journal = state.Journal('articles', resume=True, record=False, state_dir=state_dir)
+    journal.add('Nisei')
+    journal.finish()
+    journal = state.Journal('articles', resume=True, state_dir=state_dir)
+    assert journal.resumed
+    assert 'Sansei' in journal
+    assert 'Nisei' not in journal
+    journal.close()
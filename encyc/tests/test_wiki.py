@@ -110,3 +110,147 @@ def test_MediaWiki_published_authors(mediawiki_login):
     pages = mw.published_authors()
     for page in pages:
         assert isinstance(page.get('title',None), str)
+
+class FakeSite():
+    """Returns canned API results, one per call"""
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+    def api(self, action, **kwargs):
+        self.calls.append(dict(kwargs))
+        return self.results[len(self.calls) - 1]
+
+def test_MediaWiki_category_members():
+    mw = wiki.MediaWiki.__new__(wiki.MediaWiki)
+    mw.mw = FakeSite([
+        {
+            'continue': {'gcmcontinue': 'page|B|2', 'continue': 'gcmcontinue||'},
+            'query': {'pages': {
+                '1': {'pageid': 1, 'title': 'Sansei',
+                      'revisions': [{'timestamp': '2020-01-02T03:04:05Z'}]},
+            }},
+        },
+        {
+            'query': {'pages': {
+                '2': {'pageid': 2, 'title': 'Manzanar',
+                      'revisions': [{'timestamp': '2021-01-02T03:04:05Z'}]},
+            }},
+        },
+    ])
+    pages = mw._category_members('Published', prop='revisions', rvprop='timestamp')
+    assert [page['title'] for page in pages] == ['Manzanar', 'Sansei']
+    assert mw.mw.calls[0]['gcmtitle'] == 'Category:Published'
+    assert mw.mw.calls[1]['gcmcontinue'] == 'page|B|2'
+
+def test_MediaWiki_recent_changes():
+    mw = wiki.MediaWiki.__new__(wiki.MediaWiki)
+    mw.mw = FakeSite([
+        {
+            'curtimestamp': '2024-01-02T00:00:00Z',
+            'continue': {'rccontinue': '20240101|3', 'continue': '-||'},
+            'query': {'recentchanges': [
+                {'type': 'edit', 'ns': 0, 'title': 'Sansei'},
+                {'type': 'new', 'ns': 0, 'title': 'Nisei'},
+                {'type': 'categorize', 'ns': 14, 'title': 'Category:Published',
+                 'comment': '[[:Manzanar]] added to category'},
+            ]},
+        },
+        {
+            'curtimestamp': '2024-01-02T00:00:05Z',
+            'query': {'recentchanges': [
+                {'type': 'log', 'ns': 0, 'title': 'Nisei',
+                 'logtype': 'delete', 'logaction': 'delete'},
+                {'type': 'log', 'ns': 0, 'title': 'Issei',
+                 'logtype': 'move', 'logaction': 'move',
+                 'logparams': {'target_ns': 0, 'target_title': 'Issei (term)'}},
+            ]},
+        },
+    ])
+    changes = mw.recent_changes(datetime(2024,1,1))
+    assert changes['updated'] == {'Sansei', 'Manzanar', 'Issei (term)'}
+    assert changes['deleted'] == {'Nisei', 'Issei'}
+    assert changes['timestamp'] == datetime(2024,1,2)
+    assert mw.mw.calls[0]['rcstart'] == '2024-01-01T00:00:00Z'
+    assert mw.mw.calls[1]['rccontinue'] == '20240101|3'
+
+class FakeCache():
+    def __init__(self):
+        self.data = {}
+    def get(self, key):
+        return self.data.get(key)
+    def set(self, key, value, timeout):
+        self.data[key] = value
+
+def test_MediaWiki_articles_index(monkeypatch):
+    monkeypatch.setattr(wiki, 'cache', FakeCache())
+    mw = wiki.MediaWiki.__new__(wiki.MediaWiki)
+    mw._articles = None
+    mw._authors = None
+    mw.mw = FakeSite([
+        {'query': {'pages': {'9': {'pageid': 9, 'title': 'Brian Niiya'}}}},
+    ])
+    mw.published_pages = lambda: [
+        {'title': title} for title in ['Manzanar', 'Brian Niiya', 'Amache', 'Sansei']
+    ]
+    assert mw.articles_a_z() == ['Amache', 'Manzanar', 'Sansei']
+    assert mw.is_article('Manzanar')
+    assert mw.is_article('Brian Niiya')
+    assert not mw.is_article('Nope')
+    assert mw.article_next('Amache') == 'Manzanar'
+    assert mw.article_next('Sansei') == ''
+    assert mw.article_prev('Manzanar') == 'Amache'
+    assert mw.article_prev('Amache') == ''
+    assert mw.article_prev('Nope') == ''
+    assert 'wiki.articles-index' in wiki.cache.data
+
+def test_MediaWiki_is_author_cached():
+    mw = wiki.MediaWiki.__new__(wiki.MediaWiki)
+    mw._authors = None
+    mw.mw = FakeSite([
+        {'query': {'pages': {
+            '9': {'pageid': 9, 'title': 'Brian Niiya'},
+            '8': {'pageid': 8, 'title': 'Jane Doe'},
+        }}},
+    ])
+    assert mw.is_author('Brian Niiya')
+    assert not mw.is_author('Manzanar')
+    assert mw.is_author('Jane Doe')
+    # one listing for any number of titles
+    assert len(mw.mw.calls) == 1
+    assert mw.mw.calls[0]['gcmtitle'] == 'Category:Authors'
+
+def test_MediaWiki_page_images(monkeypatch):
+    monkeypatch.setattr(wiki, 'TITLES_PER_REQUEST', 2)
+    mw = wiki.MediaWiki.__new__(wiki.MediaWiki)
+    mw.mw = FakeSite([
+        {
+            'continue': {'imcontinue': '1|Map.png', 'continue': '||'},
+            'query': {'pages': {
+                '1': {'pageid': 1, 'title': 'Amache',
+                      'images': [{'ns': 6, 'title': 'File:En-denshopd-i37-00239-1.jpg'}]},
+                '2': {'pageid': 2, 'title': 'Sansei'},
+            }},
+        },
+        {
+            'query': {'pages': {
+                '1': {'pageid': 1, 'title': 'Amache',
+                      'images': [{'ns': 6, 'title': 'File:Amache map.png'}]},
+            }},
+        },
+        {
+            'query': {'pages': {
+                '3': {'pageid': 3, 'title': 'Tule Lake'},
+            }},
+        },
+    ])
+    assert mw.page_images(['Amache', 'Sansei', 'Tule Lake']) == {
+        'Amache': ['En-denshopd-i37-00239-1.jpg', 'Amache_map.png'],
+        'Sansei': [],
+        'Tule Lake': [],
+    }
+    # only the given titles, TITLES_PER_REQUEST at a time
+    assert [call['titles'] for call in mw.mw.calls] == [
+        'Amache|Sansei', 'Amache|Sansei', 'Tule Lake'
+    ]
+    assert mw.mw.calls[0]['prop'] == 'images'
+    assert mw.mw.calls[1]['imcontinue'] == '1|Map.png'
@@ -4,7 +4,6 @@ import logging
 logger = logging.getLogger(__name__)
 from operator import itemgetter
 import re
-from time import mktime
 from typing import List, Set, Dict, Tuple, Optional, Any
 from urllib.parse import urlparse
 
@@ -18,6 +17,14 @@ cache = config.CACHE
 
 NON_ARTICLE_PAGES = ['about', 'categories', 'contact', 'contents', 'search',]
 TIMEOUT = float(config.MEDIAWIKI_API_TIMEOUT)
+# namespaces listed by MediaWiki._category_members (i.e. not subcategories)
+CATEGORY_MEMBER_TYPES = 'page|file'
+# recentchanges: main and Category namespaces
+RECENTCHANGES_NAMESPACES = '0|14'
+# page title in a categorize entry's comment e.g. "[[:Sansei]] added to category"
+CATEGORIZE_TITLE = re.compile(r'\[\[:?([^\]|]+)')
+# max titles in one API query (see MediaWiki.page_images)
+TITLES_PER_REQUEST = 50
 
 
 # TODO encyc.cli
@@ -34,6 +41,9 @@ class MediaWiki():
 
     def __init__(self):
         self.mw = MediaWiki._login()
+        # see _articles_index, author_titles
+        self._articles = None
+        self._authors = None
 
     @staticmethod
     def _login():
@@ -70,40 +80,100 @@ class MediaWiki():
         logging.debug('done')
         return wiki
 
-    def articles_a_z(self) -> List[str]:
-        """List of published article titles arranged A-Z.
+    def _category_members(self, category: str, **kwargs) -> List[Dict[str,Any]]:
+        """All pages in a category, fetched 'max' (500) at a time.
+        
+        Uses the categorymembers generator so that page properties
+        (e.g. prop='revisions') come back in the same requests as the listing,
+        following API continuation until the listing is done.
+        Subcategories are not included.
+        
+        @param category: str Category name without the "Category:" prefix.
+        @param kwargs: Extra query params e.g. prop='revisions'.
+        @returns: list of page dicts from the API, sorted by title
         """
-        key = 'wiki.articles-a-z'
+        params = {
+            'generator': 'categorymembers',
+            'gcmtitle': f'Category:{category}',
+            'gcmtype': CATEGORY_MEMBER_TYPES,
+            'gcmlimit': 'max',
+        }
+        params.update(kwargs)
+        return self._query_pages(params)
+
+    def _query_pages(self, params: Dict[str,Any]) -> List[Dict[str,Any]]:
+        """Pages from a query, following API continuation until done.
+        
+        @param params: dict Query params e.g. titles='A|B', prop='images'.
+        @returns: list of page dicts from the API, sorted by title
+        """
+        params = dict(params, **{'continue': ''})
+        pages: Dict[str, Dict[str,Any]] = {}
+        while True:
+            result = self.mw.api('query', **params)
+            for pageid,page in result.get('query', {}).get('pages', {}).items():
+                # prop data for one page may be split across batches
+                if pageid in pages:
+                    for key,val in page.items():
+                        if isinstance(val, list):
+                            pages[pageid].setdefault(key, []).extend(val)
+                else:
+                    pages[pageid] = page
+            if 'continue' not in result:
+                break
+            params.update(result['continue'])
+        return sorted(pages.values(), key=lambda page: page['title'])
+
+    def _articles_index(self) -> Dict[str,Any]:
+        """Published titles and A-Z article list, with lookup tables.
+        
+        Built once per MediaWiki object (i.e. once per publish run) and
+        cached, so is_article, article_next, and article_prev are
+        dict/set lookups instead of scans of the whole list.
+        
+        @returns: dict {'published': set, 'a_z': list, 'positions': dict}
+        """
+        if self._articles:
+            return self._articles
+        key = 'wiki.articles-index'
         data = cache.get(key)
         if not data:
-            authors = [page.name for page in self.mw.categories['Authors']]
-            data = sorted([
-                page['title'] for page in self.published_pages()
-                if page['title'] not in authors
-            ])
+            authors = self.author_titles()
+            published = [page['title'] for page in self.published_pages()]
+            a_z = sorted([title for title in published if title not in authors])
+            data = {
+                'published': set(published),
+                'a_z': a_z,
+                'positions': {title: n for n,title in enumerate(a_z)},
+            }
             cache.set(key, data, config.CACHE_TIMEOUT)
+        self._articles = data
         return data
 
+    def articles_a_z(self) -> List[str]:
+        """List of published article titles arranged A-Z.
+        """
+        return self._articles_index()['a_z']
+
     # DONE encyc.models.legacy
     def article_next(self, title: str) -> str:
         """Title of the next article in the A-Z list.
         """
-        titles = self.articles_a_z()
-        try:
-            return titles[titles.index(title) + 1]
-        except:
-            pass
+        index = self._articles_index()
+        n = index['positions'].get(title)
+        if (n is not None) and (n + 1 < len(index['a_z'])):
+            return index['a_z'][n + 1]
         return ''
 
     # DONE encyc.models.legacy
     def article_prev(self, title: str) -> str:
         """Title of the previous article in the A-Z list.
         """
-        titles = self.articles_a_z()
-        try:
-            return titles[titles.index(title) - 1]
-        except:
-            pass
+        index = self._articles_index()
+        n = index['positions'].get(title)
+        # not for the first title (or a title not in the list)
+        if n:
+            return index['a_z'][n - 1]
         return ''
 
     # DONE encyc.models.legacy
@@ -130,12 +200,45 @@ class MediaWiki():
 
     # DONE encyc.models.legacy
     def is_article(self, title: str) -> bool:
-        return title in [page['title'] for page in self.published_pages()]
+        return title in self._articles_index()['published']
 
     # DONE encyc.models.legacy
     def is_author(self, title: str) -> bool:
-        page = self.mw.pages[title]
-        return 'Category:Authors' in [cat.name for cat in page.categories()]
+        return title in self.author_titles()
+
+    def author_titles(self) -> Set[str]:
+        """Titles of all pages in Category:Authors, published or not.
+        
+        Listed once per MediaWiki object (i.e. once per publish run) in a
+        single categorymembers listing, so is_author makes no API requests.
+        """
+        if self._authors is None:
+            self._authors = set([
+                page['title'] for page in self._category_members('Authors')
+            ])
+        return self._authors
+
+    def page_images(self, titles: List[str]) -> Dict[str,List[str]]:
+        """Images used in each page, TITLES_PER_REQUEST titles per request.
+        
+        Names are in the same form as action=parse "images" (no namespace,
+        underscores for spaces) for use with helpers.primary_source_ids.
+        
+        @param titles: list of str
+        @returns: dict {title: [image, ...]}
+        """
+        images = {}
+        for n in range(0, len(titles), TITLES_PER_REQUEST):
+            for page in self._query_pages({
+                'titles': '|'.join(titles[n:n+TITLES_PER_REQUEST]),
+                'prop': 'images',
+                'imlimit': 'max',
+            }):
+                images[page['title']] = [
+                    image['title'].split(':', 1)[-1].replace(' ', '_')
+                    for image in page.get('images', [])
+                ]
+        return images
 
     # DONE encyc.models.legacy
     def published_pages(self, cached_ok: bool=True) -> List[Dict[str,str]]:
@@ -144,21 +247,103 @@ class MediaWiki():
         key = 'wiki.published_pages'
         data = cache.get(key)
         if not data:
+            # In generator mode prop=revisions returns only the latest
+            # revision of each page.
             data = [
                 {
-                    'title': page.name,
-                    'timestamp': datetime.fromtimestamp(mktime(
-                        [r for r in page.revisions()][0]['timestamp'],
-                    ))
+                    'title': page['title'],
+                    'timestamp': datetime.strptime(
+                        page['revisions'][0]['timestamp'],
+                        config.MEDIAWIKI_DATETIME_FORMAT_TZ
+                    )
                     # see encyc.models.helpers.page_lastmod which is used by
                     # encyc.models.legacy.Page.get.
                 }
-                for page in self.mw.categories['Published']
-                if not isinstance(page, mwclient.listing.Category)
+                for page in self._category_members(
+                    'Published', prop='revisions', rvprop='timestamp'
+                )
+                if page.get('revisions')
             ]
             cache.set(key, data, config.CACHE_TIMEOUT)
         return data
 
+    def recent_changes(self, since: datetime) -> Dict[str,Any]:
+        """Titles changed since a timestamp, from the recentchanges feed.
+        
+        Edits, new pages, and category changes mark a title as updated.
+        Deleted pages and the old titles of moved pages are marked deleted;
+        the new titles of moved pages are marked updated.  Changes are
+        applied oldest first, so a page deleted and then re-created ends up
+        as updated.
+        
+        'timestamp' is the wiki's clock when the listing started: use it as
+        `since` for the next call.
+        
+        @param since: datetime (UTC)
+        @returns: dict {'updated': set, 'deleted': set, 'timestamp': datetime}
+        """
+        params = {
+            'list': 'recentchanges',
+            'rcstart': since.strftime(config.MEDIAWIKI_DATETIME_FORMAT_TZ),
+            'rcdir': 'newer',
+            'rcnamespace': RECENTCHANGES_NAMESPACES,
+            'rctype': 'edit|new|log|categorize',
+            'rcprop': 'title|timestamp|loginfo|comment',
+            'rclimit': 'max',
+            'curtimestamp': 1,
+            'continue': '',
+        }
+        updated = set()
+        deleted = set()
+        timestamp = None
+        def update(title):
+            updated.add(title)
+            deleted.discard(title)
+        def delete(title):
+            deleted.add(title)
+            updated.discard(title)
+        while True:
+            result = self.mw.api('query', **params)
+            if not timestamp:
+                timestamp = datetime.strptime(
+                    result['curtimestamp'], config.MEDIAWIKI_DATETIME_FORMAT_TZ
+                )
+            for rc in result.get('query', {}).get('recentchanges', []):
+                if rc['type'] in ['edit', 'new']:
+                    if rc['ns'] == 0:
+                        update(rc['title'])
+                elif rc['type'] == 'categorize':
+                    match = CATEGORIZE_TITLE.match(rc.get('comment', ''))
+                    if match:
+                        update(match.group(1))
+                elif (rc['type'] == 'log') and (rc['ns'] == 0):
+                    if rc.get('logtype') == 'delete':
+                        if rc.get('logaction') == 'restore':
+                            update(rc['title'])
+                        elif rc.get('logaction') == 'delete':
+                            delete(rc['title'])
+                    elif rc.get('logtype') == 'move':
+                        delete(rc['title'])
+                        target = rc.get('logparams', {}).get('target_title')
+                        if target:
+                            update(target)
+            if 'continue' not in result:
+                break
+            params.update(result['continue'])
+        return {
+            'updated': updated,
+            'deleted': deleted,
+            'timestamp': timestamp,
+        }
+
+    def current_timestamp(self) -> datetime:
+        """The wiki's clock (UTC), for use with recent_changes.
+        """
+        result = self.mw.api('query', curtimestamp=1)
+        return datetime.strptime(
+            result['curtimestamp'], config.MEDIAWIKI_DATETIME_FORMAT_TZ
+        )
+
     # DONE encyc.models.legacy
     def published_authors(self, cached_ok: bool=True) -> List[Dict[str,str]]:
         """List of *published* authors (pages), with timestamp of latest revision.
@@ -166,16 +351,15 @@ class MediaWiki():
         key = 'wiki.published_authors'
         data = cache.get(key)
         if not data:
-            published = [
-                page.name for page in self.mw.categories['Published']
-                if isinstance(page, mwclient.page.Page)
-            ]
+            published = set([
+                page['title'] for page in self._category_members('Published')
+            ])
             data = [
                 {
-                    'title': page.name,
+                    'title': title,
                 }
-                for page in self.mw.categories['Authors']
-                if page.name in published
+                for title in sorted(self.author_titles())
+                if title in published
             ]
             cache.set(key, data, config.CACHE_TIMEOUT)
         return data